@@ -0,0 +1,303 @@
+### Batch annotation of a whole recipe catalog
+### Runs the bot's parsers over every recipe in a JSON lines file (from recipeCrawler.py) with no
+### conversation at all, and writes each recipe's ingPredicates and instPredicates as a JSON line.
+### The work is spread over a pool of processes. Each worker loads the spaCy model and builds the
+### food matcher once, when it starts, and then takes recipes a chunk at a time: the whole chunk
+### goes through one nlp.pipe call and one ConceptNet prefetch before the parsers run on each
+### recipe. Output can stay in the input's order or be written as soon as each chunk is done.
+from recipeBot import RecipeBot
+from recipeState import Recipe
+from batchParse import parseRecipes, defaultBatchSize
+from conceptCache import ConceptCache
+from conceptIndex import ConceptIndex
+from termModel import loadTermModel, defaultConfidence
+from conceptPrefetch import defaultConcurrency
+from foodMatcher import defaultPhrasesPath
+from multiprocessing import Pool
+import threading
+import argparse
+import json
+import time
+import sys
+import os
+
+defaultWorkers = os.cpu_count() or 1
+defaultChunkSize = 16 # Recipes a worker takes at a time
+progressInterval = 5.0 # Seconds between progress lines
+
+workerSettings = None # What the worker was started with (see startWorker)
+
+############################################################################
+# Name: readRecipes                                                        #
+# Params: recipesPath (JSON lines file of recipes)                         #
+# Returns: A generator of (line number, recipe dict) pairs                 #
+# Notes: Blank lines are skipped. A line that is not valid JSON is passed  #
+# on as None, so it still gets an error line in the output.                #
+############################################################################
+def readRecipes(recipesPath):
+    with open(recipesPath, encoding = "utf-8") as recipesFile:
+        for lineNumber, line in enumerate(recipesFile, 1):
+            if line.strip() == "":
+                continue
+            try:
+                yield lineNumber, json.loads(line)
+            except ValueError:
+                yield lineNumber, None
+
+############################################################################
+# Name: chunked                                                            #
+# Params: items (any iterable), chunkSize                                  #
+# Returns: A generator of lists of at most chunkSize items                 #
+# Notes: None                                                              #
+############################################################################
+def chunked(items, chunkSize):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunkSize:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+############################################################################
+# Name: startWorker                                                        #
+# Params: settings (dict of the command line options that the parsers      #
+# depend on)                                                               #
+# Returns: None                                                            #
+# Notes: The pool's initializer, so it runs once per worker process. The   #
+# ConceptNet cache and index are opened here rather than inherited, since  #
+# neither SQLite connections nor memory maps should be shared across a     #
+# fork. The model and food matcher are loaded before the first chunk so    #
+# that their load time is counted separately from the parsing.             #
+############################################################################
+def startWorker(settings):
+    global workerSettings
+    workerSettings = dict(settings)
+    loadStart = time.perf_counter()
+    RecipeBot.batchSize = settings["batchSize"]
+    RecipeBot.nProcess = 1 # The pool is already the parallelism
+    RecipeBot.foodPhrasesPath = settings["foodPhrasesPath"]
+    RecipeBot.prefetchConcurrency = settings["concurrency"]
+    RecipeBot.conceptIndex = ConceptIndex(settings["conceptIndexPath"]) if settings["conceptIndexPath"] is not None else None
+    RecipeBot.conceptCache = ConceptCache(settings["cachePath"]) if settings["cachePath"] is not None else None
+    RecipeBot.termModel = loadTermModel(settings["termModelPath"]) if settings["termModelPath"] is not None else None
+    RecipeBot.termModelConfidence = settings["termModelConfidence"]
+    RecipeBot.recipeStore = None
+    RecipeBot.progressiveParsing = False
+    RecipeBot.modelLoader.get()
+    RecipeBot.foodMatcherLoader.get()
+    workerSettings["loadSeconds"] = time.perf_counter() - loadStart
+    workerSettings["reportedLoad"] = False
+
+############################################################################
+# Name: headlessBot                                                        #
+# Params: recipe (one recipe dict, with its "url")                         #
+# Returns: A RecipeBot that can run the parsers, but never asks or says    #
+# anything                                                                 #
+# Notes: None                                                              #
+############################################################################
+def headlessBot(recipe):
+    bot = RecipeBot.__new__(RecipeBot) # __init__ would ask for a URL and start fetching it
+    bot.inputFunc = None
+    bot.outputFunc = lambda message: None
+    bot.recipe = Recipe(recipe.get("url"), dict((key, value) for key, value in recipe.items() if key != "url"))
+    return bot
+
+############################################################################
+# Name: annotateChunk                                                      #
+# Params: chunk (list of (line number, recipe dict) pairs)                 #
+# Returns: (list of (line number, output line) pairs in the chunk's order, #
+# dict of what this chunk cost the worker)                                 #
+# Notes: Runs in a worker (or on any thread of a process whose RecipeBot   #
+# is already set up, like the servers). A recipe that fails to parse gets  #
+# an "error" line instead of taking the rest of the chunk down with it.    #
+############################################################################
+def annotateChunk(chunk):
+    chunkStart = time.perf_counter()
+    cpuStart = time.process_time()
+    outputLines = dict()
+    usable = []
+    for lineNumber, recipe in chunk:
+        if recipe is None:
+            outputLines[lineNumber] = {"line": lineNumber, "error": "not valid JSON"}
+        elif not isinstance(recipe, dict): # Valid JSON, but a list, string or number instead of a recipe
+            outputLines[lineNumber] = {"line": lineNumber, "error": "not a JSON object"}
+        elif not isinstance(recipe.get("ingredients"), list) or not isinstance(recipe.get("instructions"), list):
+            outputLines[lineNumber] = {"line": lineNumber, "url": recipe.get("url"), "error": "no ingredients or instructions"}
+        else:
+            usable.append((lineNumber, recipe))
+
+    bots = [headlessBot(recipe) for _, recipe in usable]
+    lineCount = 0
+    try:
+        parsedRecipes = parseRecipes(RecipeBot.modelLoader.get(), [bot.recipeData for bot in bots], RecipeBot.batchSize, 1)
+        foodMatcher = RecipeBot.foodMatcherLoader.get()
+        prefetched = dict() # Shared by the whole chunk, so every term is fetched once per chunk
+        for bot, (ingDocs, instDocs) in zip(bots, parsedRecipes):
+            bot.ingDocs = ingDocs
+            bot.instDocs = instDocs
+            bot.ingMatches = foodMatcher.matchAll(ingDocs)
+            bot.prefetched = prefetched
+            lineCount += len(ingDocs) + len(instDocs)
+        if len(bots) > 0:
+            bots[0]._prefetchConceptNet([doc for bot in bots for doc in bot.ingDocs], [match for bot in bots for match in bot.ingMatches],
+            [doc for bot in bots for doc in bot.instDocs])
+    except Exception as chunkError: # Nothing in the chunk can be parsed without these
+        for lineNumber, recipe in usable:
+            outputLines[lineNumber] = {"line": lineNumber, "url": recipe.get("url"), "error": repr(chunkError)}
+        usable = []
+
+    for (lineNumber, recipe), bot in zip(usable, bots):
+        try:
+            bot._ingParse()
+            bot._instParse()
+            recipeIndex = bot._index()
+            outputLines[lineNumber] = {"line": lineNumber, "url": bot.recipeURL, "recipeName": bot.recipeData.get("recipeName"),
+            "ingPredicates": [(key, record.asDict()) for key, record in bot.ingPredicates.items()],
+            "instPredicates": [(key, record.asDict()) for key, record in bot.instPredicates.items()],
+            "stepIngredients": [list(ingKeys) for ingKeys in recipeIndex.stepIngredients]}
+            if bot.termClassifier is not None and bot.termClassifier.remoteUnavailable() > 0: # Some answers are fallbacks, worth redoing later
+                outputLines[lineNumber]["degraded"] = True
+        except Exception as parseError:
+            outputLines[lineNumber] = {"line": lineNumber, "url": bot.recipeURL, "error": repr(parseError)}
+
+    costs = {"pid": os.getpid(),
+    "recipes": len(chunk),
+    "failed": sum(1 for outputLine in outputLines.values() if "error" in outputLine),
+    "lines": lineCount,
+    "seconds": time.perf_counter() - chunkStart,
+    "cpuSeconds": time.process_time() - cpuStart,
+    "loadSeconds": 0.0}
+    if workerSettings is not None and not workerSettings["reportedLoad"]: # Counted once per worker, with its first chunk
+        costs["loadSeconds"] = workerSettings["loadSeconds"]
+        workerSettings["reportedLoad"] = True
+    return [(lineNumber, json.dumps(outputLines[lineNumber])) for lineNumber, _ in chunk], costs
+
+class BatchAnnotator:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: settings (passed to startWorker in every worker), workers        #
+    # (processes), chunkSize (recipes per task), ordered (keep the input's     #
+    # order in the output), progressFunc (called with each progress line, or   #
+    # None for no progress)                                                    #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, settings, workers = defaultWorkers, chunkSize = defaultChunkSize, ordered = True, progressFunc = None):
+        self.settings = settings
+        self.workers = max(1, workers)
+        self.chunkSize = max(1, chunkSize)
+        self.ordered = ordered
+        self.progressFunc = progressFunc
+        self.recipes = 0
+        self.failed = 0
+        self.lines = 0
+        self.perWorker = dict() # pid -> totals of that worker's chunk costs
+
+    ############################################################################
+    # Name: _addCosts                                                          #
+    # Params: costs (from annotateChunk)                                       #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def _addCosts(self, costs):
+        self.recipes += costs["recipes"]
+        self.failed += costs["failed"]
+        self.lines += costs["lines"]
+        workerTotals = self.perWorker.setdefault(costs["pid"], {"recipes": 0, "lines": 0, "seconds": 0.0, "cpuSeconds": 0.0, "loadSeconds": 0.0})
+        for field in workerTotals:
+            workerTotals[field] += costs[field]
+
+    ############################################################################
+    # Name: annotate                                                           #
+    # Params: recipesPath (JSON lines of recipes), outputPath (where the       #
+    # predicates go, one JSON line per recipe)                                 #
+    # Returns: The report (see report)                                         #
+    # Notes: Chunks are read lazily, and only a few per worker are handed out  #
+    # ahead of the results being written, so a huge catalog never sits in      #
+    # memory. Ordered output holds finished chunks back until the ones before  #
+    # them are written; unordered output writes them as they arrive.           #
+    ############################################################################
+    def annotate(self, recipesPath, outputPath):
+        annotateStart = time.perf_counter()
+        lastProgress = annotateStart
+        queued = threading.BoundedSemaphore(self.workers * 4)
+
+        def boundedChunks():
+            for chunk in chunked(readRecipes(recipesPath), self.chunkSize):
+                queued.acquire()
+                yield chunk
+
+        with Pool(self.workers, initializer = startWorker, initargs = (self.settings,)) as pool, open(outputPath, "w", encoding = "utf-8") as outputFile:
+            results = pool.imap(annotateChunk, boundedChunks()) if self.ordered else pool.imap_unordered(annotateChunk, boundedChunks())
+            for outputLines, costs in results:
+                queued.release()
+                for _, outputLine in outputLines:
+                    outputFile.write(outputLine + "\n")
+                self._addCosts(costs)
+                if self.progressFunc is not None and time.perf_counter() - lastProgress >= progressInterval:
+                    lastProgress = time.perf_counter()
+                    self.progressFunc(self.progress(lastProgress - annotateStart))
+
+        return self.report(time.perf_counter() - annotateStart)
+
+    ############################################################################
+    # Name: progress                                                           #
+    # Params: seconds (since annotating started)                               #
+    # Returns: A one line summary of how far along things are                  #
+    # Notes: Per core throughput is recipes over the CPU time the workers      #
+    # actually spent parsing, so it shows whether adding workers still helps.  #
+    ############################################################################
+    def progress(self, seconds):
+        cpuSeconds = sum(workerTotals["cpuSeconds"] for workerTotals in self.perWorker.values())
+        return "{} recipes ({} failed) in {:.1f}s: {:.1f} recipes/s, {:.1f} recipes/s per core".format(self.recipes, self.failed, seconds,
+        self.recipes / seconds if seconds > 0 else 0.0, self.recipes / cpuSeconds if cpuSeconds > 0 else 0.0)
+
+    ############################################################################
+    # Name: report                                                             #
+    # Params: seconds (how long annotating took)                               #
+    # Returns: A dict summarizing the run, overall and per worker              #
+    # Notes: None                                                              #
+    ############################################################################
+    def report(self, seconds):
+        cpuSeconds = sum(workerTotals["cpuSeconds"] for workerTotals in self.perWorker.values())
+        return {"recipes": self.recipes,
+        "failed": self.failed,
+        "lines": self.lines,
+        "workers": self.workers,
+        "chunkSize": self.chunkSize,
+        "ordered": self.ordered,
+        "seconds": seconds,
+        "recipesPerSecond": self.recipes / seconds if seconds > 0 else 0.0,
+        "recipesPerCoreSecond": self.recipes / cpuSeconds if cpuSeconds > 0 else 0.0,
+        "perWorker": [dict(workerTotals, pid = pid, recipesPerSecond = workerTotals["recipes"] / workerTotals["seconds"] if workerTotals["seconds"] > 0 else 0.0)
+        for pid, workerTotals in sorted(self.perWorker.items())]}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Parse every recipe in a JSON lines file into predicates, over several processes.")
+    parser.add_argument("recipes", help = "JSON lines file of recipes (from recipeCrawler.py)")
+    parser.add_argument("--output", default = "predicates.jsonl", help = "JSON lines file to write the predicates to")
+    parser.add_argument("--workers", type = int, default = defaultWorkers, help = "Worker processes, each with its own spaCy model")
+    parser.add_argument("--chunk-size", type = int, default = defaultChunkSize, help = "Recipes a worker parses at a time")
+    parser.add_argument("--unordered", action = "store_true", help = "Write recipes as soon as they are done instead of in the input's order")
+    parser.add_argument("--batch-size", type = int, default = defaultBatchSize, help = "Lines spaCy parses per batch")
+    parser.add_argument("--concurrency", type = int, default = defaultConcurrency, help = "Most ConceptNet requests each worker keeps in flight")
+    parser.add_argument("--food-phrases", default = defaultPhrasesPath, help = "File of multi-word foods (one per line) the ingredient parser recognizes")
+    parser.add_argument("--concept-index", metavar = "INDEX_FILE", help = "Answer ConceptNet questions from an index built by conceptIndex.py instead of the API")
+    parser.add_argument("--term-model", metavar = "MODEL_FILE", help = "Answer the questions it is sure about with a model trained by termModel.py instead of ConceptNet")
+    parser.add_argument("--term-model-confidence", type = float, default = defaultConfidence, help = "How sure the term model has to be (0.5 to 1) before ConceptNet is skipped")
+    parser.add_argument("--cache-path", default = ConceptCache.defaultPath, help = "Where the ConceptNet response cache is stored")
+    parser.add_argument("--no-cache", action = "store_true", help = "Always ask ConceptNet, never use the cache")
+    parser.add_argument("--quiet", action = "store_true", help = "Do not print progress while annotating")
+    args = parser.parse_args()
+
+    settings = {"batchSize": args.batch_size,
+    "concurrency": args.concurrency,
+    "foodPhrasesPath": args.food_phrases,
+    "conceptIndexPath": args.concept_index,
+    "termModelPath": args.term_model,
+    "termModelConfidence": args.term_model_confidence,
+    "cachePath": None if args.no_cache else args.cache_path}
+    annotator = BatchAnnotator(settings, args.workers, args.chunk_size, not args.unordered, None if args.quiet else lambda line: print(line, file = sys.stderr))
+    print(json.dumps(annotator.annotate(args.recipes, args.output), indent = 2))
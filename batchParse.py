@@ -0,0 +1,54 @@
+### Batched spaCy parsing
+### Every ingredient and instruction line goes through nlp.pipe in one go instead of one
+### nlp() call per line, and the pipeline only keeps the components the parsers read
+### (part-of-speech tags and the dependency parse). NER and the lemmatizer are never used.
+from lazyLoader import lazyImport
+from instrumentation import timed, timedFunction, count
+
+spacy = lazyImport("spacy") # Importing spaCy alone takes a noticeable while, so wait until a model is wanted
+
+modelName = "en_core_web_sm"
+unusedComponents = ["ner", "lemmatizer"] # Nothing in the bot reads entities or lemmas
+defaultBatchSize = 64 # Lines handed to spaCy at a time
+defaultProcesses = 1 # Extra processes only pay off when many recipes are parsed at once
+
+############################################################################
+# Name: loadModel                                                          #
+# Params: name (the spaCy model to load)                                   #
+# Returns: The spaCy Language object                                       #
+# Notes: The unused components are excluded outright rather than just      #
+# disabled, so they are never even loaded.                                 #
+############################################################################
+@timedFunction("spacy.load")
+def loadModel(name = modelName):
+    return spacy.load(name, exclude = unusedComponents)
+
+############################################################################
+# Name: parseRecipes                                                       #
+# Params: nlp (the spaCy model), recipes (list of recipe dicts from        #
+# formulateJSON), batchSize (lines per batch), nProcess (worker processes) #
+# Returns: A list with an (ingredient Docs, instruction Docs) pair for     #
+# each recipe, in the same order                                           #
+# Notes: Every line of every recipe goes through a single nlp.pipe call,   #
+# then gets split back up into the recipes it came from.                   #
+############################################################################
+def parseRecipes(nlp, recipes, batchSize = defaultBatchSize, nProcess = defaultProcesses):
+    allLines = []
+    for recipe in recipes:
+        allLines += recipe["ingredients"]
+        allLines += recipe["instructions"]
+
+    with timed("spacy.pipe", lines = len(allLines)):
+        allDocs = list(nlp.pipe(allLines, batch_size = batchSize, n_process = nProcess))
+    count("spacy.lines", len(allLines))
+
+    parsedRecipes = []
+    position = 0
+    for recipe in recipes:
+        ingCount = len(recipe["ingredients"])
+        instCount = len(recipe["instructions"])
+        ingDocs = allDocs[position:position + ingCount]
+        instDocs = allDocs[position + ingCount:position + ingCount + instCount]
+        parsedRecipes.append((ingDocs, instDocs))
+        position += ingCount + instCount
+    return parsedRecipes
@@ -0,0 +1,225 @@
+### Persistent cache for ConceptNet API responses, backed by SQLite
+### Every word the bot looks up gets stored here, so later runs (of the same recipe or any
+### recipe that shares vocabulary) can skip the network entirely.
+import sqlite3
+import threading
+import atexit
+import json
+import time
+import os
+
+class ConceptCache:
+    defaultPath = os.path.join(os.path.expanduser("~"), ".recipeBot", "conceptCache.sqlite3")
+    defaultTTL = 60 * 60 * 24 * 30 # ConceptNet barely changes, so a month seems reasonable
+    defaultMaxEntries = 50000 # Least recently used entries get thrown out past this point
+    accessBatch = 256 # Hits whose lastAccess is held in memory before being written out together
+
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: path (where the SQLite file lives), ttl (seconds before an entry #
+    # is considered stale), maxEntries (size bound for LRU eviction)           #
+    # Returns: None                                                            #
+    # Notes: Opens (or creates) the cache file. The hit/miss counters only     #
+    # cover this process, they are not persisted. The row count is read once   #
+    # here and kept up to date by put, so put never has to count the table.    #
+    ############################################################################
+    def __init__(self, path = None, ttl = None, maxEntries = None):
+        self.path = path if path is not None else self.defaultPath
+        self.ttl = ttl if ttl is not None else self.defaultTTL
+        self.maxEntries = maxEntries if maxEntries is not None else self.defaultMaxEntries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pendingAccess = dict() # key -> lastAccess for hits not written to SQLite yet
+        self.lock = threading.Lock() # The connection gets shared, so only one thread talks to SQLite at a time
+
+        if self.path != ":memory:" and os.path.dirname(self.path) != "":
+            os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        self.connection = sqlite3.connect(self.path, check_same_thread = False)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            createdAt REAL NOT NULL,
+            lastAccess REAL NOT NULL)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responsesByAccess ON responses (lastAccess)")
+        self.connection.commit()
+        self.rowCount = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        atexit.register(self.flush) # So the last batch of hits still counts towards the LRU order next run
+
+    ############################################################################
+    # Name: normalizeTerm                                                      #
+    # Params: term (the word or phrase looked up)                              #
+    # Returns: The term the way ConceptNet names its nodes                     #
+    # Notes: "Salt", " salt" and "salt" should all land on the same entry.     #
+    # Spaces become underscores since that is how ConceptNet spells phrases.   #
+    ############################################################################
+    @staticmethod
+    def normalizeTerm(term):
+        return "_".join(term.strip().lower().split())
+
+    ############################################################################
+    # Name: makeKey                                                            #
+    # Params: term (the word or phrase looked up), query (the query string     #
+    # sent along with it)                                                      #
+    # Returns: The key for the cache                                           #
+    # Notes: None                                                              #
+    ############################################################################
+    @staticmethod
+    def makeKey(term, query):
+        return ConceptCache.normalizeTerm(term) + "?" + query
+
+    ############################################################################
+    # Name: get                                                                #
+    # Params: term, query (same as makeKey)                                    #
+    # Returns: The cached JSON response, or None on a miss                     #
+    # Notes: Expired entries count as misses and get deleted on the spot. A    #
+    # hit is a pure read: its lastAccess is only noted in memory, and written  #
+    # out with the next put or once accessBatch hits have piled up.            #
+    ############################################################################
+    def get(self, term, query):
+        key = self.makeKey(term, query)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT response, createdAt FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if now - row[1] > self.ttl: # Stale, so pretend it was never here
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+                self.pendingAccess.pop(key, None)
+                self.rowCount -= 1
+                self.misses += 1
+                return None
+            self.pendingAccess[key] = now
+            if len(self.pendingAccess) >= self.accessBatch:
+                self._writeAccess()
+                self.connection.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    ############################################################################
+    # Name: put                                                                #
+    # Params: term, query (same as makeKey), response (the decoded JSON)       #
+    # Returns: None                                                            #
+    # Notes: Stores the response and evicts the least recently used entries if #
+    # the cache has grown past maxEntries. Any hits noted since the last write #
+    # go out in the same transaction, before the eviction looks at lastAccess. #
+    # Processes sharing the file each keep their own count, so with several of #
+    # them the bound is approximate.                                           #
+    ############################################################################
+    def put(self, term, query, response):
+        key = self.makeKey(term, query)
+        now = time.time()
+        with self.lock:
+            self.pendingAccess.pop(key, None)
+            self._writeAccess()
+            exists = self.connection.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+            self.connection.execute("INSERT OR REPLACE INTO responses (key, response, createdAt, lastAccess) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(response), now, now))
+            if not exists:
+                self.rowCount += 1
+            overflow = self.rowCount - self.maxEntries
+            if overflow > 0:
+                evicted = self.connection.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY lastAccess ASC LIMIT ?)", (overflow,)).rowcount
+                self.rowCount -= evicted
+                self.evictions += evicted
+            self.connection.commit()
+
+    ############################################################################
+    # Name: _writeAccess                                                       #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Writes the noted lastAccess times without committing. The caller  #
+    # holds the lock and commits.                                              #
+    ############################################################################
+    def _writeAccess(self):
+        if len(self.pendingAccess) > 0:
+            self.connection.executemany("UPDATE responses SET lastAccess = ? WHERE key = ?",
+            [(accessedAt, key) for key, accessedAt in self.pendingAccess.items()])
+            self.pendingAccess.clear()
+
+    ############################################################################
+    # Name: flush                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Writes out any lastAccess times still held in memory.             #
+    ############################################################################
+    def flush(self):
+        with self.lock:
+            if len(self.pendingAccess) > 0:
+                self._writeAccess()
+                self.connection.commit()
+
+    ############################################################################
+    # Name: warm                                                               #
+    # Params: terms (iterable of words to look up), query (same as makeKey),   #
+    # fetchFunc (takes a normalized term and returns its JSON response)        #
+    # Returns: The number of terms that actually had to be fetched             #
+    # Notes: Pre-loads the cache so the first real session does not pay for    #
+    # the network round trips. Anything already cached is left alone.          #
+    ############################################################################
+    def warm(self, terms, query, fetchFunc):
+        fetched = 0
+        for term in terms:
+            normalizedTerm = self.normalizeTerm(term)
+            if normalizedTerm == "":
+                continue
+            if self.get(normalizedTerm, query) is None:
+                self.put(normalizedTerm, query, fetchFunc(normalizedTerm))
+                fetched += 1
+        return fetched
+
+    ############################################################################
+    # Name: entries                                                            #
+    # Params: query (same as makeKey)                                          #
+    # Returns: A list of (normalized term, JSON response) for every fresh      #
+    # entry stored with that query                                             #
+    # Notes: Reading everything does not count as using it, so the hit/miss    #
+    # counters and the LRU order are left alone.                               #
+    ############################################################################
+    def entries(self, query):
+        suffix = "?" + query
+        oldest = time.time() - self.ttl
+        with self.lock:
+            rows = self.connection.execute("SELECT key, response FROM responses WHERE createdAt >= ?", (oldest,)).fetchall()
+        return [(key[:-len(suffix)], json.loads(response)) for key, response in rows if key.endswith(suffix)]
+
+    ############################################################################
+    # Name: clear                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Drops every entry and resets the counters.                        #
+    ############################################################################
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self.connection.commit()
+            self.pendingAccess.clear()
+            self.rowCount = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    ############################################################################
+    # Name: stats                                                              #
+    # Params: None                                                             #
+    # Returns: A dict with the entry count and the hit/miss/eviction counters  #
+    # Notes: None                                                              #
+    ############################################################################
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": self.rowCount, "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+        "hitRate": (self.hits / lookups) if lookups > 0 else 0.0}
+
+    ############################################################################
+    # Name: close                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Writes out the noted hits, then closes the SQLite connection.     #
+    ############################################################################
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.connection.close()
+        atexit.unregister(self.flush)
@@ -0,0 +1,221 @@
+### Offline ConceptNet index, built from the ConceptNet assertions dump
+### (https://github.com/commonsense/conceptnet5/wiki/Downloads)
+### Only the handful of English edges the bot actually looks at are kept:
+###   IsA .../food       -> the start term is a food
+###   MannerOf .../v/    -> the term used as a verb is an action
+###   UsedFor .../cook   -> the start term is a cooking tool
+### The index is a single file that gets memory-mapped, so nothing is read into RAM up front.
+###
+### File layout (all integers are little-endian unsigned 32-bit):
+###   header:  magic "CNIX", version, number of terms, reserved
+###   offsets: (number of terms + 1) offsets into the term blob, terms sorted bytewise
+###   flags:   one byte per term (FOOD | ACTION | TOOL)
+###   blob:    every term in UTF-8, back to back
+import mmap
+import struct
+import gzip
+import sys
+import os
+
+FOOD = 1
+ACTION = 2
+TOOL = 4
+
+indexMagic = b"CNIX"
+indexVersion = 1
+headerFormat = "<4sIII"
+headerSize = struct.calcsize(headerFormat)
+
+############################################################################
+# Name: normalizeTerm                                                      #
+# Params: term (the word or phrase to look up)                             #
+# Returns: The term the way ConceptNet names its nodes                     #
+# Notes: Lowercase with underscores instead of spaces.                     #
+############################################################################
+def normalizeTerm(term):
+    return "_".join(term.strip().lower().split())
+
+############################################################################
+# Name: splitConcept                                                       #
+# Params: uri (a ConceptNet node like /c/en/ground_beef/n/wn/food)         #
+# Returns: (language, term, part of speech), the last one possibly None    #
+# Notes: None                                                              #
+############################################################################
+def splitConcept(uri):
+    pieces = uri.split("/")
+    if len(pieces) < 4 or pieces[1] != "c":
+        return None, None, None
+    return pieces[2], pieces[3], pieces[4] if len(pieces) > 4 else None
+
+############################################################################
+# Name: classifyAssertion                                                  #
+# Params: relation, start, end (the relation and node URIs of one edge)    #
+# Returns: A list of (term, flag) pairs this edge contributes              #
+# Notes: Mirrors the checks RecipeBot makes on live ConceptNet edges.      #
+############################################################################
+def classifyAssertion(relation, start, end):
+    startLang, startTerm, startPOS = splitConcept(start)
+    endLang, endTerm, endPOS = splitConcept(end)
+    if startLang != "en" or endLang != "en":
+        return []
+
+    found = []
+    if relation == "/r/IsA" and endTerm.startswith("food"):
+        found.append((startTerm, FOOD))
+    elif relation == "/r/MannerOf":
+        if startPOS == "v":
+            found.append((startTerm, ACTION))
+        if endPOS == "v":
+            found.append((endTerm, ACTION))
+    elif relation == "/r/UsedFor" and endTerm == "cook":
+        found.append((startTerm, TOOL))
+    return found
+
+############################################################################
+# Name: buildIndex                                                         #
+# Params: assertionsPath (the assertions CSV, optionally gzipped),         #
+# indexPath (where to write the index)                                     #
+# Returns: The number of terms written                                     #
+# Notes: The dump is streamed line by line, so even the full multi-GB file #
+# is fine. Only the terms we keep are ever held in memory.                 #
+############################################################################
+def buildIndex(assertionsPath, indexPath):
+    termFlags = dict()
+    opener = gzip.open if assertionsPath.endswith(".gz") else open
+    with opener(assertionsPath, "rt", encoding = "utf-8") as assertions:
+        for line in assertions:
+            columns = line.split("\t")
+            if len(columns) < 4:
+                continue
+            for term, flag in classifyAssertion(columns[1], columns[2], columns[3]):
+                termFlags[term] = termFlags.get(term, 0) | flag
+
+    writeIndex(termFlags, indexPath)
+    return len(termFlags)
+
+############################################################################
+# Name: writeIndex                                                         #
+# Params: termFlags (dict of term -> flags), indexPath (where to write)    #
+# Returns: None                                                            #
+# Notes: Terms are sorted bytewise so the reader can binary search them.   #
+############################################################################
+def writeIndex(termFlags, indexPath):
+    encodedTerms = sorted((term.encode("utf-8"), flags) for term, flags in termFlags.items())
+    offsets = [0]
+    for term, flags in encodedTerms:
+        offsets.append(offsets[-1] + len(term))
+
+    temporaryPath = indexPath + ".tmp" # Written to the side first so a half-built index never gets used
+    with open(temporaryPath, "wb") as indexFile:
+        indexFile.write(struct.pack(headerFormat, indexMagic, indexVersion, len(encodedTerms), 0))
+        indexFile.write(struct.pack("<" + str(len(offsets)) + "I", *offsets))
+        indexFile.write(bytes(flags for term, flags in encodedTerms))
+        for term, flags in encodedTerms:
+            indexFile.write(term)
+    os.replace(temporaryPath, indexPath)
+
+class ConceptIndex:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: indexPath (an index written by buildIndex)                       #
+    # Returns: None                                                            #
+    # Notes: Maps the file instead of reading it, so the OS only pages in the  #
+    # parts that lookups actually touch.                                       #
+    ############################################################################
+    def __init__(self, indexPath):
+        self.indexPath = indexPath
+        self.indexFile = open(indexPath, "rb")
+        self.data = mmap.mmap(self.indexFile.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, self.termCount, reserved = struct.unpack_from(headerFormat, self.data, 0)
+        if magic != indexMagic or version != indexVersion:
+            raise ValueError(indexPath + " is not a ConceptNet index this version of the bot can read")
+        self.offsetsStart = headerSize
+        self.flagsStart = self.offsetsStart + 4 * (self.termCount + 1)
+        self.blobStart = self.flagsStart + self.termCount
+
+    ############################################################################
+    # Name: _termAt                                                            #
+    # Params: position (index into the sorted term table)                      #
+    # Returns: The term's bytes                                                #
+    # Notes: None                                                              #
+    ############################################################################
+    def _termAt(self, position):
+        start, stop = struct.unpack_from("<II", self.data, self.offsetsStart + 4 * position)
+        return self.data[self.blobStart + start:self.blobStart + stop]
+
+    ############################################################################
+    # Name: flagsFor                                                           #
+    # Params: term (the word or phrase to look up)                             #
+    # Returns: The flags stored for the term (0 if it is not in the index)     #
+    # Notes: Plain binary search over the sorted term table.                   #
+    ############################################################################
+    def flagsFor(self, term):
+        target = normalizeTerm(term).encode("utf-8")
+        low = 0
+        high = self.termCount
+        while low < high:
+            middle = (low + high) // 2
+            middleTerm = self._termAt(middle)
+            if middleTerm < target:
+                low = middle + 1
+            elif middleTerm > target:
+                high = middle
+            else:
+                return self.data[self.flagsStart + middle]
+        return 0
+
+    ############################################################################
+    # Name: isFood                                                             #
+    # Params: term (the word or phrase to look up)                             #
+    # Returns: Boolean                                                         #
+    # Notes: True if ConceptNet has the term IsA food.                         #
+    ############################################################################
+    def isFood(self, term):
+        return self.flagsFor(term) & FOOD != 0
+
+    ############################################################################
+    # Name: isAction                                                           #
+    # Params: term (the word to look up)                                       #
+    # Returns: Boolean                                                         #
+    # Notes: True if ConceptNet uses the term as a verb in a MannerOf edge.    #
+    ############################################################################
+    def isAction(self, term):
+        return self.flagsFor(term) & ACTION != 0
+
+    ############################################################################
+    # Name: isTool                                                             #
+    # Params: term (the word to look up)                                       #
+    # Returns: Boolean                                                         #
+    # Notes: True if ConceptNet has the term UsedFor cook.                     #
+    ############################################################################
+    def isTool(self, term):
+        return self.flagsFor(term) & TOOL != 0
+
+    def __len__(self):
+        return self.termCount
+
+    ############################################################################
+    # Name: close                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Unmaps the index and closes the file.                             #
+    ############################################################################
+    def close(self):
+        self.data.close()
+        self.indexFile.close()
+
+if __name__ == "__main__":
+    usage = "Usage: python conceptIndex.py build <assertions.csv[.gz]> <index file>\n       python conceptIndex.py lookup <index file> <term> [<term> ...]"
+    if len(sys.argv) < 4:
+        sys.exit(usage)
+
+    if sys.argv[1] == "build":
+        termCount = buildIndex(sys.argv[2], sys.argv[3])
+        print("Wrote " + str(termCount) + " terms to " + sys.argv[3])
+    elif sys.argv[1] == "lookup":
+        index = ConceptIndex(sys.argv[2])
+        for term in sys.argv[3:]:
+            print(term + ": food=" + str(index.isFood(term)) + " action=" + str(index.isAction(term)) + " tool=" + str(index.isTool(term)))
+        index.close()
+    else:
+        sys.exit(usage)
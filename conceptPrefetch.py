@@ -0,0 +1,97 @@
+### Concurrent ConceptNet prefetching
+### RecipeBot works out every term its parsers are going to ask ConceptNet about, and this
+### fetches them all at once over a bounded thread pool instead of one blocking call at a time.
+from concurrent.futures import ThreadPoolExecutor
+from lazyLoader import lazyImport
+import time
+
+requests = lazyImport("requests")
+
+defaultConcurrency = 8 # How many ConceptNet requests can be in flight at once
+
+############################################################################
+# Name: pooledSession                                                      #
+# Params: poolSize (how many keep-alive connections to hold per host)      #
+# Returns: A requests.Session                                              #
+# Notes: Reusing connections matters more than anything else here, since   #
+# every ConceptNet call is otherwise a fresh TCP (and DNS) round trip.     #
+############################################################################
+def pooledSession(poolSize = defaultConcurrency):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections = poolSize, pool_maxsize = poolSize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class ConceptPrefetcher:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: fetchFunc (takes a normalized term and returns its JSON          #
+    # response), concurrency (the most requests in flight at once)             #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, fetchFunc, concurrency = defaultConcurrency):
+        self.fetchFunc = fetchFunc
+        self.concurrency = max(1, concurrency)
+        self.rounds = [] # One entry per call to fetchAll, for the latency report
+        self.fetchTimes = [] # How long each individual request took
+        self.startTime = time.perf_counter()
+
+    ############################################################################
+    # Name: _timedFetch                                                        #
+    # Params: term (normalized term to fetch)                                  #
+    # Returns: (term, JSON response or None, seconds taken)                    #
+    # Notes: A failed request gives back None, so the parser can still retry   #
+    # it later on its own instead of the whole prefetch falling over.          #
+    ############################################################################
+    def _timedFetch(self, term):
+        fetchStart = time.perf_counter()
+        try:
+            response = self.fetchFunc(term)
+        except Exception:
+            response = None
+        return term, response, time.perf_counter() - fetchStart
+
+    ############################################################################
+    # Name: fetchAll                                                           #
+    # Params: terms (normalized terms that are not cached anywhere yet)        #
+    # Returns: (dict of term -> JSON response, list of terms that failed)      #
+    # Notes: Duplicates are dropped before anything gets sent.                 #
+    ############################################################################
+    def fetchAll(self, terms):
+        uniqueTerms = list(dict.fromkeys(terms)) # Keeps the order, which keeps the report readable
+        roundStart = time.perf_counter()
+        results = dict()
+        failures = []
+
+        if len(uniqueTerms) > 0:
+            with ThreadPoolExecutor(max_workers = min(self.concurrency, len(uniqueTerms))) as pool:
+                for term, response, seconds in pool.map(self._timedFetch, uniqueTerms):
+                    self.fetchTimes.append(seconds)
+                    if response is None:
+                        failures.append(term)
+                    else:
+                        results[term] = response
+
+        self.rounds.append({"fetched": len(results), "failed": len(failures), "seconds": time.perf_counter() - roundStart})
+        return results, failures
+
+    ############################################################################
+    # Name: report                                                             #
+    # Params: requested (how many distinct terms the parsers will ask about),  #
+    # alreadyCached (how many of those never needed the network)               #
+    # Returns: A dict summarizing the prefetch for this recipe                 #
+    # Notes: None                                                              #
+    ############################################################################
+    def report(self, requested, alreadyCached):
+        sortedTimes = sorted(self.fetchTimes)
+        return {"distinctTerms": requested,
+        "alreadyCached": alreadyCached,
+        "fetched": sum(eachRound["fetched"] for eachRound in self.rounds),
+        "failed": sum(eachRound["failed"] for eachRound in self.rounds),
+        "concurrency": self.concurrency,
+        "rounds": self.rounds,
+        "meanRequestSeconds": (sum(sortedTimes) / len(sortedTimes)) if len(sortedTimes) > 0 else 0.0,
+        "slowestRequestSeconds": sortedTimes[-1] if len(sortedTimes) > 0 else 0.0,
+        "totalSeconds": time.perf_counter() - self.startTime}
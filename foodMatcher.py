@@ -0,0 +1,127 @@
+### Phrase matching for ingredient lines
+### Finds multi-word foods ("ground beef", "chicken broth") and quantities with their units
+### ("1 1/2 cups", "½ teaspoon") in every ingredient line in one pass, with spaCy's PhraseMatcher
+### and Matcher. The foods come from a plain vocabulary file (foodPhrases.txt), plus a pattern for
+### any word in front of a paired word like "broth" or "loin", so none of this asks ConceptNet
+### anything. Only the tokenizer is used, so it works the same whichever model is loaded.
+from lazyLoader import lazyImport
+from collections import namedtuple
+import os
+
+spacyMatcher = lazyImport("spacy.matcher")
+spacyUtil = lazyImport("spacy.util")
+
+defaultPhrasesPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "foodPhrases.txt")
+
+# Units a quantity can be measured in, in the forms recipes write them
+measurementUnits = ["cup", "cups", "c", "tablespoon", "tablespoons", "tbsp", "tbs", "tbsps", "teaspoon", "teaspoons", "tsp", "tsps",
+"pound", "pounds", "lb", "lbs", "ounce", "ounces", "oz", "gram", "grams", "g", "kilogram", "kilograms", "kg",
+"milliliter", "milliliters", "ml", "liter", "liters", "l", "quart", "quarts", "qt", "pint", "pints", "pt", "gallon", "gallons",
+"pinch", "pinches", "dash", "dashes", "clove", "cloves", "can", "cans", "package", "packages", "pkg", "jar", "jars",
+"bottle", "bottles", "stick", "sticks", "slice", "slices", "sprig", "sprigs", "bunch", "bunches", "head", "heads",
+"piece", "pieces", "inch", "inches", "envelope", "envelopes", "container", "containers", "box", "boxes", "bag", "bags"]
+
+vulgarFractions = "½⅓⅔¼¾⅕⅖⅗⅘⅙⅚⅛⅜⅝⅞"
+numberPattern = r"^(\d+([.,/]\d+)?|\d*[" + vulgarFractions + "])$" # "2", "1.5", "1/2", "½" or "1½"
+fractionPattern = r"^(\d+/\d+|[" + vulgarFractions + "])$" # The "1/2" in "1 1/2"
+
+IngredientMatch = namedtuple("IngredientMatch", ["foods", "quantity", "measurement"]) # foods are Spans, the others are text or None
+
+############################################################################
+# Name: readPhrases                                                        #
+# Params: phrasesPath (the vocabulary file)                                #
+# Returns: The phrases in it, lowercased, without blanks or comments       #
+# Notes: None                                                              #
+############################################################################
+def readPhrases(phrasesPath = defaultPhrasesPath):
+    with open(phrasesPath, encoding = "utf-8") as phrasesFile:
+        phrases = [line.strip().lower() for line in phrasesFile]
+    return [phrase for phrase in phrases if phrase != "" and not phrase.startswith("#")]
+
+############################################################################
+# Name: pluralForm                                                         #
+# Params: phrase                                                           #
+# Returns: The phrase with its last word made plural                       #
+# Notes: Only the regular endings; anything odd can go in the file.        #
+############################################################################
+def pluralForm(phrase):
+    if phrase.endswith("s"):
+        return phrase
+    if phrase.endswith("ch") or phrase.endswith("sh") or phrase.endswith("o"):
+        return phrase + "es"
+    if phrase.endswith("y") and phrase[-2:-1] not in "aeiou":
+        return phrase[:-1] + "ies"
+    if phrase.endswith("f"):
+        return phrase[:-1] + "ves"
+    return phrase + "s"
+
+class FoodMatcher:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: nlp (the spaCy model, only its tokenizer and vocab are used),    #
+    # phrases (the multi-word foods), pairedWords (foods that take the word    #
+    # in front of them, like "broth")                                          #
+    # Returns: None                                                            #
+    # Notes: Built once per model and then only read, so every session can     #
+    # share it.                                                                #
+    ############################################################################
+    def __init__(self, nlp, phrases, pairedWords = ()):
+        self.phraseMatcher = spacyMatcher.PhraseMatcher(nlp.vocab, attr = "LOWER")
+        allForms = sorted(set(phrases) | set(pluralForm(phrase) for phrase in phrases))
+        self.phraseMatcher.add("FOOD", [nlp.make_doc(phrase) for phrase in allForms])
+
+        self.matcher = spacyMatcher.Matcher(nlp.vocab)
+        pairedForms = sorted(set(word.lower() for word in pairedWords) | set(pluralForm(word.lower()) for word in pairedWords))
+        self.matcher.add("FOOD", [[{"IS_ALPHA": True, "IS_STOP": False}, {"LOWER": {"IN": pairedForms}}]])
+        self.matcher.add("QUANTITY", [[{"TEXT": {"REGEX": numberPattern}}, {"TEXT": {"REGEX": fractionPattern}, "OP": "?"},
+        {"LOWER": {"IN": measurementUnits}, "OP": "?"}]])
+        self.foodLabel = nlp.vocab.strings["FOOD"]
+        self.units = set(measurementUnits)
+
+    ############################################################################
+    # Name: match                                                              #
+    # Params: doc (one parsed or just tokenized ingredient line)               #
+    # Returns: An IngredientMatch                                              #
+    # Notes: Overlapping matches are narrowed down to the longest, so "extra   #
+    # virgin olive oil" wins over "olive oil", and "1 1/2 cups" over "1". The  #
+    # first quantity in the line is the one that counts.                       #
+    ############################################################################
+    def match(self, doc):
+        foodSpans = [doc[start:end] for _, start, end in self.phraseMatcher(doc)]
+        quantitySpans = []
+        for matchID, start, end in self.matcher(doc):
+            (foodSpans if matchID == self.foodLabel else quantitySpans).append(doc[start:end])
+        foods = sorted(spacyUtil.filter_spans(foodSpans), key = lambda span: span.start)
+
+        quantity = None
+        measurement = None
+        quantitySpans = sorted(spacyUtil.filter_spans(quantitySpans), key = lambda span: span.start)
+        if len(quantitySpans) > 0:
+            quantitySpan = quantitySpans[0]
+            if quantitySpan[-1].lower_ in self.units:
+                measurement = quantitySpan[-1].text
+                quantitySpan = quantitySpan[:-1]
+            quantity = quantitySpan.text
+        return IngredientMatch(foods, quantity, measurement)
+
+    ############################################################################
+    # Name: matchAll                                                           #
+    # Params: docs (every ingredient line of a recipe, or of many)             #
+    # Returns: A list of IngredientMatch, one per doc                          #
+    # Notes: None                                                              #
+    ############################################################################
+    def matchAll(self, docs):
+        return [self.match(doc) for doc in docs]
+
+    ############################################################################
+    # Name: foodAt                                                             #
+    # Params: ingredientMatch (from match), token (a token in the same line)   #
+    # Returns: The matched food span the token is part of, or None             #
+    # Notes: None                                                              #
+    ############################################################################
+    @staticmethod
+    def foodAt(ingredientMatch, token):
+        for span in ingredientMatch.foods:
+            if span.start <= token.i < span.end:
+                return span
+        return None
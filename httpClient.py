@@ -0,0 +1,232 @@
+### Resilient outbound HTTP
+### Every call the bot makes to someone else's server (ConceptNet, recipe sites, sitemaps) goes
+### through here. Each kind of call is an endpoint with its own timeouts and latency budget, and
+### connection errors, timeouts and 429/5xx answers are retried a few times with jittered backoff,
+### as long as the budget allows. Each endpoint (per host) also has a circuit breaker: once calls
+### keep failing, it stops sending them for a while and callers fall back to whatever they can do
+### locally straight away, instead of every session waiting out every timeout. The breaker lets one
+### call through now and then to see whether the upstream is back. Every attempt is timed as
+### "http.<endpoint>", so the tail latency of each upstream shows up in the metrics.
+from instrumentation import metrics, timed, count
+from conceptPrefetch import pooledSession
+from lazyLoader import lazyImport
+from collections import namedtuple
+from urllib.parse import urlsplit
+import threading
+import random
+import time
+
+requests = lazyImport("requests")
+
+# connectTimeout, readTimeout: seconds for one attempt. budget: most seconds for every attempt
+# together. retries: attempts after the first. backoff: seconds before the first retry, doubled
+# for each one after and jittered by half either way, so many callers do not retry in lockstep.
+Endpoint = namedtuple("Endpoint", ["connectTimeout", "readTimeout", "budget", "retries", "backoff"])
+
+endpoints = {"conceptnet": Endpoint(3.05, 10, 20, 2, 0.25), # Asked during parsing, which the user is waiting on
+"recipePage": Endpoint(3.05, 30, 45, 2, 0.5),
+"sitemap": Endpoint(3.05, 30, 60, 2, 0.5)}
+defaultEndpoint = Endpoint(3.05, 30, 45, 1, 0.5)
+retryStatuses = {429, 500, 502, 503, 504} # Worth asking again; any other status is the real answer
+breakerThreshold = 5 # Failed calls in a row before a breaker trips
+breakerReset = 30 # Seconds a tripped breaker waits before letting one call through to test the upstream
+
+class UpstreamUnavailable(Exception):
+    pass
+
+class CircuitBreaker:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: threshold (failed calls in a row before it trips), resetAfter    #
+    # (seconds before a tripped breaker lets a test call through)              #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, threshold = breakerThreshold, resetAfter = breakerReset):
+        self.threshold = threshold
+        self.resetAfter = resetAfter
+        self.failures = 0 # Failed calls in a row
+        self.openedAt = None # When it tripped, or None while calls are going through
+        self.probing = False # True while the one test call of a half-open breaker is out
+        self.trips = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    ############################################################################
+    # Name: allow                                                              #
+    # Params: None                                                             #
+    # Returns: Boolean, whether the call may go out                            #
+    # Notes: Every call that is allowed must end in succeeded, failed or       #
+    # abandon, or a half-open breaker never lets another call through.         #
+    ############################################################################
+    def allow(self):
+        with self.lock:
+            if self.openedAt is None:
+                return True
+            if self.probing or time.monotonic() - self.openedAt < self.resetAfter:
+                self.rejected += 1
+                return False
+            self.probing = True
+            return True
+
+    ############################################################################
+    # Name: succeeded                                                          #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: One good call closes the breaker again.                           #
+    ############################################################################
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.openedAt = None
+            self.probing = False
+
+    ############################################################################
+    # Name: failed                                                             #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: A failed test call trips the breaker again straight away.         #
+    ############################################################################
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.openedAt is not None or self.failures >= self.threshold:
+                if self.openedAt is None:
+                    self.trips += 1
+                self.openedAt = time.monotonic()
+
+    ############################################################################
+    # Name: abandon                                                            #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: For a call that went wrong on our side (a malformed URL, say),    #
+    # which says nothing about the upstream either way.                        #
+    ############################################################################
+    def abandon(self):
+        with self.lock:
+            self.probing = False
+
+    ############################################################################
+    # Name: state                                                              #
+    # Params: None                                                             #
+    # Returns: "closed", "open" or "halfOpen"                                  #
+    # Notes: None                                                              #
+    ############################################################################
+    def state(self):
+        with self.lock:
+            if self.openedAt is None:
+                return "closed"
+            return "open" if self.probing or time.monotonic() - self.openedAt < self.resetAfter else "halfOpen"
+
+class HTTPClient:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: sleep (what to wait between attempts with, time.sleep normally)  #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, sleep = time.sleep):
+        self.sleep = sleep
+        self.breakers = dict() # (endpoint name, host) -> CircuitBreaker
+        self.session = None # Used when the caller does not bring its own
+        self.lock = threading.Lock()
+
+    ############################################################################
+    # Name: breaker                                                            #
+    # Params: name (the endpoint, or anything else worth a breaker, like a     #
+    # search backend), host (the upstream's host, if it has several)           #
+    # Returns: The CircuitBreaker for it                                       #
+    # Notes: Recipe pages get one breaker per site, so one site being down     #
+    # does not stop a crawl of the others.                                     #
+    ############################################################################
+    def breaker(self, name, host = ""):
+        with self.lock:
+            key = (name, host)
+            if key not in self.breakers:
+                self.breakers[key] = CircuitBreaker()
+            return self.breakers[key]
+
+    ############################################################################
+    # Name: get                                                                #
+    # Params: endpointName (a key of endpoints), url, session (a pooled        #
+    # requests.Session to send it on), beforeAttempt (called with no           #
+    # arguments before every attempt, e.g. to wait for a rate limiter), kwargs #
+    # (anything else for session.get, like headers or stream)                  #
+    # Returns: The response, which may be a 4xx for the caller to deal with    #
+    # Notes: Raises UpstreamUnavailable if the breaker is open, or if every    #
+    # attempt failed or the budget ran out. The budget covers getting the      #
+    # response; a streamed body is only bound by the read timeout per chunk.   #
+    # It starts with the first attempt, so waiting for a first slot in         #
+    # beforeAttempt does not use it up.                                        #
+    ############################################################################
+    def get(self, endpointName, url, session = None, beforeAttempt = None, **kwargs):
+        endpoint = endpoints.get(endpointName, defaultEndpoint)
+        breaker = self.breaker(endpointName, urlsplit(url).netloc.lower())
+        if not breaker.allow():
+            count("http." + endpointName + ".rejected")
+            raise UpstreamUnavailable(endpointName + " is not being called for now, after failing repeatedly")
+        if session is None:
+            session = self._session()
+
+        deadline = None
+        lastError = None
+        for attempt in range(endpoint.retries + 1):
+            try:
+                if beforeAttempt is not None:
+                    beforeAttempt()
+                if deadline is None:
+                    deadline = time.monotonic() + endpoint.budget
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: # Waiting for this attempt's slot took the rest of the budget
+                    break
+                with timed("http." + endpointName):
+                    response = session.get(url, timeout = (min(endpoint.connectTimeout, remaining), min(endpoint.readTimeout, remaining)), **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as requestError:
+                lastError = requestError
+            except BaseException:
+                breaker.abandon()
+                raise
+            else:
+                if response.status_code not in retryStatuses:
+                    breaker.succeeded()
+                    return response
+                lastError = requests.HTTPError(str(response.status_code) + " from " + url, response = response)
+                response.close()
+
+            pause = endpoint.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            if attempt == endpoint.retries or time.monotonic() + pause >= deadline:
+                break
+            count("http." + endpointName + ".retries")
+            self.sleep(pause)
+
+        breaker.failed()
+        count("http." + endpointName + ".failures")
+        raise UpstreamUnavailable(endpointName + " failed: " + repr(lastError)) from lastError
+
+    ############################################################################
+    # Name: _session                                                           #
+    # Params: None                                                             #
+    # Returns: The client's own pooled session                                 #
+    # Notes: Made on first use, so requests is not imported until needed.      #
+    ############################################################################
+    def _session(self):
+        with self.lock:
+            if self.session is None:
+                self.session = pooledSession()
+            return self.session
+
+    ############################################################################
+    # Name: stats                                                              #
+    # Params: None                                                             #
+    # Returns: A dict of every breaker's state and counters                    #
+    # Notes: None                                                              #
+    ############################################################################
+    def stats(self):
+        with self.lock:
+            breakers = list(self.breakers.items())
+        return {(name + " " + host).strip(): {"state": breaker.state(), "failuresInARow": breaker.failures, "trips": breaker.trips, "rejected": breaker.rejected}
+        for (name, host), breaker in breakers}
+
+client = HTTPClient() # Shared by everything in the process, so every session sees the same breakers
+metrics.addSource("http", client.stats)
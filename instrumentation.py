@@ -0,0 +1,199 @@
+### Timing and call-count instrumentation
+### Every slow thing the bot does (scraping, spaCy, each ConceptNet request, each search, each
+### turn) is wrapped in a named timer here, so when someone says the bot "hung" it is easy to see
+### where the time went. Timers are always on and cheap; what happens with them is up to the flags:
+### --profile prints a summary at the end, --profile-log writes one JSON line per timed event, and
+### --metrics-port serves the live numbers as JSON for long-running deployments.
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from contextlib import contextmanager
+from collections import deque
+import functools
+import threading
+import json
+import time
+
+maxSamples = 1000 # Recent durations kept per timer, for the percentiles
+
+class Metrics:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self):
+        self.timers = dict() # name -> {"count", "totalSeconds", "maxSeconds", "samples"}
+        self.counters = dict() # name -> count
+        self.sources = dict() # name -> function returning a dict (e.g. a cache's stats)
+        self.lock = threading.Lock()
+        self.logFile = None
+        self.startTime = time.time()
+
+    ############################################################################
+    # Name: record                                                             #
+    # Params: name (what was timed), seconds (how long it took), fields (any   #
+    # extra detail for the JSON log)                                           #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def record(self, name, seconds, **fields):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = {"count": 0, "totalSeconds": 0.0, "maxSeconds": 0.0, "samples": deque(maxlen = maxSamples)}
+                self.timers[name] = timer
+            timer["count"] += 1
+            timer["totalSeconds"] += seconds
+            timer["maxSeconds"] = max(timer["maxSeconds"], seconds)
+            timer["samples"].append(seconds)
+            if self.logFile is not None:
+                self.logFile.write(json.dumps(dict({"event": name, "seconds": seconds, "at": time.time()}, **fields)) + "\n")
+                self.logFile.flush()
+
+    ############################################################################
+    # Name: count                                                              #
+    # Params: name (what happened), amount (how many times)                    #
+    # Returns: None                                                            #
+    # Notes: For things worth counting but not timing, like cache hits.        #
+    ############################################################################
+    def count(self, name, amount = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    ############################################################################
+    # Name: timed                                                              #
+    # Params: name (what is being timed), fields (extra detail for the log)    #
+    # Returns: A context manager                                               #
+    # Notes: Time spent is recorded even if the block raises, and the error    #
+    # is counted under "<name>.errors".                                        #
+    ############################################################################
+    @contextmanager
+    def timed(self, name, **fields):
+        timerStart = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.count(name + ".errors")
+            raise
+        finally:
+            self.record(name, time.perf_counter() - timerStart, **fields)
+
+    ############################################################################
+    # Name: timedFunction                                                      #
+    # Params: name (what calls to the function are recorded as)                #
+    # Returns: A decorator                                                     #
+    # Notes: None                                                              #
+    ############################################################################
+    def timedFunction(self, name):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timed(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    ############################################################################
+    # Name: addSource                                                          #
+    # Params: name (section of the snapshot), statsFunc (takes nothing and     #
+    # returns a dict)                                                          #
+    # Returns: None                                                            #
+    # Notes: Lets the caches report their hit/miss numbers alongside the       #
+    # timers without this module knowing about them.                           #
+    ############################################################################
+    def addSource(self, name, statsFunc):
+        with self.lock:
+            self.sources[name] = statsFunc
+
+    ############################################################################
+    # Name: openLog                                                            #
+    # Params: logPath (file to append JSON lines to)                           #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def openLog(self, logPath):
+        with self.lock:
+            self.logFile = open(logPath, "a", encoding = "utf-8")
+
+    ############################################################################
+    # Name: snapshot                                                           #
+    # Params: None                                                             #
+    # Returns: A JSON-ready dict of every timer, counter and source            #
+    # Notes: None                                                              #
+    ############################################################################
+    def snapshot(self):
+        with self.lock:
+            timers = dict()
+            for name, timer in self.timers.items():
+                samples = sorted(timer["samples"])
+                timers[name] = {"count": timer["count"],
+                "totalSeconds": timer["totalSeconds"],
+                "meanSeconds": timer["totalSeconds"] / timer["count"],
+                "p50Seconds": samples[len(samples) // 2],
+                "p95Seconds": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+                "p99Seconds": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+                "maxSeconds": timer["maxSeconds"]}
+            counters = dict(self.counters)
+            sources = dict(self.sources)
+
+        sourceStats = dict()
+        for name, statsFunc in sources.items():
+            try:
+                sourceStats[name] = statsFunc()
+            except Exception as statsError: # A closed cache should not take the whole snapshot down
+                sourceStats[name] = {"error": repr(statsError)}
+        return {"uptimeSeconds": time.time() - self.startTime, "timers": timers, "counters": counters, "sources": sourceStats}
+
+    ############################################################################
+    # Name: summary                                                            #
+    # Params: None                                                             #
+    # Returns: A printable table of the snapshot                               #
+    # Notes: Slowest total first, since that is usually the question.          #
+    ############################################################################
+    def summary(self):
+        snapshot = self.snapshot()
+        lines = ["\n{:<34}{:>8}{:>11}{:>10}{:>10}{:>10}{:>10}".format("Timer", "Count", "Total s", "Mean s", "p95 s", "p99 s", "Max s")]
+        for name, timer in sorted(snapshot["timers"].items(), key = lambda item: -item[1]["totalSeconds"]):
+            lines.append("{:<34}{:>8}{:>11.3f}{:>10.4f}{:>10.4f}{:>10.4f}{:>10.4f}".format(name, timer["count"], timer["totalSeconds"],
+            timer["meanSeconds"], timer["p95Seconds"], timer["p99Seconds"], timer["maxSeconds"]))
+        if len(snapshot["counters"]) > 0:
+            lines.append("\n{:<34}{:>8}".format("Counter", "Count"))
+            for name, value in sorted(snapshot["counters"].items()):
+                lines.append("{:<34}{:>8}".format(name, value))
+        for name, stats in sorted(snapshot["sources"].items()):
+            lines.append("\n" + name + ": " + json.dumps(stats))
+        return "\n".join(lines)
+
+    ############################################################################
+    # Name: serve                                                              #
+    # Params: port (where to listen), host (defaults to this machine only)     #
+    # Returns: The HTTP server (already running on a daemon thread)            #
+    # Notes: GET /metrics gives the snapshot as JSON.                          #
+    ############################################################################
+    def serve(self, port, host = "127.0.0.1"):
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = json.dumps(metrics.snapshot()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target = server.serve_forever, name = "metrics", daemon = True).start()
+        return server
+
+metrics = Metrics() # Shared by everything in the process
+timed = metrics.timed
+timedFunction = metrics.timedFunction
+count = metrics.count
@@ -0,0 +1,235 @@
+### Precompiled intent matching for user commands
+### Everything the bot listens for (navigation keywords, "how do I" style question prefixes and
+### step numbers like "3rd" or "fifth") is compiled once into an Aho-Corasick automaton and a
+### couple of lookup tables, so each utterance is scanned a single time instead of once per keyword.
+### Run `python intentMatcher.py` for a per-utterance latency comparison with the old approach.
+from collections import deque
+import time
+import re
+
+ordinalWords = {"first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5, "sixth": 6,
+"seventh": 7, "eighth": 8, "ninth": 9, "tenth": 10}
+lastStep = "last" # stepReference gives this back for "the last step", since it depends on the recipe
+ordinalPattern = re.compile(r"^(-?\d+)(?:st|nd|rd|th)$") # "3rd", "10th", even "-1st"
+
+############################################################################
+# Name: boundedDistance                                                    #
+# Params: first, second (the strings to compare), limit (the largest       #
+# distance worth knowing about)                                            #
+# Returns: The Levenshtein distance, or limit + 1 if it is bigger than     #
+# limit                                                                    #
+# Notes: Only the cells within limit of the diagonal are filled in, and it #
+# gives up as soon as a whole row is over the limit. With the small limits #
+# the bot uses, that is a handful of cells instead of the full table.      #
+############################################################################
+def boundedDistance(first, second, limit):
+    if abs(len(first) - len(second)) > limit: # The length difference alone is too much
+        return limit + 1
+    tooFar = limit + 1
+    previousRow = [column if column <= limit else tooFar for column in range(len(second) + 1)]
+    for row in range(1, len(first) + 1):
+        currentRow = [tooFar] * (len(second) + 1)
+        if row <= limit:
+            currentRow[0] = row
+        lowColumn = max(1, row - limit)
+        highColumn = min(len(second), row + limit)
+        rowBest = currentRow[0]
+        for column in range(lowColumn, highColumn + 1):
+            substitution = previousRow[column - 1] + (first[row - 1] != second[column - 1])
+            cost = min(substitution, previousRow[column] + 1, currentRow[column - 1] + 1, tooFar)
+            currentRow[column] = cost
+            rowBest = min(rowBest, cost)
+        if rowBest > limit: # Every path from here only gets longer
+            return tooFar
+        previousRow = currentRow
+    return min(previousRow[len(second)], tooFar)
+
+class KeywordAutomaton:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: keywords (dict of keyword -> label)                              #
+    # Returns: None                                                            #
+    # Notes: Builds the trie and its failure links straight away.              #
+    ############################################################################
+    def __init__(self, keywords):
+        self.transitions = [dict()] # One dict of character -> next state per state
+        self.failures = [0]
+        self.outputs = [[]] # The (keyword, label) pairs that end at each state
+
+        for keyword, label in keywords.items():
+            state = 0
+            for character in keyword:
+                if character not in self.transitions[state]:
+                    self.transitions.append(dict())
+                    self.failures.append(0)
+                    self.outputs.append([])
+                    self.transitions[state][character] = len(self.transitions) - 1
+                state = self.transitions[state][character]
+            self.outputs[state].append((keyword, label))
+
+        # Breadth first, so every state's failure link is ready before its children need it
+        pending = deque(self.transitions[0].values())
+        while len(pending) > 0:
+            state = pending.popleft()
+            for character, child in self.transitions[state].items():
+                fallback = self.failures[state]
+                while fallback != 0 and character not in self.transitions[fallback]:
+                    fallback = self.failures[fallback]
+                failure = self.transitions[fallback].get(character, 0)
+                self.failures[child] = failure if failure != child else 0 # A first character can only fall back to the root
+                self.outputs[child] = self.outputs[child] + self.outputs[self.failures[child]]
+                pending.append(child)
+
+    ############################################################################
+    # Name: findAll                                                            #
+    # Params: text (already lowercased)                                        #
+    # Returns: A list of (keyword, label) for every keyword found, in the      #
+    # order they end in the text                                               #
+    # Notes: One pass over the text no matter how many keywords there are.     #
+    ############################################################################
+    def findAll(self, text):
+        found = []
+        state = 0
+        for character in text:
+            while state != 0 and character not in self.transitions[state]:
+                state = self.failures[state]
+            state = self.transitions[state].get(character, 0)
+            if len(self.outputs[state]) > 0:
+                found += self.outputs[state]
+        return found
+
+class IntentMatcher:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: botCommands (RecipeBot.botCommands), navTypes (the command types #
+    # that count as navigation), maxTypos (edit distance still accepted for a  #
+    # question prefix)                                                         #
+    # Returns: None                                                            #
+    # Notes: Everything is compiled here, once, when the bot class is built.   #
+    ############################################################################
+    def __init__(self, botCommands, navTypes, maxTypos = 1):
+        self.navTypes = navTypes
+        self.maxTypos = maxTypos
+        keywords = dict()
+        for navType in navTypes:
+            for navCmd in botCommands[navType]:
+                keywords[navCmd] = navType
+        self.automaton = KeywordAutomaton(keywords)
+
+        # Question prefixes are matched on their first few words, so keep them split up ahead of time
+        self.questions = [(question, question.lower(), len(question.split(" "))) for question in botCommands["questions"]]
+
+    ############################################################################
+    # Name: keywords                                                           #
+    # Params: text (what the user said)                                        #
+    # Returns: A dict of navigation type -> set of keywords found for it       #
+    # Notes: None                                                              #
+    ############################################################################
+    def keywords(self, text):
+        found = dict()
+        for keyword, navType in self.automaton.findAll(text.lower()):
+            found.setdefault(navType, set()).add(keyword)
+        return found
+
+    ############################################################################
+    # Name: question                                                           #
+    # Params: text (what the user said)                                        #
+    # Returns: The matching question with the rest of the user's words on the  #
+    # end (e.g. "How do I whisk eggs?"), or None                               #
+    # Notes: Compares the first few words of the text against each question,   #
+    # as many words as the question has, allowing up to maxTypos mistakes.     #
+    # The closest question wins, and ties go to the earlier one.               #
+    ############################################################################
+    def question(self, text):
+        splitText = text.lower().split(" ")
+        bestQuestion = None
+        lowestDistance = self.maxTypos + 1
+        for question, loweredQuestion, wordCount in self.questions:
+            if len(splitText) < wordCount:
+                continue
+            distance = boundedDistance(" ".join(splitText[:wordCount]), loweredQuestion, lowestDistance - 1) # Only a closer match is worth finishing
+            if distance < lowestDistance:
+                bestQuestion = question + " " + " ".join(splitText[wordCount:])
+                lowestDistance = distance
+                if distance == 0: # Nothing can beat an exact match
+                    break
+        return bestQuestion
+
+    ############################################################################
+    # Name: stepReference                                                      #
+    # Params: text (what the user said)                                        #
+    # Returns: The step number the user asked for (1 is the first step, and it #
+    # may be out of range), lastStep for "the last step", or None              #
+    # Notes: Only the first step number in the text counts.                    #
+    ############################################################################
+    def stepReference(self, text):
+        for token in text.lower().split(" "):
+            if token in ordinalWords:
+                return ordinalWords[token]
+            elif token == lastStep:
+                return lastStep
+            ordinalMatch = ordinalPattern.match(token)
+            if ordinalMatch is not None:
+                return int(ordinalMatch.group(1))
+        return None
+
+############################################################################
+# Name: legacyMatch                                                        #
+# Params: text (what the user said), botCommands, navTypes                 #
+# Returns: The same answer IntentMatcher gives for navigation and question #
+# prefixes                                                                 #
+# Notes: The old approach (one substring scan per keyword and full edit    #
+# distance tables), kept only for the benchmark below.                     #
+############################################################################
+def legacyMatch(text, botCommands, navTypes):
+    def fullDistance(first, second):
+        previousRow = list(range(len(second) + 1))
+        for row in range(1, len(first) + 1):
+            currentRow = [row] + [0] * len(second)
+            for column in range(1, len(second) + 1):
+                currentRow[column] = min(previousRow[column - 1] + (first[row - 1] != second[column - 1]), previousRow[column] + 1, currentRow[column - 1] + 1)
+            previousRow = currentRow
+        return previousRow[len(second)]
+
+    for navType in navTypes:
+        for navCmd in botCommands[navType]:
+            if navCmd in text.lower():
+                return text.lower()
+    bestCmd = None
+    lowestEditDist = float("inf")
+    for howToCmd in botCommands["questions"]:
+        splitDecision = text.lower().split(" ")
+        howToCmdSplit = howToCmd.lower().split(" ")
+        if len(splitDecision) >= len(howToCmdSplit):
+            editDist = fullDistance(" ".join(splitDecision[:len(howToCmdSplit)]), howToCmd.lower())
+            if editDist < lowestEditDist and editDist < 2:
+                bestCmd = howToCmd + " " + " ".join(splitDecision[len(howToCmdSplit):])
+                lowestEditDist = editDist
+    return bestCmd
+
+if __name__ == "__main__":
+    from recipeBot import RecipeBot
+    navTypes = RecipeBot.botCommandTypes["navTypes"]
+    matcher = IntentMatcher(RecipeBot.botCommands, navTypes)
+    utterances = ["next", "Take me to the 3rd step", "go back one", "How do I whisk the eggs until they are fluffy?",
+    "hwo do I fold in the flour", "How many steps are there?", "what temperature should the oven be at right now",
+    "I think I am done with this one", "can you repeat that please", "how to"]
+    rounds = 2000
+
+    compiledStart = time.perf_counter()
+    for _ in range(rounds):
+        for utterance in utterances:
+            if len(matcher.keywords(utterance)) == 0:
+                matcher.question(utterance)
+    compiledSeconds = time.perf_counter() - compiledStart
+
+    legacyStart = time.perf_counter()
+    for _ in range(rounds):
+        for utterance in utterances:
+            legacyMatch(utterance, RecipeBot.botCommands, navTypes)
+    legacySeconds = time.perf_counter() - legacyStart
+
+    perUtterance = rounds * len(utterances)
+    print("{:<12}{:>22}".format("Matcher", "Microseconds/utterance"))
+    print("{:<12}{:>22.2f}".format("compiled", compiledSeconds / perUtterance * 1e6))
+    print("{:<12}{:>22.2f}".format("legacy", legacySeconds / perUtterance * 1e6))
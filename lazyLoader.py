@@ -0,0 +1,145 @@
+### Lazy imports and background loading
+### spaCy, the search libraries and requests_html (with its whole pyppeteer/Chromium stack) are
+### slow to import, and the spaCy model is slow to load. Nothing here gets imported or loaded
+### until it is actually used, and everything records how long it took for --startup-profile.
+import importlib
+import threading
+import time
+
+processStart = time.perf_counter() # Roughly when the program started, since this gets imported first
+startupTimes = [] # (what was loaded, seconds it took, seconds since processStart when it finished)
+startupLock = threading.Lock()
+
+############################################################################
+# Name: recordTime                                                         #
+# Params: name (what was loaded), seconds (how long it took)               #
+# Returns: None                                                            #
+# Notes: None                                                              #
+############################################################################
+def recordTime(name, seconds):
+    with startupLock:
+        startupTimes.append((name, seconds, time.perf_counter() - processStart))
+
+############################################################################
+# Name: startupReport                                                      #
+# Params: None                                                             #
+# Returns: A printable report of everything recorded so far                #
+# Notes: Things loaded in the background overlap, so the durations do not  #
+# add up to the total. The "finished at" column shows what overlapped.     #
+############################################################################
+def startupReport():
+    with startupLock:
+        lines = ["\n{:<40}{:>12}{:>16}".format("Loaded", "Seconds", "Finished at")]
+        for name, seconds, finishedAt in startupTimes:
+            lines.append("{:<40}{:>12.3f}{:>16.3f}".format(name, seconds, finishedAt))
+    return "\n".join(lines)
+
+class LazyModule:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: name (the module to import, e.g. "nltk.metrics.distance")        #
+    # Returns: None                                                            #
+    # Notes: Nothing gets imported here. The module is imported the first time #
+    # one of its attributes is used.                                           #
+    ############################################################################
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    ############################################################################
+    # Name: _load                                                              #
+    # Params: None                                                             #
+    # Returns: The real module                                                 #
+    # Notes: None                                                              #
+    ############################################################################
+    def _load(self):
+        if self._module is None:
+            with self._lock: # Two threads reaching for it at once should only import it once
+                if self._module is None:
+                    importStart = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    recordTime("import " + self._name, time.perf_counter() - importStart)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+############################################################################
+# Name: lazyImport                                                         #
+# Params: name (the module to import)                                      #
+# Returns: A LazyModule standing in for it                                 #
+# Notes: None                                                              #
+############################################################################
+def lazyImport(name):
+    return LazyModule(name)
+
+class BackgroundLoader:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: name (what is being loaded, for the report), loadFunc (takes no  #
+    # arguments and returns the loaded thing)                                  #
+    # Returns: None                                                            #
+    # Notes: Nothing starts until start() or get() is called.                  #
+    ############################################################################
+    def __init__(self, name, loadFunc):
+        self.name = name
+        self.loadFunc = loadFunc
+        self.thread = None
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    ############################################################################
+    # Name: start                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Kicks off loading in a daemon thread. Calling it again does       #
+    # nothing.                                                                 #
+    ############################################################################
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target = self._run, name = self.name, daemon = True)
+                self.thread.start()
+
+    ############################################################################
+    # Name: _run                                                               #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Any error is kept and raised again from get(), in the thread that #
+    # actually needs the result.                                               #
+    ############################################################################
+    def _run(self):
+        loadStart = time.perf_counter()
+        try:
+            self.result = self.loadFunc()
+        except BaseException as loadError:
+            self.error = loadError
+        finally:
+            recordTime(self.name, time.perf_counter() - loadStart)
+            self.done.set()
+
+    ############################################################################
+    # Name: get                                                                #
+    # Params: None                                                             #
+    # Returns: Whatever loadFunc returned                                      #
+    # Notes: Starts loading if nobody has yet, then waits for it.              #
+    ############################################################################
+    def get(self):
+        self.start()
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    ############################################################################
+    # Name: isReady                                                            #
+    # Params: None                                                             #
+    # Returns: Boolean                                                         #
+    # Notes: True once loading has finished (successfully or not).             #
+    ############################################################################
+    def isReady(self):
+        return self.done.is_set()
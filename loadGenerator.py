@@ -0,0 +1,459 @@
+### Load generator for the dialogue
+### Plays many cooking sessions at once against the bot and reports how long turns take, so we can
+### tell how many cooks a process can keep up with and catch a slower dialogue path before users
+### do. Sessions are either replayed from transcripts (recorded with --record on recipeBot.py or
+### recipeServer.py) or made up: a mix of navigation, jumps to the nth step and "how do I"
+### questions over the benchmark's recipes.
+###
+### By default the sessions run in this process, against RecipeBot directly, with the benchmark's
+### stand-ins for everything upstream (recorded ConceptNet answers from a local server, and stub
+### searches). With --server they go over HTTP to a running recipeServer.py or preforkServer.py
+### instead, and the recipes are served to it from a local page server, so it never scrapes
+### anything real either.
+###
+###   python loadGenerator.py run --concurrency 16 --sessions 200 --output before.json
+###   python loadGenerator.py run --transcripts sessions.jsonl --server 127.0.0.1:8337
+###   python loadGenerator.py compare before.json after.json
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+from recipeBot import RecipeBot
+from recipeBenchmark import FixtureServer, fixturesDir, currentCommit
+from recipeClient import RecipeClient
+from recipeScraper import parseRecipePage
+from searchBackends import SearchPrefetcher, StubBackend, VIDEO, WEB
+from batchAnnotate import headlessBot
+from transcripts import readTranscripts
+import threading
+import argparse
+import platform
+import random
+import json
+import time
+import sys
+import os
+import re
+
+turnKinds = ["start", "choice", "navigation", "jump", "question"]
+navigationCommands = ["next", "next", "next", "go back", "repeat", "what now"] # Weighted towards moving on, like real cooks
+questions = ["how do I do that?", "how do I prepare that?", "how do I cook those?", "how many steps are there?", "what is the next step?"]
+percentiles = [50, 90, 99]
+
+############################################################################
+# Name: ordinal                                                            #
+# Params: number                                                           #
+# Returns: The number written as "1st", "2nd", "3rd", "11th" and so on     #
+# Notes: None                                                              #
+############################################################################
+def ordinal(number):
+    if number % 100 in (11, 12, 13):
+        return str(number) + "th"
+    return str(number) + {1: "st", 2: "nd", 3: "rd"}.get(number % 10, "th")
+
+############################################################################
+# Name: turnKind                                                           #
+# Params: text (one thing the user typed)                                  #
+# Returns: Which of turnKinds it is                                        #
+# Notes: Only used to break the latencies down, so a rough guess is fine.  #
+############################################################################
+def turnKind(text):
+    lowered = text.strip().lower()
+    if lowered in ("1", "2", "y", "n", "yes", "no"):
+        return "choice"
+    if "step" in lowered and re.search(r"\d|first|last|second|third", lowered) and not lowered.startswith("how"):
+        return "jump"
+    if lowered.startswith("how") or lowered.startswith("what is") or lowered.startswith("which") or lowered.endswith("?"):
+        return "question"
+    return "navigation"
+
+############################################################################
+# Name: syntheticTurns                                                     #
+# Params: recipe (the recipe dict), turnCount (about how many turns),      #
+# randomizer (a random.Random, so runs can be repeated)                    #
+# Returns: A list of what the user types, starting with "2"                #
+# Notes: "How do I" questions are followed by an answer to the bot's       #
+# "was that helpful?" question, the way a real user would.                 #
+############################################################################
+def syntheticTurns(recipe, turnCount, randomizer):
+    stepCount = max(1, len(recipe["instructions"]))
+    turns = ["2"] # Straight to the first step
+    while len(turns) < turnCount:
+        roll = randomizer.random()
+        if roll < 0.55:
+            turns.append(randomizer.choice(navigationCommands))
+        elif roll < 0.75:
+            turns.append("take me to the " + ordinal(randomizer.randint(1, stepCount)) + " step")
+        else:
+            question = randomizer.choice(questions)
+            turns.append(question)
+            if question.startswith("how do"):
+                turns.append(randomizer.choice(["y", "n"]))
+    return turns
+
+############################################################################
+# Name: fixtureRecipes                                                     #
+# Params: fixtures (the benchmark fixtures directory)                      #
+# Returns: A list of (name, recipe dict) for every saved page              #
+# Notes: None                                                              #
+############################################################################
+def fixtureRecipes(fixtures = fixturesDir):
+    recipes = []
+    pagesDir = os.path.join(fixtures, "pages")
+    for pageName in sorted(os.listdir(pagesDir)):
+        if pageName.endswith(".html"):
+            with open(os.path.join(pagesDir, pageName), encoding = "utf-8") as pageFile:
+                recipeData = parseRecipePage([pageFile.read()])
+            if recipeData is not None:
+                recipes.append((pageName[:-len(".html")], recipeData))
+    return recipes
+
+class RecipePageServer:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: recipes (list of recipe dicts)                                   #
+    # Returns: None                                                            #
+    # Notes: Serves /recipes/<n>.html as a page with the recipe in its         #
+    # JSON-LD, which is all the scraper needs, so a server under test can load #
+    # recorded or fixture recipes without touching the real sites.             #
+    ############################################################################
+    def __init__(self, recipes):
+        self.pages = []
+        for recipeData in recipes:
+            recipeNode = {"@context": "http://schema.org", "@type": "Recipe", "name": recipeData.get("recipeName", ""),
+            "recipeIngredient": recipeData["ingredients"], "recipeInstructions": [{"@type": "HowToStep", "text": step} for step in recipeData["instructions"]]}
+            self.pages.append(("<html><head><script type=\"application/ld+json\">" + json.dumps(recipeNode) + "</script></head><body></body></html>").encode("utf-8"))
+        pageServer = self
+
+        class PageHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                pageServer._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1])
+        self.thread = threading.Thread(target = self.server.serve_forever, name = "recipe pages", daemon = True)
+        self.thread.start()
+
+    ############################################################################
+    # Name: _handle                                                            #
+    # Params: handler (the request being answered)                             #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def _handle(self, handler):
+        match = re.match(r"^/recipes/(\d+)\.html$", handler.path)
+        pageIdx = int(match.group(1)) if match is not None else -1
+        body = self.pages[pageIdx] if 0 <= pageIdx < len(self.pages) else b"Not found"
+        handler.send_response(200 if 0 <= pageIdx < len(self.pages) else 404)
+        handler.send_header("Content-Type", "text/html; charset=utf-8")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    ############################################################################
+    # Name: pageURL                                                            #
+    # Params: recipeIdx (position in the recipes given to __init__)            #
+    # Returns: The URL the recipe is served at                                 #
+    # Notes: None                                                              #
+    ############################################################################
+    def pageURL(self, recipeIdx):
+        return self.url + "/recipes/" + str(recipeIdx) + ".html"
+
+    ############################################################################
+    # Name: close                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class LoadRecorder:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Collects every turn's latency from every virtual user.            #
+    ############################################################################
+    def __init__(self):
+        self.latencies = dict((kind, []) for kind in turnKinds)
+        self.errors = []
+        self.sessions = 0
+        self.lock = threading.Lock()
+
+    ############################################################################
+    # Name: add                                                                #
+    # Params: kind (one of turnKinds), seconds                                 #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def add(self, kind, seconds):
+        with self.lock:
+            self.latencies[kind].append(seconds)
+
+    ############################################################################
+    # Name: fail                                                               #
+    # Params: description (what went wrong, and in which session)              #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def fail(self, description):
+        with self.lock:
+            self.errors.append(description)
+
+    ############################################################################
+    # Name: finishSession                                                      #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def finishSession(self):
+        with self.lock:
+            self.sessions += 1
+
+############################################################################
+# Name: summarize                                                          #
+# Params: latencies (list of seconds)                                      #
+# Returns: A dict of the count, mean, max and percentiles, in milliseconds #
+# Notes: Nearest-rank percentiles, so p99 of a few turns is just the max.  #
+############################################################################
+def summarize(latencies):
+    if len(latencies) == 0:
+        return {"count": 0}
+    ordered = sorted(latencies)
+    summary = {"count": len(ordered), "meanMs": 1000 * sum(ordered) / len(ordered), "maxMs": 1000 * ordered[-1]}
+    for percentile in percentiles:
+        summary["p" + str(percentile) + "Ms"] = 1000 * ordered[max(0, -(-percentile * len(ordered) // 100) - 1)]
+    return summary
+
+############################################################################
+# Name: runLocalSession                                                    #
+# Params: recipeURL, recipeData, turns (what to type), recorder            #
+# (LoadRecorder), thinkTime (seconds between turns)                        #
+# Returns: None                                                            #
+# Notes: The bot is built without __init__, so nothing gets fetched: the   #
+# recipe is already in hand. Parsing counts as the session's "start" turn. #
+############################################################################
+def runLocalSession(recipeURL, recipeData, turns, recorder, thinkTime = 0.0):
+    bot = headlessBot(dict(recipeData, url = recipeURL))
+    turnStart = time.perf_counter()
+    try:
+        bot.startConversation()
+        recorder.add("start", time.perf_counter() - turnStart)
+        for text in turns:
+            if bot.isDone():
+                break
+            if thinkTime > 0:
+                time.sleep(thinkTime)
+            turnStart = time.perf_counter()
+            bot.handleTurn(text)
+            recorder.add(turnKind(text), time.perf_counter() - turnStart)
+    except Exception as sessionError:
+        recorder.fail(recipeURL + ": " + repr(sessionError))
+    recorder.finishSession()
+
+############################################################################
+# Name: runRemoteSession                                                   #
+# Params: host, port (the server under test), recipeURL (a page on the     #
+# RecipePageServer), turns, recorder, thinkTime (same as runLocalSession)  #
+# Returns: None                                                            #
+# Notes: Every virtual user gets its own keep-alive connection, like a     #
+# real client would.                                                       #
+############################################################################
+def runRemoteSession(host, port, recipeURL, turns, recorder, thinkTime = 0.0):
+    client = RecipeClient(host, port)
+    try:
+        turnStart = time.perf_counter()
+        response = client.start(recipeURL)
+        recorder.add("start", time.perf_counter() - turnStart)
+        for text in turns:
+            if "error" in response or response.get("done"):
+                break
+            if thinkTime > 0:
+                time.sleep(thinkTime)
+            turnStart = time.perf_counter()
+            response = client.say(text)
+            recorder.add(turnKind(text), time.perf_counter() - turnStart)
+        if "error" in response:
+            recorder.fail(recipeURL + ": " + response["error"])
+        client.close()
+    except Exception as sessionError:
+        recorder.fail(recipeURL + ": " + repr(sessionError))
+    recorder.finishSession()
+
+############################################################################
+# Name: buildSessions                                                      #
+# Params: transcriptsPath (file from --record, or None for made up         #
+# sessions), sessionCount, turnsPerSession, seed, fixtures                 #
+# Returns: A list of (recipe URL, recipe dict, turns), sessionCount long   #
+# Notes: Recorded sessions are played round robin if more are asked for    #
+# than were recorded.                                                      #
+############################################################################
+def buildSessions(transcriptsPath, sessionCount, turnsPerSession, seed, fixtures = fixturesDir):
+    if transcriptsPath is not None:
+        recorded = [(transcript["url"], transcript["recipe"], transcript["turns"]) for transcript in readTranscripts(transcriptsPath)]
+        if len(recorded) == 0:
+            raise ValueError("There are no complete sessions in " + transcriptsPath)
+        sessionCount = sessionCount if sessionCount is not None else len(recorded)
+        return [recorded[sessionIdx % len(recorded)] for sessionIdx in range(sessionCount)]
+
+    randomizer = random.Random(seed)
+    recipes = fixtureRecipes(fixtures)
+    sessions = []
+    for sessionIdx in range(sessionCount if sessionCount is not None else 50):
+        recipeName, recipeData = recipes[sessionIdx % len(recipes)]
+        sessions.append(("fixture:" + recipeName, recipeData, syntheticTurns(recipeData, turnsPerSession, randomizer)))
+    return sessions
+
+############################################################################
+# Name: runLoad                                                            #
+# Params: sessions (from buildSessions), concurrency (virtual users at     #
+# once), server ((host, port) to test over HTTP, or None for in-process),  #
+# thinkTime (seconds between a user's turns), fixtures, latency (seconds   #
+# the ConceptNet stand-in adds to every answer)                            #
+# Returns: The full results dict                                           #
+# Notes: In-process runs switch off both persistent caches, so every run   #
+# does the same work, just like recipeBenchmark.py.                        #
+############################################################################
+def runLoad(sessions, concurrency, server = None, thinkTime = 0.0, fixtures = fixturesDir, latency = 0.0):
+    recorder = LoadRecorder()
+    standIn = None
+    pageServer = None
+    if server is None:
+        standIn = FixtureServer(fixtures, latency)
+        with open(os.path.join(fixtures, "search.json")) as searchFile:
+            recordedSearches = json.load(searchFile)
+        RecipeBot.conceptNetURL = standIn.url + "/c/en/"
+        RecipeBot.conceptCache = None
+        RecipeBot.recipeStore = None
+        RecipeBot.conceptIndex = None
+        RecipeBot.searcher = SearchPrefetcher({VIDEO: StubBackend("video", recordedSearches.get(VIDEO)), WEB: StubBackend("web", recordedSearches.get(WEB))})
+        RecipeBot.modelLoader.get() # Loading the model is not what is being measured
+        sessionFuncs = [lambda url = url, recipe = recipe, turns = turns: runLocalSession(url, recipe, turns, recorder, thinkTime) for url, recipe, turns in sessions]
+    else:
+        pageServer = RecipePageServer([recipe for _, recipe, _ in sessions])
+        sessionFuncs = [lambda sessionIdx = sessionIdx, turns = turns: runRemoteSession(server[0], server[1], pageServer.pageURL(sessionIdx), turns, recorder, thinkTime)
+        for sessionIdx, (_, _, turns) in enumerate(sessions)]
+
+    runStart = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers = max(1, concurrency), thread_name_prefix = "virtual user") as pool:
+            for sessionFunc in sessionFuncs:
+                pool.submit(sessionFunc)
+    finally:
+        seconds = time.perf_counter() - runStart
+        if standIn is not None:
+            standIn.close()
+        if pageServer is not None:
+            pageServer.close()
+
+    allTurns = [latency for kind in turnKinds if kind != "start" for latency in recorder.latencies[kind]]
+    return {"commit": currentCommit(),
+    "python": platform.python_version(),
+    "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "settings": {"concurrency": concurrency, "sessions": len(sessions), "target": "in-process" if server is None else server[0] + ":" + str(server[1]),
+    "thinkTime": thinkTime, "latency": latency},
+    "seconds": seconds,
+    "sessionsFinished": recorder.sessions,
+    "turns": len(allTurns),
+    "turnsPerSecond": len(allTurns) / seconds if seconds > 0 else 0.0,
+    "sessionsPerSecond": recorder.sessions / seconds if seconds > 0 else 0.0,
+    "errors": len(recorder.errors),
+    "errorSamples": recorder.errors[:10],
+    "turnLatency": summarize(allTurns),
+    "byKind": dict((kind, summarize(recorder.latencies[kind])) for kind in turnKinds)}
+
+############################################################################
+# Name: printResults                                                       #
+# Params: results (from runLoad)                                           #
+# Returns: None                                                            #
+# Notes: None                                                              #
+############################################################################
+def printResults(results):
+    settings = results["settings"]
+    print(str(settings["sessions"]) + " sessions against " + settings["target"] + " with " + str(settings["concurrency"]) + " at once: " +
+    "{:.1f} turns/s, {:.2f} sessions/s, {} errors".format(results["turnsPerSecond"], results["sessionsPerSecond"], results["errors"]))
+    print("{:<12}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}".format("Turn", "Count", "Mean ms", "p50 ms", "p90 ms", "p99 ms", "Max ms"))
+    for kind, summary in list(results["byKind"].items()) + [("all turns", results["turnLatency"])]:
+        if summary["count"] > 0:
+            print("{:<12}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}".format(kind, summary["count"], summary["meanMs"], summary["p50Ms"],
+            summary["p90Ms"], summary["p99Ms"], summary["maxMs"]))
+    for errorSample in results["errorSamples"]:
+        print("  error: " + errorSample)
+
+############################################################################
+# Name: compareResults                                                     #
+# Params: before, after (results from two runs), threshold (how much       #
+# slower a percentile may get, as a fraction, before it counts as a        #
+# regression), minMs (smaller differences than this are noise)             #
+# Returns: The list of what regressed                                      #
+# Notes: Lower throughput counts too, and so does any new error.           #
+############################################################################
+def compareResults(before, after, threshold = 0.25, minMs = 0.5):
+    regressions = []
+    print("Comparing " + str(before.get("commit")) + " -> " + str(after.get("commit")))
+    print("{:<22}{:>12}{:>12}{:>9}".format("Measure", "Before", "After", "Change"))
+    for kind, summaryBefore, summaryAfter in [("all turns", before["turnLatency"], after["turnLatency"])] + \
+    [(kind, before["byKind"][kind], after["byKind"][kind]) for kind in turnKinds if kind in before["byKind"] and kind in after["byKind"]]:
+        if summaryBefore["count"] == 0 or summaryAfter["count"] == 0:
+            continue
+        for percentile in percentiles:
+            field = "p" + str(percentile) + "Ms"
+            change = (summaryAfter[field] - summaryBefore[field]) / summaryBefore[field] if summaryBefore[field] > 0 else 0.0
+            regressed = change > threshold and summaryAfter[field] - summaryBefore[field] > minMs
+            if regressed:
+                regressions.append(kind + " " + field)
+            print("{:<22}{:>12.2f}{:>12.2f}{:>8.0%}{}".format(kind + " " + field, summaryBefore[field], summaryAfter[field], change, "!" if regressed else " "))
+    change = (after["turnsPerSecond"] - before["turnsPerSecond"]) / before["turnsPerSecond"] if before["turnsPerSecond"] > 0 else 0.0
+    if change < -threshold:
+        regressions.append("turnsPerSecond")
+    print("{:<22}{:>12.1f}{:>12.1f}{:>8.0%}{}".format("turns/s", before["turnsPerSecond"], after["turnsPerSecond"], change, "!" if change < -threshold else " "))
+    if after["errors"] > before["errors"]:
+        regressions.append("errors")
+    print("{:<22}{:>12}{:>12}".format("errors", before["errors"], after["errors"]))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Put " + RecipeBot.name + " under load with recorded or made up cooking sessions.")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+    runParser = subparsers.add_parser("run", help = "Run the sessions and report latency and throughput")
+    runParser.add_argument("--transcripts", help = "Replay the sessions in this file (from --record) instead of making them up")
+    runParser.add_argument("--sessions", type = int, help = "Sessions to run (defaults to every recorded one, or 50 made up ones)")
+    runParser.add_argument("--turns", type = int, default = 20, help = "About how many turns each made up session takes")
+    runParser.add_argument("--seed", type = int, default = 337, help = "Seed for the made up sessions, so runs can be compared")
+    runParser.add_argument("--concurrency", type = int, default = 8, help = "Sessions running at once")
+    runParser.add_argument("--think-time", type = float, default = 0.0, help = "Seconds each user waits between turns")
+    runParser.add_argument("--server", metavar = "HOST:PORT", help = "Send the sessions to a running recipeServer.py or preforkServer.py instead of running them here")
+    runParser.add_argument("--fixtures", default = fixturesDir, help = "Directory of recorded pages and responses for the stand-ins")
+    runParser.add_argument("--latency", type = float, default = 0.0, help = "Seconds the ConceptNet stand-in adds to every answer")
+    runParser.add_argument("--output", help = "Write the results to this JSON file")
+    compareParser = subparsers.add_parser("compare", help = "Compare two result files")
+    compareParser.add_argument("before")
+    compareParser.add_argument("after")
+    compareParser.add_argument("--threshold", type = float, default = 0.25, help = "Fraction slower a percentile may get before it counts as a regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        server = None
+        if args.server is not None:
+            host, port = args.server.rsplit(":", 1)
+            server = (host, int(port))
+        try:
+            sessions = buildSessions(args.transcripts, args.sessions, args.turns, args.seed, args.fixtures)
+        except (OSError, ValueError) as sessionsError:
+            sys.exit("Could not load the sessions: " + str(sessionsError))
+        results = runLoad(sessions, args.concurrency, server, args.think_time, args.fixtures, args.latency)
+        printResults(results)
+        if args.output is not None:
+            with open(args.output, "w") as outputFile:
+                json.dump(results, outputFile, indent = 2)
+    else:
+        with open(args.before) as beforeFile, open(args.after) as afterFile:
+            regressions = compareResults(json.load(beforeFile), json.load(afterFile), args.threshold)
+        if len(regressions) > 0:
+            sys.exit("Regressed: " + ", ".join(regressions))
@@ -0,0 +1,500 @@
+### Pre-forked conversation server
+### recipeServer.py runs every session in one process, so it only ever uses one core for parsing.
+### Running several copies of it would load en_core_web_sm (and build the food matcher, intent
+### matcher and word lists) once per copy. This loads all of that once, in a supervisor process,
+### freezes it out of the garbage collector's reach and then forks the workers, so they all share
+### those pages copy-on-write. Each worker is a recipeServer.py SessionManager of its own, and the
+### supervisor routes messages to them over a socket per worker: a session stays on the worker
+### that started it, new sessions go to the worker with the fewest, and batches of recipes to
+### parse (see batchAnnotate.py) go to the one with the least outstanding work.
+###
+### The HTTP API and JSON lines mode are the same as recipeServer.py's. GET /stats adds every
+### worker's memory from /proc: RSS, PSS (shared pages split between the processes sharing them)
+### and how much of it is shared or private.
+###
+### `python preforkServer.py --measure recipes.jsonl --measure-workers 1,2,4` parses the recipes
+### once per worker count instead of serving, and reports throughput and memory per worker for
+### each, to help size a machine.
+from recipeBot import RecipeBot
+from recipeServer import SessionManager, serveHTTP, serveStdio
+from recipeStore import RecipeStore
+from conceptCache import ConceptCache
+from conceptPrefetch import defaultConcurrency
+from batchAnnotate import startWorker, readRecipes, chunked, defaultChunkSize
+from batchParse import defaultBatchSize
+from foodMatcher import defaultPhrasesPath
+from termModel import defaultConfidence
+from instrumentation import metrics
+import asyncio
+import argparse
+import socket
+import signal
+import json
+import time
+import uuid
+import sys
+import gc
+import os
+
+defaultWorkers = os.cpu_count() or 1
+messageLimit = 64 * 1024 * 1024 # Longest line either side will read; a batch of parsed recipes can be big
+memoryFields = {"Rss": "rssKB", "Pss": "pssKB", "Shared_Clean": "sharedKB", "Shared_Dirty": "sharedKB", "Private_Clean": "privateKB", "Private_Dirty": "privateKB"}
+
+############################################################################
+# Name: processMemory                                                      #
+# Params: pid (any process, this one by default)                           #
+# Returns: A dict of rssKB, pssKB, sharedKB and privateKB, or an empty     #
+# dict where /proc is not available                                        #
+# Notes: smaps_rollup is what shows the sharing. RSS counts every shared   #
+# page in full in every worker, while PSS splits each one between the      #
+# processes using it, so PSS adds up to what the workers really cost.      #
+############################################################################
+def processMemory(pid = None):
+    memory = dict()
+    try:
+        with open("/proc/" + str(pid if pid is not None else os.getpid()) + "/smaps_rollup") as smapsFile:
+            for line in smapsFile:
+                pieces = line.split()
+                field = pieces[0].rstrip(":") if len(pieces) == 3 else None
+                if field in memoryFields:
+                    memory[memoryFields[field]] = memory.get(memoryFields[field], 0) + int(pieces[1])
+    except (OSError, ValueError):
+        pass
+    return memory
+
+############################################################################
+# Name: loadShared                                                         #
+# Params: None                                                             #
+# Returns: None                                                            #
+# Notes: Everything every worker needs and never writes to: the spaCy      #
+# model, the food matcher, and the word lists and intent matcher that are  #
+# built when RecipeBot is defined. gc.freeze moves all of it into the      #
+# permanent generation, so collections in the workers never touch (and so  #
+# never copy) those pages.                                                 #
+############################################################################
+def loadShared():
+    RecipeBot.modelLoader.get()
+    RecipeBot.foodMatcherLoader.get()
+    gc.freeze()
+
+############################################################################
+# Name: runWorker                                                          #
+# Params: workerSocket (this worker's end of its socket), settings (dict   #
+# of the command line options)                                             #
+# Returns: Never; the process exits once the supervisor goes away          #
+# Notes: Runs in the forked child. The caches and the recipe store are     #
+# opened here, since SQLite connections must not cross a fork.             #
+############################################################################
+def runWorker(workerSocket, settings):
+    exitCode = 0
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl-C is for the supervisor, which then closes the sockets
+        startWorker(settings)
+        if settings["recipeStorePath"] is not None:
+            RecipeBot.recipeStore = RecipeStore(settings["recipeStorePath"], version = RecipeBot.parserVersion())
+        RecipeBot.progressiveParsing = settings["progressive"]
+        asyncio.run(serveWorker(workerSocket, settings))
+    except Exception as workerError:
+        print("Worker " + str(os.getpid()) + " stopped: " + repr(workerError), file = sys.stderr)
+        exitCode = 1
+    finally:
+        os._exit(exitCode) # Never run the supervisor's own cleanup in a child
+
+############################################################################
+# Name: serveWorker                                                        #
+# Params: workerSocket, settings (same as runWorker)                       #
+# Returns: None, once the supervisor closes the socket                     #
+# Notes: Every message is handled in its own task, like serveStdio. Each   #
+# response carries the message's requestID back, along with how many       #
+# sessions the worker has and whether this one is still live, so the       #
+# supervisor's routing stays current without asking. Sessions evicted for  #
+# being idle are reported on their own, as {"evicted": [ids]} with no      #
+# requestID.                                                               #
+############################################################################
+async def serveWorker(workerSocket, settings):
+    manager = SessionManager(settings["maxSessions"], settings["idleTimeout"], settings["turnTimeout"], settings["threads"])
+    reader, writer = await asyncio.open_connection(sock = workerSocket, limit = messageLimit)
+    writeLock = asyncio.Lock()
+
+    async def reportEvicted(sessionIDs):
+        async with writeLock:
+            writer.write((json.dumps({"evicted": sessionIDs, "workerSessions": len(manager.sessions)}) + "\n").encode("utf-8"))
+            await writer.drain()
+
+    evictor = asyncio.ensure_future(manager.evictIdle(reportEvicted))
+
+    async def handleMessage(message):
+        requestID = message.pop("requestID", None)
+        try:
+            response = await manager.handle(message)
+        except Exception as handleError:
+            response = {"session": message.get("session"), "error": "Something went wrong in the worker: " + repr(handleError)}
+        response["requestID"] = requestID
+        response["live"] = message.get("session") in manager.sessions
+        response["workerSessions"] = len(manager.sessions)
+        async with writeLock:
+            writer.write((json.dumps(response) + "\n").encode("utf-8"))
+            await writer.drain()
+
+    pending = set()
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        task = asyncio.ensure_future(handleMessage(json.loads(line)))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if len(pending) > 0:
+        await asyncio.wait(pending)
+    evictor.cancel()
+    manager.executor.shutdown(wait = False)
+
+class WorkerProcess:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: pid (the forked worker), supervisorSocket (the supervisor's end  #
+    # of the worker's socket), onSessionsGone (called with this worker and the #
+    # ids of sessions it no longer has, or None for all of them)               #
+    # Returns: None                                                            #
+    # Notes: The streams are only opened in connect(), once there is an event  #
+    # loop to open them on.                                                    #
+    ############################################################################
+    def __init__(self, pid, supervisorSocket, onSessionsGone):
+        self.pid = pid
+        self.supervisorSocket = supervisorSocket
+        self.onSessionsGone = onSessionsGone
+        self.reader = None
+        self.writer = None
+        self.readerTask = None
+        self.pending = dict() # requestID -> future for the response
+        self.nextRequestID = 0
+        self.sessions = 0 # As last reported by the worker
+        self.alive = True
+        self.handled = 0
+
+    ############################################################################
+    # Name: connect                                                            #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(sock = self.supervisorSocket, limit = messageLimit)
+        self.readerTask = asyncio.ensure_future(self._readResponses())
+
+    ############################################################################
+    # Name: request                                                            #
+    # Params: message (what to hand the worker's SessionManager)               #
+    # Returns: The worker's response dict                                      #
+    # Notes: Any number of requests can be waiting on one worker at once; the  #
+    # responses are matched back up by requestID.                              #
+    ############################################################################
+    async def request(self, message):
+        if not self.alive:
+            return {"session": message.get("session"), "error": "The worker for that session has stopped."}
+        requestID = self.nextRequestID
+        self.nextRequestID += 1
+        response = asyncio.get_running_loop().create_future()
+        self.pending[requestID] = response
+        self.writer.write((json.dumps(dict(message, requestID = requestID)) + "\n").encode("utf-8"))
+        await self.writer.drain()
+        return await response
+
+    ############################################################################
+    # Name: _readResponses                                                     #
+    # Params: None                                                             #
+    # Returns: None, once the worker's socket closes                           #
+    # Notes: If the worker dies, everything still waiting on it gets an error  #
+    # response instead of hanging, and its sessions are forgotten.             #
+    ############################################################################
+    async def _readResponses(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                self.sessions = response.pop("workerSessions", self.sessions)
+                if "evicted" in response and "requestID" not in response: # Not an answer to anything, the worker evicted idle sessions
+                    self.onSessionsGone(self, response["evicted"])
+                    continue
+                self.handled += 1
+                waiting = self.pending.pop(response.pop("requestID", None), None)
+                if waiting is not None and not waiting.done():
+                    waiting.set_result(response)
+        except (ValueError, ConnectionError):
+            pass
+        self.alive = False
+        for waiting in self.pending.values():
+            if not waiting.done():
+                waiting.set_result({"error": "The worker stopped while handling this.", "live": False})
+        self.pending.clear()
+        self.onSessionsGone(self, None)
+
+    ############################################################################
+    # Name: stats                                                              #
+    # Params: None                                                             #
+    # Returns: A dict describing the worker, including its memory              #
+    # Notes: None                                                              #
+    ############################################################################
+    def stats(self):
+        return dict({"pid": self.pid, "alive": self.alive, "sessions": self.sessions, "outstanding": len(self.pending), "handled": self.handled},
+        **(processMemory(self.pid) if self.alive else dict()))
+
+class PreforkSupervisor:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: workers (processes to fork), settings (dict of the command line  #
+    # options, handed to every worker)                                         #
+    # Returns: None                                                            #
+    # Notes: Nothing is loaded or forked until start().                        #
+    ############################################################################
+    def __init__(self, workers, settings):
+        self.workerCount = max(1, workers)
+        self.settings = settings
+        self.maxSessions = settings["maxSessions"]
+        self.workers = []
+        self.sessions = dict() # session id -> the WorkerProcess it lives on
+        self.finished = 0
+        self.evicted = 0 # Sessions a worker evicted for being idle, or lost when it stopped
+
+    ############################################################################
+    # Name: start                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Has to run before any event loop or thread pool exists in this    #
+    # process, since only the forking thread survives in the children. The     #
+    # supervisor's end of every earlier worker's socket is closed in each new  #
+    # child, so a worker only ever sees its own.                               #
+    ############################################################################
+    def start(self):
+        loadShared()
+        for _ in range(self.workerCount):
+            supervisorSocket, workerSocket = socket.socketpair()
+            pid = os.fork()
+            if pid == 0:
+                supervisorSocket.close()
+                for worker in self.workers:
+                    worker.supervisorSocket.close()
+                runWorker(workerSocket, self.settings)
+            workerSocket.close()
+            self.workers.append(WorkerProcess(pid, supervisorSocket, self._sessionsGone))
+
+    ############################################################################
+    # Name: connect                                                            #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Call from inside the event loop, after start().                   #
+    ############################################################################
+    async def connect(self):
+        for worker in self.workers:
+            await worker.connect()
+
+    ############################################################################
+    # Name: handle                                                             #
+    # Params: message (same as SessionManager.handle)                          #
+    # Returns: The response dict                                               #
+    # Notes: The supervisor picks the session id, so it knows where the        #
+    # session lives before the worker has even answered.                       #
+    ############################################################################
+    async def handle(self, message):
+        liveWorkers = [worker for worker in self.workers if worker.alive]
+        if len(liveWorkers) == 0:
+            return {"error": "Every worker has stopped."}
+        if "recipes" in message:
+            worker = min(liveWorkers, key = lambda candidate: len(candidate.pending))
+            response = await worker.request({"recipes": message["recipes"]})
+            response.pop("live", None)
+            return response
+
+        sessionID = message.get("session")
+        if "url" in message:
+            if len(self.sessions) >= self.maxSessions:
+                return {"error": "The server is full, please try again later."}
+            sessionID = sessionID if sessionID is not None else uuid.uuid4().hex
+            if sessionID in self.sessions:
+                return {"session": sessionID, "error": "That session already exists."}
+            self.sessions[sessionID] = min(liveWorkers, key = lambda candidate: candidate.sessions + len(candidate.pending))
+            message = dict(message, session = sessionID)
+        elif sessionID not in self.sessions:
+            return {"session": sessionID, "error": "There is no such session (it may have finished or been idle too long)."}
+
+        response = await self.sessions[sessionID].request(message)
+        if not response.pop("live", False) and self.sessions.pop(sessionID, None) is not None:
+            self.finished += 1
+        return response
+
+    ############################################################################
+    # Name: _sessionsGone                                                      #
+    # Params: worker (the WorkerProcess), sessionIDs (the sessions it no       #
+    # longer has, or None for every session routed to it)                      #
+    # Returns: None                                                            #
+    # Notes: Without this, idle sessions a worker evicted would stay in        #
+    # self.sessions forever and count towards maxSessions. Only sessions       #
+    # still routed to that worker are dropped.                                 #
+    ############################################################################
+    def _sessionsGone(self, worker, sessionIDs):
+        if sessionIDs is None:
+            sessionIDs = [sessionID for sessionID, owner in self.sessions.items() if owner is worker]
+        for sessionID in sessionIDs:
+            if self.sessions.get(sessionID) is worker:
+                del self.sessions[sessionID]
+                self.evicted += 1
+
+    ############################################################################
+    # Name: stats                                                              #
+    # Params: None                                                             #
+    # Returns: A dict of session counts, plus every worker's stats and memory  #
+    # Notes: None                                                              #
+    ############################################################################
+    def stats(self):
+        return {"live": len(self.sessions), "finished": self.finished, "evicted": self.evicted, "maxSessions": self.maxSessions,
+        "supervisor": dict({"pid": os.getpid()}, **processMemory()),
+        "workers": [worker.stats() for worker in self.workers]}
+
+    ############################################################################
+    # Name: stop                                                               #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Closing a worker's socket is what tells it to finish up and exit. #
+    # The socket is closed directly, since the event loop its streams were     #
+    # opened on may already be gone.                                           #
+    ############################################################################
+    def stop(self):
+        for worker in self.workers:
+            worker.supervisorSocket.close()
+        for worker in self.workers:
+            os.waitpid(worker.pid, 0)
+
+############################################################################
+# Name: serve                                                              #
+# Params: supervisor (already started), args (parsed command line)         #
+# Returns: None (runs until the process is stopped)                        #
+# Notes: None                                                              #
+############################################################################
+async def serve(supervisor, args):
+    await supervisor.connect()
+    metrics.addSource("sessions", supervisor.stats)
+    print("Forked " + str(len(supervisor.workers)) + " workers from supervisor " + str(os.getpid()), file = sys.stderr)
+    if args.stdio:
+        await serveStdio(supervisor)
+    else:
+        await serveHTTP(supervisor, args.host, args.port)
+
+############################################################################
+# Name: measureRun                                                         #
+# Params: supervisor (already started), chunks (lists of recipes)          #
+# Returns: (seconds taken, recipes parsed, recipes that failed, every      #
+# worker's stats taken right after)                                        #
+# Notes: Keeps two chunks outstanding per worker, so none of them sit idle #
+# waiting for the next one. The workers are told to exit at the end.       #
+############################################################################
+async def measureRun(supervisor, chunks):
+    await supervisor.connect()
+    inFlight = asyncio.Semaphore(2 * len(supervisor.workers))
+    totals = {"recipes": 0, "failed": 0}
+
+    async def annotate(chunk):
+        async with inFlight:
+            response = await supervisor.handle({"recipes": chunk})
+        results = response.get("results", [])
+        totals["recipes"] += len(chunk)
+        totals["failed"] += len(chunk) if "error" in response else sum(1 for result in results if "error" in result)
+
+    runStart = time.perf_counter()
+    await asyncio.gather(*[annotate(chunk) for chunk in chunks])
+    seconds = time.perf_counter() - runStart
+    workerStats = [worker.stats() for worker in supervisor.workers]
+    for worker in supervisor.workers:
+        worker.writer.close()
+        await worker.readerTask # Ends once the worker has exited
+    return seconds, totals["recipes"], totals["failed"], workerStats
+
+############################################################################
+# Name: measure                                                            #
+# Params: recipesPath (JSON lines of recipes), workerCounts (list of       #
+# worker counts to try), chunkSize (recipes per batch), settings           #
+# Returns: A list with one dict per worker count                           #
+# Notes: Every worker count gets freshly forked workers. The model stays   #
+# loaded in this process between them, which is the whole point: forking   #
+# one more worker only costs the pages it writes to. Memory is read once   #
+# the recipes are parsed, when every worker has done real work.            #
+############################################################################
+def measure(recipesPath, workerCounts, chunkSize, settings):
+    chunks = [[recipe for _, recipe in chunk] for chunk in chunked(readRecipes(recipesPath), chunkSize)]
+    rows = []
+    for workerCount in workerCounts:
+        supervisor = PreforkSupervisor(workerCount, settings)
+        supervisor.start()
+        loop = asyncio.new_event_loop()
+        try:
+            seconds, recipes, failed, workerStats = loop.run_until_complete(measureRun(supervisor, chunks))
+        finally:
+            loop.close()
+            supervisor.stop()
+        memoryTotals = dict((field, sum(worker.get(field, 0) for worker in workerStats)) for field in ("rssKB", "pssKB", "sharedKB", "privateKB"))
+        rows.append({"workers": workerCount,
+        "recipes": recipes,
+        "failed": failed,
+        "seconds": seconds,
+        "recipesPerSecond": recipes / seconds if seconds > 0 else 0.0,
+        "recipesPerSecondPerWorker": recipes / seconds / workerCount if seconds > 0 else 0.0,
+        "supervisor": processMemory(),
+        "perWorkerKB": dict((field, total / workerCount) for field, total in memoryTotals.items()),
+        "totalWorkerPssKB": memoryTotals["pssKB"]})
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serve " + RecipeBot.name + " conversations from pre-forked workers that share one spaCy model.")
+    parser.add_argument("--workers", type = int, default = defaultWorkers, help = "Worker processes to fork")
+    parser.add_argument("--threads", type = int, default = 8, help = "Most turns (fetching, parsing or answering) running at once in each worker")
+    parser.add_argument("--host", default = "127.0.0.1", help = "Address to listen on")
+    parser.add_argument("--port", type = int, default = 8337, help = "Port to listen on")
+    parser.add_argument("--stdio", action = "store_true", help = "Speak JSON lines on stdin/stdout instead of HTTP")
+    parser.add_argument("--max-sessions", type = int, default = 5000, help = "Most sessions to host at once, across every worker")
+    parser.add_argument("--idle-timeout", type = float, default = 30 * 60, help = "Seconds of silence before a session is evicted")
+    parser.add_argument("--turn-timeout", type = float, default = 300, help = "Most seconds a single turn (including the first fetch and parse) may take before its session is closed")
+    parser.add_argument("--progressive", action = "store_true", help = "Start every session once its ingredients and first step are parsed, and parse the other steps in the background")
+    parser.add_argument("--batch-size", type = int, default = defaultBatchSize, help = "Lines spaCy parses per batch")
+    parser.add_argument("--concurrency", type = int, default = defaultConcurrency, help = "Most ConceptNet requests each worker keeps in flight")
+    parser.add_argument("--food-phrases", default = defaultPhrasesPath, help = "File of multi-word foods (one per line) the ingredient parser recognizes")
+    parser.add_argument("--concept-index", metavar = "INDEX_FILE", help = "Answer ConceptNet questions from an index built by conceptIndex.py instead of the API")
+    parser.add_argument("--term-model", metavar = "MODEL_FILE", help = "Answer the questions it is sure about with a model trained by termModel.py instead of ConceptNet")
+    parser.add_argument("--term-model-confidence", type = float, default = defaultConfidence, help = "How sure the term model has to be (0.5 to 1) before ConceptNet is skipped")
+    parser.add_argument("--cache-path", default = ConceptCache.defaultPath, help = "Where the ConceptNet response cache is stored")
+    parser.add_argument("--no-cache", action = "store_true", help = "Always ask ConceptNet, never use the cache")
+    parser.add_argument("--recipe-store", default = RecipeStore.defaultPath, help = "Where parsed recipes are stored")
+    parser.add_argument("--no-recipe-store", action = "store_true", help = "Always parse the recipe, never use the store")
+    parser.add_argument("--measure", metavar = "RECIPES_FILE", help = "Instead of serving, parse these recipes once per --measure-workers count and print throughput and memory")
+    parser.add_argument("--measure-workers", default = "1,2,4", help = "Comma separated worker counts for --measure")
+    parser.add_argument("--chunk-size", type = int, default = defaultChunkSize, help = "Recipes per batch for --measure")
+    args = parser.parse_args()
+
+    settings = {"batchSize": args.batch_size,
+    "concurrency": args.concurrency,
+    "foodPhrasesPath": args.food_phrases,
+    "conceptIndexPath": args.concept_index,
+    "termModelPath": args.term_model,
+    "termModelConfidence": args.term_model_confidence,
+    "cachePath": None if args.no_cache else args.cache_path,
+    "recipeStorePath": None if args.no_recipe_store else args.recipe_store,
+    "progressive": args.progressive,
+    "maxSessions": args.max_sessions,
+    "idleTimeout": args.idle_timeout,
+    "turnTimeout": args.turn_timeout,
+    "threads": args.threads}
+    RecipeBot.foodPhrasesPath = args.food_phrases # The shared food matcher is built in this process
+
+    if args.measure is not None:
+        workerCounts = [int(count) for count in args.measure_workers.split(",") if count.strip() != ""]
+        print(json.dumps(measure(args.measure, workerCounts, args.chunk_size, settings), indent = 2))
+        sys.exit(0)
+
+    supervisor = PreforkSupervisor(args.workers, settings)
+    supervisor.start()
+    try:
+        asyncio.run(serve(supervisor, args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
@@ -0,0 +1,143 @@
+### Progressive instruction parsing
+### Instead of parsing every step before the conversation starts, the bot parses the ingredients
+### and the first step, starts talking, and leaves the rest of the steps to a background worker.
+### The worker always works on the first unparsed step at or after wherever the user is, so it
+### stays ahead of them. If the user jumps to a step that is not ready yet, that step gets parsed
+### right away on their turn (or waited for, if the worker is already halfway through it).
+import threading
+
+class StepScheduler:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: stepCount (how many steps the recipe has), parseStep (takes a    #
+    # zero-indexed step and parses it), onFinished (called with no arguments   #
+    # once every step has been parsed without errors, or None)                 #
+    # Returns: None                                                            #
+    # Notes: Nothing runs in the background until start().                     #
+    ############################################################################
+    def __init__(self, stepCount, parseStep, onFinished = None):
+        self.stepCount = stepCount
+        self.parseStep = parseStep
+        self.onFinished = onFinished
+        self.ready = [threading.Event() for _ in range(stepCount)] # Set once a step is parsed (or failed to)
+        self.claimed = set() # Steps somebody has started parsing
+        self.errors = dict() # step -> the error parsing it raised
+        self.cursor = 0 # Where the user is; the worker starts looking from here
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.thread = None
+
+    ############################################################################
+    # Name: start                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Starts the background worker. Calling it again does nothing.      #
+    ############################################################################
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target = self._run, name = "parse steps", daemon = True)
+                self.thread.start()
+
+    ############################################################################
+    # Name: _claimNext                                                         #
+    # Params: None                                                             #
+    # Returns: The next step the worker should parse, or None if every step    #
+    # has been claimed                                                         #
+    # Notes: Steps ahead of the user come first, then any the user skipped.    #
+    ############################################################################
+    def _claimNext(self):
+        with self.lock:
+            for stepIdx in list(range(self.cursor, self.stepCount)) + list(range(0, self.cursor)):
+                if stepIdx not in self.claimed:
+                    self.claimed.add(stepIdx)
+                    return stepIdx
+        return None
+
+    ############################################################################
+    # Name: _parse                                                             #
+    # Params: stepIdx (a step this thread has claimed)                         #
+    # Returns: None                                                            #
+    # Notes: A step that fails to parse is left without predicates (the bot    #
+    # still has its sentence), rather than taking the conversation down.       #
+    ############################################################################
+    def _parse(self, stepIdx):
+        try:
+            self.parseStep(stepIdx)
+        except Exception as parseError:
+            with self.lock:
+                self.errors[stepIdx] = parseError
+        finally:
+            self.ready[stepIdx].set()
+
+    ############################################################################
+    # Name: _run                                                               #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: The background worker's loop.                                     #
+    ############################################################################
+    def _run(self):
+        stepIdx = self._claimNext()
+        while stepIdx is not None:
+            self._parse(stepIdx)
+            stepIdx = self._claimNext()
+        self.waitAll()
+        if self.onFinished is not None and len(self.errors) == 0 and not self.cancelled:
+            self.onFinished()
+
+    ############################################################################
+    # Name: ensure                                                             #
+    # Params: stepIdx (the step the user is moving to)                         #
+    # Returns: None, once the step is parsed                                   #
+    # Notes: Also moves the worker along to the steps after this one. If no    #
+    # one has started on the step, it is parsed right here instead of waiting  #
+    # for the worker to get to it.                                             #
+    ############################################################################
+    def ensure(self, stepIdx):
+        if stepIdx < 0 or stepIdx >= self.stepCount:
+            return
+        with self.lock:
+            self.cursor = stepIdx + 1
+            parseHere = stepIdx not in self.claimed
+            self.claimed.add(stepIdx)
+        if parseHere:
+            self._parse(stepIdx)
+        self.ready[stepIdx].wait()
+
+    ############################################################################
+    # Name: isReady                                                            #
+    # Params: stepIdx                                                          #
+    # Returns: True if the step has been parsed                                #
+    # Notes: None                                                              #
+    ############################################################################
+    def isReady(self, stepIdx):
+        return self.ready[stepIdx].is_set()
+
+    ############################################################################
+    # Name: waitAll                                                            #
+    # Params: None                                                             #
+    # Returns: None, once every step is parsed                                 #
+    # Notes: None                                                              #
+    ############################################################################
+    def waitAll(self):
+        for stepReady in self.ready:
+            stepReady.wait()
+
+    ############################################################################
+    # Name: cancel                                                             #
+    # Params: None                                                             #
+    # Returns: None, once the worker has stopped                               #
+    # Notes: For when the user moves on to another recipe. Steps nobody has    #
+    # started are given up on (they are marked ready, without predicates, so   #
+    # nothing waits on them forever), a step already underway is finished,     #
+    # and onFinished is never called.                                          #
+    ############################################################################
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            skipped = [stepIdx for stepIdx in range(self.stepCount) if stepIdx not in self.claimed]
+            self.claimed.update(skipped)
+        for stepIdx in skipped:
+            self.ready[stepIdx].set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
@@ -0,0 +1,445 @@
+### Offline benchmark suite
+### Runs every stage of a session (scraping, spaCy, the ConceptNet prefetch, both parsers, query
+### building and a scripted conversation) over the saved recipes in benchmarkFixtures/, with a
+### local stand-in server answering the page and ConceptNet requests from recorded responses and a
+### stub answering searches. For every recipe and stage it reports wall time, outbound calls and
+### peak Python memory, and writes it all as JSON so two commits can be compared:
+###
+###   python recipeBenchmark.py run --output before.json
+###   python recipeBenchmark.py run --output after.json
+###   python recipeBenchmark.py compare before.json after.json
+###
+### `python recipeBenchmark.py record urls.txt` saves real pages and responses as new fixtures.
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from recipeBot import RecipeBot
+from recipeState import Recipe
+from recipeScraper import fetchRecipe, legacyParse, streamPage
+from searchBackends import SearchPrefetcher, StubBackend, liveBackends, VIDEO, WEB
+from urllib.parse import urlparse, unquote
+import subprocess
+import tracemalloc
+import threading
+import argparse
+import platform
+import json
+import time
+import sys
+import os
+
+fixturesDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarkFixtures")
+stages = ["loadModel", "fetch", "legacyScrape", "parse", "prefetch", "ingParse", "instParse", "index", "generateQuery", "commands"]
+vagueQuestions = ["How do I prepare that?", "How do I cook those?", "How do I do that?"] # What _generateQuery gets asked at every step
+
+class FixtureServer:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: fixtures (the fixtures directory), latency (seconds added to     #
+    # every response, to stand in for the real network)                        #
+    # Returns: None                                                            #
+    # Notes: Serves /pages/<name>.html and /c/en/<term> (ConceptNet), and      #
+    # counts every request so the benchmark can tell how many calls each       #
+    # stage would have made. Unrecorded ConceptNet terms get no edges.         #
+    ############################################################################
+    def __init__(self, fixtures = fixturesDir, latency = 0.0):
+        self.fixtures = fixtures
+        self.latency = latency
+        with open(os.path.join(fixtures, "conceptnet.json")) as conceptFile:
+            self.concepts = json.load(conceptFile)
+        self.counts = {"pages": 0, "conceptnet": 0, "unrecorded": 0}
+        self.lock = threading.Lock()
+        fixtureServer = self
+
+        class FixtureHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real sites
+            disable_nagle_algorithm = True # Otherwise headers and body go out separately and every response stalls on a delayed ACK
+
+            def do_GET(self):
+                fixtureServer._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1])
+        self.thread = threading.Thread(target = self.server.serve_forever, name = "fixtures", daemon = True)
+        self.thread.start()
+
+    ############################################################################
+    # Name: _handle                                                            #
+    # Params: handler (the request being served)                               #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def _handle(self, handler):
+        path = unquote(urlparse(handler.path).path)
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if path.startswith("/pages/"):
+            self._count("pages")
+            pagePath = os.path.join(self.fixtures, "pages", os.path.basename(path))
+            if not os.path.exists(pagePath):
+                return self._send(handler, 404, b"Not found", "text/plain")
+            with open(pagePath, "rb") as pageFile:
+                return self._send(handler, 200, pageFile.read(), "text/html; charset=utf-8")
+        elif path.startswith("/c/en/"):
+            self._count("conceptnet")
+            term = path[len("/c/en/"):]
+            if term not in self.concepts:
+                self._count("unrecorded")
+            response = self.concepts.get(term, {"@id": path, "edges": []})
+            return self._send(handler, 200, json.dumps(response).encode("utf-8"), "application/json")
+        return self._send(handler, 404, b"Not found", "text/plain")
+
+    ############################################################################
+    # Name: _count                                                             #
+    # Params: kind ("pages", "conceptnet" or "unrecorded")                     #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def _count(self, kind):
+        with self.lock:
+            self.counts[kind] += 1
+
+    ############################################################################
+    # Name: _send                                                              #
+    # Params: handler, status, body (bytes), contentType                       #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def _send(self, handler, status, body, contentType):
+        handler.send_response(status)
+        handler.send_header("Content-Type", contentType)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    ############################################################################
+    # Name: calls                                                              #
+    # Params: None                                                             #
+    # Returns: How many requests have been served so far                       #
+    # Notes: None                                                              #
+    ############################################################################
+    def calls(self):
+        with self.lock:
+            return self.counts["pages"] + self.counts["conceptnet"]
+
+    ############################################################################
+    # Name: close                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class StageTimer:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: callCounter (returns the outbound calls made so far)             #
+    # Returns: None                                                            #
+    # Notes: tracemalloc only sees memory Python allocates itself, so spaCy's  #
+    # own buffers are not part of the peak.                                    #
+    ############################################################################
+    def __init__(self, callCounter):
+        self.callCounter = callCounter
+        self.results = dict()
+
+    ############################################################################
+    # Name: measure                                                            #
+    # Params: stage (its name), stageFunc (runs the stage)                     #
+    # Returns: Whatever stageFunc returned                                     #
+    # Notes: A stage that fails is recorded with its error instead of numbers  #
+    # being made up for it.                                                    #
+    ############################################################################
+    def measure(self, stage, stageFunc):
+        tracemalloc.reset_peak()
+        memoryBefore = tracemalloc.get_traced_memory()[0]
+        callsBefore = self.callCounter()
+        stageStart = time.perf_counter()
+        result = None
+        try:
+            result = stageFunc()
+        except Exception as stageError:
+            self.results[stage] = {"error": repr(stageError)}
+            return None
+        seconds = time.perf_counter() - stageStart
+        self.results[stage] = {"seconds": seconds,
+        "outboundCalls": self.callCounter() - callsBefore,
+        "peakKB": (tracemalloc.get_traced_memory()[1] - memoryBefore) / 1024.0}
+        return result
+
+############################################################################
+# Name: freshBot                                                           #
+# Params: recipeURL                                                        #
+# Returns: A RecipeBot with nothing fetched or parsed yet                  #
+# Notes: __init__ would start fetching in the background, which would      #
+# blur the stages together, so the bot is put together by hand instead.    #
+############################################################################
+def freshBot(recipeURL):
+    bot = RecipeBot.__new__(RecipeBot)
+    bot.inputFunc = None
+    bot.outputFunc = lambda message: None
+    bot.recipe = Recipe(recipeURL)
+    return bot
+
+############################################################################
+# Name: runCommands                                                        #
+# Params: bot (already parsed), commands (what the user types, in order)   #
+# Returns: The number of turns taken                                       #
+# Notes: The conversation restarts if the script finishes the recipe       #
+# early, so every command always gets run.                                 #
+############################################################################
+def runCommands(bot, commands):
+    bot.state = "start"
+    for command in commands:
+        if bot.isDone():
+            bot.state = "start"
+        bot.handleTurn(command)
+    return len(commands)
+
+############################################################################
+# Name: generateQueries                                                    #
+# Params: bot (already parsed)                                             #
+# Returns: The number of queries built                                     #
+# Notes: None                                                              #
+############################################################################
+def generateQueries(bot):
+    built = 0
+    for stepIdx in range(len(bot.recipeData["instructions"])):
+        for question in vagueQuestions:
+            bot._generateQuery(question, stepIdx)
+            built += 1
+    return built
+
+############################################################################
+# Name: benchmarkRecipe                                                    #
+# Params: server (FixtureServer), pageName (file in pages/), commands      #
+# (scripted turns), searchStubs (the stub search backends)                 #
+# Returns: The per-stage results for this recipe                           #
+# Notes: None                                                              #
+############################################################################
+def benchmarkRecipe(server, pageName, commands, searchStubs):
+    callCounter = lambda: server.calls() + sum(stub.calls for stub in searchStubs.values())
+    timer = StageTimer(callCounter)
+    recipeURL = server.url + "/pages/" + pageName
+    with open(os.path.join(server.fixtures, "pages", pageName), encoding = "utf-8") as pageFile:
+        page = pageFile.read()
+
+    bot = freshBot(recipeURL)
+    bot.recipeData = timer.measure("fetch", lambda: fetchRecipe(recipeURL))
+    timer.measure("legacyScrape", lambda: legacyParse(page)) # The original string-slicing scraper, on the same page
+    if bot.recipeData is not None:
+        timer.measure("parse", bot._parseDocs)
+        timer.measure("prefetch", bot._prefetchConceptNet)
+        timer.measure("ingParse", bot._ingParse)
+        timer.measure("instParse", bot._instParse)
+        timer.measure("index", bot._index)
+        timer.measure("generateQuery", lambda: generateQueries(bot))
+        timer.measure("commands", lambda: runCommands(bot, commands))
+
+    results = timer.results
+    results["size"] = {"ingredients": len(bot.recipeData["ingredients"]), "instructions": len(bot.recipeData["instructions"])} if bot.recipeData is not None else None
+    return results
+
+############################################################################
+# Name: totals                                                             #
+# Params: recipes (per-recipe results)                                     #
+# Returns: Each stage summed over every recipe                             #
+# Notes: Peak memory is the largest single recipe, not a sum.              #
+############################################################################
+def totals(recipes):
+    summed = dict()
+    for stage in stages:
+        measured = [results[stage] for results in recipes.values() if stage in results and "error" not in results[stage]]
+        if len(measured) > 0:
+            summed[stage] = {"seconds": sum(result["seconds"] for result in measured),
+            "outboundCalls": sum(result["outboundCalls"] for result in measured),
+            "peakKB": max(result["peakKB"] for result in measured)}
+    return summed
+
+############################################################################
+# Name: currentCommit                                                      #
+# Params: None                                                             #
+# Returns: The git commit being benchmarked, or None outside a checkout    #
+# Notes: None                                                              #
+############################################################################
+def currentCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd = os.path.dirname(os.path.abspath(__file__)),
+        capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+############################################################################
+# Name: runBenchmark                                                       #
+# Params: fixtures (the fixtures directory), latency (seconds added to     #
+# every fake network response), searchDelay (seconds each search takes),   #
+# repeats (times to run the whole corpus)                                  #
+# Returns: The full results dict                                           #
+# Notes: Both persistent caches are switched off so every run does the     #
+# same work. Only the last repeat is kept, so the first one can warm up    #
+# imports and the like.                                                    #
+############################################################################
+def runBenchmark(fixtures = fixturesDir, latency = 0.0, searchDelay = 0.0, repeats = 1):
+    server = FixtureServer(fixtures, latency)
+    with open(os.path.join(fixtures, "search.json")) as searchFile:
+        recordedSearches = json.load(searchFile)
+    with open(os.path.join(fixtures, "commands.txt")) as commandsFile:
+        commands = [line.rstrip("\n") for line in commandsFile if line.strip() != ""]
+    pageNames = sorted(name for name in os.listdir(os.path.join(fixtures, "pages")) if name.endswith(".html"))
+
+    RecipeBot.conceptNetURL = server.url + "/c/en/"
+    RecipeBot.conceptCache = None
+    RecipeBot.recipeStore = None
+    RecipeBot.conceptIndex = None
+
+    tracemalloc.start()
+    modelTimer = StageTimer(server.calls)
+    modelTimer.measure("loadModel", RecipeBot.modelLoader.get)
+    try:
+        for _ in range(max(1, repeats)):
+            searchStubs = {VIDEO: StubBackend("video", recordedSearches.get(VIDEO), searchDelay), WEB: StubBackend("web", recordedSearches.get(WEB), searchDelay)}
+            RecipeBot.searcher = SearchPrefetcher(searchStubs)
+            recipes = dict((pageName[:-len(".html")], benchmarkRecipe(server, pageName, commands, searchStubs)) for pageName in pageNames)
+    finally:
+        tracemalloc.stop()
+        server.close()
+
+    return {"commit": currentCommit(),
+    "python": platform.python_version(),
+    "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "settings": {"latency": latency, "searchDelay": searchDelay, "repeats": repeats},
+    "loadModel": modelTimer.results["loadModel"],
+    "recipes": recipes,
+    "totals": totals(recipes)}
+
+############################################################################
+# Name: printResults                                                       #
+# Params: results (from runBenchmark)                                      #
+# Returns: None                                                            #
+# Notes: None                                                              #
+############################################################################
+def printResults(results):
+    print("{:<26}{:<15}{:>10}{:>8}{:>12}".format("Recipe", "Stage", "Seconds", "Calls", "Peak KB"))
+    if "error" in results["loadModel"]:
+        print("{:<26}{:<15}  {}".format("(once)", "loadModel", results["loadModel"]["error"]))
+    else:
+        print("{:<26}{:<15}{:>10.4f}{:>8}{:>12.1f}".format("(once)", "loadModel", results["loadModel"]["seconds"], results["loadModel"]["outboundCalls"], results["loadModel"]["peakKB"]))
+    for recipeName, recipeResults in list(results["recipes"].items()) + [("TOTAL", results["totals"])]:
+        for stage in stages:
+            if stage not in recipeResults:
+                continue
+            stageResult = recipeResults[stage]
+            if "error" in stageResult:
+                print("{:<26}{:<15}  {}".format(recipeName, stage, stageResult["error"]))
+            else:
+                print("{:<26}{:<15}{:>10.4f}{:>8}{:>12.1f}".format(recipeName, stage, stageResult["seconds"], stageResult["outboundCalls"], stageResult["peakKB"]))
+
+############################################################################
+# Name: compareResults                                                     #
+# Params: before, after (results from two runs), threshold (how much       #
+# slower a stage may get, as a fraction, before it counts as a regression),#
+# minSeconds (smaller differences than this are noise, whatever the        #
+# fraction)                                                                #
+# Returns: The list of stages that regressed                               #
+# Notes: More outbound calls always count as a regression, since they do   #
+# not depend on how noisy the machine is.                                  #
+############################################################################
+def compareResults(before, after, threshold = 0.25, minSeconds = 0.005):
+    regressions = []
+    print("Comparing " + str(before.get("commit")) + " -> " + str(after.get("commit")))
+    print("{:<15}{:>10}{:>10}{:>9}{:>8}{:>8}{:>11}{:>11}".format("Stage", "Before s", "After s", "Change", "Calls", "Calls", "Before KB", "After KB"))
+    for stage in stages:
+        if stage not in before["totals"] or stage not in after["totals"]:
+            continue
+        old = before["totals"][stage]
+        new = after["totals"][stage]
+        change = (new["seconds"] - old["seconds"]) / old["seconds"] if old["seconds"] > 0 else 0.0
+        regressed = (change > threshold and new["seconds"] - old["seconds"] > minSeconds) or new["outboundCalls"] > old["outboundCalls"]
+        if regressed:
+            regressions.append(stage)
+        print("{:<15}{:>10.4f}{:>10.4f}{:>8.0%}{}{:>8}{:>8}{:>11.1f}{:>11.1f}".format(stage, old["seconds"], new["seconds"], change,
+        "!" if regressed else " ", old["outboundCalls"], new["outboundCalls"], old["peakKB"], new["peakKB"]))
+    return regressions
+
+############################################################################
+# Name: recordFixtures                                                     #
+# Params: urlsPath (file with one recipe URL per line), fixtures (where to #
+# save them)                                                               #
+# Returns: None                                                            #
+# Notes: Needs the network and the spaCy model. Every ConceptNet response  #
+# and search result the bot asks for along the way is saved, on top of     #
+# whatever is already recorded.                                            #
+############################################################################
+def recordFixtures(urlsPath, fixtures = fixturesDir):
+    with open(urlsPath) as urlsFile:
+        urls = [line.strip() for line in urlsFile if line.strip() != ""]
+    with open(os.path.join(fixtures, "conceptnet.json")) as conceptFile:
+        concepts = json.load(conceptFile)
+    with open(os.path.join(fixtures, "search.json")) as searchFile:
+        searches = json.load(searchFile)
+
+    liveFetch = RecipeBot._fetchConceptNet
+    def recordingFetch(bot, term):
+        response = liveFetch(bot, term)
+        concepts[term] = response
+        return response
+    RecipeBot._fetchConceptNet = recordingFetch
+    RecipeBot.conceptCache = None
+    RecipeBot.recipeStore = None
+    backends = liveBackends()
+
+    for url in urls:
+        pageName = "-".join(part for part in urlparse(url).path.split("/") if part != "")[-80:] + ".html"
+        page = "".join(streamPage(url))
+        with open(os.path.join(fixtures, "pages", pageName), "w", encoding = "utf-8") as pageFile:
+            pageFile.write(page)
+        bot = freshBot(url)
+        bot.recipeData = fetchRecipe(url)
+        bot._allParsing()
+        for stepIdx in range(len(bot.recipeData["instructions"])):
+            for role, backend in backends.items():
+                try:
+                    searches.setdefault(role, dict())[bot._stepQuery(stepIdx)] = backend.search(bot._stepQuery(stepIdx))
+                except Exception as searchError:
+                    print("Could not record a " + role + " search for " + url + ": " + repr(searchError))
+        print("Recorded " + pageName)
+
+    with open(os.path.join(fixtures, "conceptnet.json"), "w") as conceptFile:
+        json.dump(dict(sorted(concepts.items())), conceptFile, indent = 1)
+    with open(os.path.join(fixtures, "search.json"), "w") as searchFile:
+        json.dump(searches, searchFile, indent = 1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark " + RecipeBot.name + " offline against recorded fixtures.")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+    runParser = subparsers.add_parser("run", help = "Run the benchmark")
+    runParser.add_argument("--fixtures", default = fixturesDir, help = "Directory of recorded pages and responses")
+    runParser.add_argument("--latency", type = float, default = 0.0, help = "Seconds added to every fake network response")
+    runParser.add_argument("--search-delay", type = float, default = 0.0, help = "Seconds every stub search takes")
+    runParser.add_argument("--repeats", type = int, default = 2, help = "Times to run the corpus (only the last run is reported)")
+    runParser.add_argument("--output", help = "Write the results to this JSON file")
+    compareParser = subparsers.add_parser("compare", help = "Compare two result files")
+    compareParser.add_argument("before")
+    compareParser.add_argument("after")
+    compareParser.add_argument("--threshold", type = float, default = 0.25, help = "Fraction slower a stage may get before it counts as a regression")
+    recordParser = subparsers.add_parser("record", help = "Save real pages and responses as fixtures (needs the network)")
+    recordParser.add_argument("urls", help = "File with one recipe URL per line")
+    recordParser.add_argument("--fixtures", default = fixturesDir)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = runBenchmark(args.fixtures, args.latency, args.search_delay, args.repeats)
+        printResults(results)
+        if args.output is not None:
+            with open(args.output, "w") as outputFile:
+                json.dump(results, outputFile, indent = 2)
+    elif args.command == "compare":
+        with open(args.before) as beforeFile, open(args.after) as afterFile:
+            regressions = compareResults(json.load(beforeFile), json.load(afterFile), args.threshold)
+        if len(regressions) > 0:
+            sys.exit("Regressed: " + ", ".join(regressions))
+    else:
+        recordFixtures(args.urls, args.fixtures)
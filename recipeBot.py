@@ -1,36 +1,88 @@
 # Where the Spacy code was adapted from: https://spacy.io/usage/linguistic-features
 
-from recipeScraper import openSession, formulateJSON
-from youtube_search import YoutubeSearch
-from googlesearch import search
-from nltk.metrics.distance import edit_distance
-import spacy
+from lazyLoader import BackgroundLoader, recordTime, startupReport, processStart
+from instrumentation import metrics, timed, timedFunction, count
+from recipeScraper import fetchRecipe
+from conceptCache import ConceptCache
+from conceptIndex import ConceptIndex
+from recipeStore import RecipeStore, parserVersion
+from recipeRecords import IngredientRecord, StepRecord, RecipeIndex
+from conceptPrefetch import ConceptPrefetcher, pooledSession, defaultConcurrency
+from httpClient import client
+from batchParse import loadModel, parseRecipes, defaultBatchSize, defaultProcesses, modelName
+from intentMatcher import IntentMatcher, lastStep
+from progressiveParse import StepScheduler
+from searchBackends import SearchPrefetcher, liveBackends, stubBackends, VIDEO, WEB, defaultTTL, defaultBudget, defaultLookahead
+from termClassifier import TermClassifier, LexiconTier, PartOfSpeechTier, IndexTier, ModelTier, RemoteTier, FOOD, ACTION, TOOL
+from termModel import loadTermModel, defaultConfidence
+from foodMatcher import FoodMatcher, readPhrases, defaultPhrasesPath
+from recipeSearch import RecipeCatalog
+from transcripts import TranscriptRecorder
+from recipeState import Recipe, RecipeCache, recipeField, defaultMaxRecipes, defaultMaxBytes
 import sys
 import re
-import requests
 import json
 import random
+import argparse
+import time
+
+# These are only imported when first used (see lazyLoader.py), since they are slow to import and
+# plenty of sessions never ask a "how do I" question
+recordTime("import recipeBot", time.perf_counter() - processStart)
+
+urlPattern = re.compile(r"(https?://|www\.)", re.IGNORECASE) # Anything else typed in place of a URL is a catalog search
 
 class RecipeBot:
-    recipeData = None # All scraped data gets stored in this
     name = "Sous-chef" # Name of the bot
 
-    # All the recipe data gets parsed into predicates, which end up in these dicts
-    ingPredicates = dict()
-    instPredicates = dict()
+    # Everything about the recipe being cooked lives on self.recipe (see recipeState.py), so that another
+    # recipe can be swapped in without restarting. These read and write the current recipe's fields
+    recipe = None
+    recipeCache = None # Parsed recipes kept in memory, shared by every bot (see recipeState.py), set up in __main__
+    recipeURL = recipeField("recipeURL")
+    recipeData = recipeField("recipeData") # All scraped data gets stored in this
+    recipeLoader = recipeField("recipeLoader") # Fetches and scrapes the recipe in the background (see __init__)
+    ingPredicates = recipeField("ingPredicates") # All the recipe data gets parsed into predicates, which end up in these dicts of records (see recipeRecords.py)
+    instPredicates = recipeField("instPredicates")
+    recipeIndex = recipeField("recipeIndex") # Which steps use which ingredients, built once parsing is done
+    ingDocs = recipeField("ingDocs")
+    instDocs = recipeField("instDocs")
+    ingMatches = recipeField("ingMatches")
+    prefetched = recipeField("prefetched") # ConceptNet responses fetched ahead of parsing (see _prefetchConceptNet)
+    prefetchReport = recipeField("prefetchReport") # Latency summary of the last prefetch
+    termClassifier = recipeField("termClassifier") # Answers the food/action/tool questions, cheapest tier first (see _classifier)
+    stepScheduler = recipeField("stepScheduler") # Parses the other steps in the background when progressiveParsing is on (see progressiveParse.py)
+    restoredFromStore = recipeField("restoredFromStore") # True if this recipe's predicates came from the store instead of the parser
+    catalogChoices = None # The search results being picked from when switching recipes
 
-    # Below is needed by the Spacy dependency parser
-    nlp = spacy.load("en_core_web_sm")
+    # Where the conversation is (see handleTurn). The states with numbered answers list the valid ones
+    state = None
+    currentStep = 0
+    prompt = None # The question the bot is waiting on an answer to
+    pendingQuery = None # The search the user is giving feedback on
+    choiceStates = {"start": ["1", "2"], "ingredients": ["1", "2"], "searchFeedback": ["yes", "no", "y", "n"]}
+    notUnderstoodPrompt = "\nI'm afraid that I do not understand that command. Please try again, and if there were numerical prompts, enter just the number: "
+    nextPrompts = ["\nLet me know what you would like to do next. I can repeat the instruction too: ",
+    "\nReady for another command. Let me know if I should repeat what I just said: ",
+    "\nWould you like me to repeat that? Otherwise, I am ready for whatever you would like to do next: "] # A few different prompts to pick from randomly
+
+    # Below is needed by the Spacy dependency parser (only the tagger and parser are loaded, see batchParse.py)
+    # Loading it is the slowest part of starting up, so it happens in the background (see the nlp property)
+    modelLoader = BackgroundLoader("load spaCy model", loadModel)
+    batchSize = defaultBatchSize # Lines handed to nlp.pipe at a time
+    nProcess = defaultProcesses # Processes nlp.pipe spreads the work over
 
     # Now for some commands and questions we can give the bot:
-    botCommandTypes = {"navTypes": ["forwardNav", "backwardNav", "otherNav", "beginningNav", "endingNav", "doneNav"]}
+    botCommandTypes = {"navTypes": ["forwardNav", "backwardNav", "otherNav", "beginningNav", "endingNav", "doneNav", "recipeNav"]}
     botCommands = {"forwardNav": ["forward", "next", "after"],
     "backwardNav": ["back", "previous", "before"],
     "beginningNav": ["begin", "first"],
     "endingNav": ["final", "last"],
     "doneNav": ["exit", "done"],
     "otherNav": ["repeat", "th step", "st step", "nd step", "rd step"],
-    "questions": ["How do I", "How to", "How many steps are there?"]}
+    "recipeNav": ["new recipe", "another recipe", "different recipe"],
+    "questions": ["How do I", "How to", "How many steps are there?", "Which steps use", "Which step uses"]}
+    intentMatcher = IntentMatcher(botCommands, botCommandTypes["navTypes"]) # Compiled once, shared by every bot
 
     # This set of all possible foods helps with parsing
     allFoods = set(["tofu", "beef", "chicken", "pork", "pepperoni", "sausage", "turkey",
@@ -40,21 +92,142 @@ class RecipeBot:
     "seasoning", "oregano", "salt", "oil", "onions", "onion"]) # Part of this list was constructed by referring to https://www.heart.org/en/healthy-living/healthy-eating/eat-smart/nutrition-basics/meat-poultry-and-fish-picking-healthy-proteins
 
     pairedWords = ["stock", "broth", "sauce", "loin", "tenderloin", "sirloin", "breast"] # Some food terms come paired with others and take a little extra processing
+    foodPhrasesPath = defaultPhrasesPath # Multi-word foods like "ground beef" (see foodMatcher.py)
+    foodMatcherLoader = BackgroundLoader("build food matcher", lambda: FoodMatcher(RecipeBot.modelLoader.get(), readPhrases(RecipeBot.foodPhrasesPath), RecipeBot.pairedWords))
     cookingVerbs = ["place"] # ConceptNet can be very bad at detecting what things are verbs
 
     queryOffset = 100 # Number of results returned by ConceptNet API call
+    conceptNetURL = "http://api.conceptnet.io/c/en/" # Where all the ConceptNet lookups go
+    conceptCache = None # Persistent cache of ConceptNet responses (see conceptCache.py), set up in __main__
+    conceptIndex = None # Offline ConceptNet index (see conceptIndex.py); when set, the API is never called
+    termModel = None # Local classifier trained on cached ConceptNet answers (see termModel.py), set up in __main__
+    termModelConfidence = defaultConfidence # How sure termModel has to be before ConceptNet is skipped (0.5 skips it always)
+    httpSession = None # Keep-alive connections shared by every ConceptNet request (made on first use)
+    prefetchConcurrency = defaultConcurrency # Most ConceptNet requests the prefetch keeps in flight at once
+    showPrefetchReport = False # Print prefetchReport once parsing is done
+    showTierReport = False # Print which tiers answered those questions once parsing is done
+    showStartupProfile = False # Print how long each import and load took once the first prompt is ready
+    transcriptRecorder = None # Writes every session's recipe and what the user types (see transcripts.py), set up in __main__
+    transcriptID = None # This session's id in the transcript
+    recipeCatalog = None # Local index of scraped recipes to search instead of typing a URL (see recipeSearch.py), set up in __main__
+    catalogResults = 5 # Matches listed for each search
+    recipeStore = None # Persistent store of parsed recipes (see recipeStore.py), set up in __main__
+    progressiveParsing = False # Start talking once the ingredients and first step are parsed, and parse the other steps in the background
+    searcher = None # Looks up how-to videos and pages ahead of time (see searchBackends.py), shared by every bot
+    searchLookahead = defaultLookahead
+    searchTTL = defaultTTL
+    searchBudget = defaultBudget
+    useStubSearch = False # Answer how-to questions with made-up links instead of going online
 
     ############################################################################
     # Name: __init__                                                           #
     # Params: None                                                             #
     # Returns: None                                                            #
     # Notes: Makes a HTTP request to get the right information about the       #
-    # recipe and format it into a JSON.                                        #
+    # recipe and format it into a JSON. The spaCy model starts loading before  #
+    # the user is even asked for a URL, and the recipe is fetched in the       #
+    # background too, so both overlap with the user typing and with each other.#
+    # With a recipe store, spaCy only starts loading once the URL turns out    #
+    # not to be in it, since a stored recipe never needs it. With a recipe     #
+    # catalog, anything that is not a URL is searched for instead, and the     #
+    # chosen recipe comes straight out of the catalog without being fetched.   #
+    # A recipe already parsed in this process comes out of the recipe cache.   #
+    ############################################################################
+    def __init__(self, recipeURL = None, inputFunc = input, outputFunc = print):
+        self.inputFunc = inputFunc # Where user input comes from (see _ask); the server swaps these out per session
+        self.outputFunc = outputFunc # Where the bot's replies go (see _say)
+        if self.recipeStore is None:
+            self.modelLoader.start()
+        userRecipeURL = recipeURL
+        if userRecipeURL is None and self.recipeCatalog is not None:
+            userRecipeURL = self._ask("\nHello, I am your " + self.name + "! If you are ready, go ahead and type in a URL that points to a recipe you would like to work on, or search for one (like \"chicken and broth soup\"): ")
+        elif userRecipeURL is None:
+            userRecipeURL = self._ask("\nHello, I am your " + self.name + "! If you are ready, go ahead and type in a URL that points to a recipe you would like to work on: ")
+        userRecipeURL = userRecipeURL.strip()
+        if self.recipeCatalog is not None and urlPattern.match(userRecipeURL) is None:
+            catalogRecipe = self._chooseRecipe(userRecipeURL)
+            self.recipe = self._openRecipe(catalogRecipe.pop("url"), catalogRecipe) # Already scraped when the catalog was built, so there is nothing to fetch
+        else:
+            self.recipe = self._openRecipe(userRecipeURL)
+        if self.recipe.parsed: # Nothing to fetch or parse
+            return
+        if self.recipeStore is not None and not self.recipeStore.hasURL(self.recipeURL):
+            self.modelLoader.start()
+        if self.recipeData is None:
+            recipeLoader = BackgroundLoader("fetch and scrape recipe", lambda: fetchRecipe(userRecipeURL))
+            recipeLoader.start()
+            self.recipeLoader = recipeLoader
+
+    ############################################################################
+    # Name: _openRecipe                                                        #
+    # Params: recipeURL, recipeData (the recipe, if it is already scraped)     #
+    # Returns: The parsed Recipe from the recipe cache if it is there, or a    #
+    # new one to fetch and parse otherwise                                     #
+    # Notes: None                                                              #
+    ############################################################################
+    def _openRecipe(self, recipeURL, recipeData = None):
+        cachedRecipe = self.recipeCache.get(recipeURL) if self.recipeCache is not None else None
+        if cachedRecipe is not None:
+            return cachedRecipe
+        return Recipe(recipeURL, recipeData)
+
+    ############################################################################
+    # Name: _chooseRecipe                                                      #
+    # Params: query (what the user typed instead of a URL)                     #
+    # Returns: The chosen recipe from the catalog, with its "url"              #
+    # Notes: Lists the best matches and asks for the number of one. Anything   #
+    # that is not one of the numbers is taken as a new search.                 #
+    ############################################################################
+    def _chooseRecipe(self, query):
+        while True:
+            results, prompt = self._searchCatalog(query)
+            choice = self._ask(prompt).strip()
+            if choice.isdigit() and 1 <= int(choice) <= len(results):
+                return self.recipeCatalog.recipe(results[int(choice) - 1].recipeNumber)
+            query = choice
+
+    ############################################################################
+    # Name: _searchCatalog                                                     #
+    # Params: query (what the user typed instead of a URL)                     #
+    # Returns: (the matches, the prompt listing them)                          #
+    # Notes: With no matches, the prompt asks for another search instead.      #
     ############################################################################
-    def __init__(self):
-        userRecipeURL = input("\nHello, I am your " + self.name + "! If you are ready, go ahead and type in a URL that points to a recipe you would like to work on: ")
-        request = openSession(userRecipeURL.strip())
-        self.recipeData = formulateJSON(request)
+    def _searchCatalog(self, query):
+        with timed("catalog.search"):
+            results = self.recipeCatalog.search(query, self.catalogResults)
+        if len(results) == 0:
+            return results, "\nI could not find any recipes for that. Try searching for something else, like a dish or a main ingredient: "
+        choices = "\n".join(str(resultIdx + 1) + ". " + result.name for resultIdx, result in enumerate(results))
+        return results, "\nHere is what I found:\n" + choices + "\nEnter the number of the recipe you would like to work on, or search again: "
+
+    ############################################################################
+    # Name: _ask                                                               #
+    # Params: prompt (what we are asking of the user)                          #
+    # Returns: What the user typed                                             #
+    # Notes: All user input goes through here instead of input() directly.     #
+    ############################################################################
+    def _ask(self, prompt):
+        return self.inputFunc(prompt)
+
+    ############################################################################
+    # Name: _say                                                               #
+    # Params: message (what the bot wants to tell the user)                    #
+    # Returns: None                                                            #
+    # Notes: All of the bot's replies go through here instead of print().      #
+    ############################################################################
+    def _say(self, message):
+        self.outputFunc(message)
+
+    ############################################################################
+    # Name: nlp                                                                #
+    # Params: None                                                             #
+    # Returns: The spaCy model                                                 #
+    # Notes: Waits for the background load if it has not finished yet (or      #
+    # starts it, if nothing has asked for the model before).                   #
+    ############################################################################
+    @property
+    def nlp(self):
+        return self.modelLoader.get()
 
     ############################################################################
     # Name: _ingParse                                                          #
@@ -64,83 +237,70 @@ class RecipeBot:
     # the relevant portions (ingredient name, quantity, and measurement units) #
     # from the recipe data and saves these in the self.ingPredicates dict.     #
     # By predicate, we mean something like "(isa beef ingredient)", but to be  #
-    # Pythonic, this is in a dict structure                                    #
-    # (ex. self.ingPredicates["beef"]["isa"] = "beef").                        #
+    # Pythonic, this is in an IngredientRecord                                 #
+    # (ex. self.ingPredicates["beef 0"].isa = "beef").                         #
     # The parsing combines using a dependency parser and conceptNet to narrow  #
-    # the "isa" predicate to point to a food. Oddly enough, whether the root   #
-    # is an actual food can be separate from the often correct quantity and    #
-    # measurement parsing.                                                     #
+    # the "isa" predicate to point to a food. Multi-word foods and the         #
+    # quantity and measurement come from the phrase matcher instead (see       #
+    # _parseDocs), which already went over every line in one pass.             #
     ############################################################################
     def _ingParse(self):
         for i in range(len(self.recipeData["ingredients"])): # So we can distinguish between different ingredients with the same root
             ing = self.recipeData["ingredients"][i]
-            parsedText = self.nlp(ing)
+            parsedText = self.ingDocs[i]
             additionalRoot = False # Turns true if the potential for a second root word pops up; semaphore to avoid storing that root word
-            mainToken = None # The actual ingredient name
             for token in parsedText: # Construct the appropriate predicates
                 if token.dep_ == "ROOT" and not additionalRoot: # Now we can traverse the parse tree
                     additionalRoot = True
-
-                    # Now let's check if the root word is actually food
-                    if self._isAFood(token.text.lower()):
-                        mainToken = token.text
-                    else: # If this fails, check every word in the sentence for food
-                        for newToken in parsedText:
-                            if self._isAFood(newToken.text.lower()):
-                                mainToken = newToken.text
-                                break # No need to keep going if we've got a food, as what came before the first food term was likely adjectives
-
-                    # Sometimes, you get None for odd reasons. Seems better to go with what we have rather than adding an obscure layer of parsing.
-                    # That said, there is one last check after this
-                    if mainToken is None:
-                        mainToken = token.text
-
-                    # If you get beef sirloin, pork loin/tenderloin, or a kind of stock or broth,
-                    # replace both words (e.g. chicken broth), not just "sirloin" or "broth"
-                    if mainToken in self.pairedWords:
-                        parsedTextAsList = list(parsedText)
-                        mainToken = parsedTextAsList[parsedTextAsList.index(token) - 1].text + " " + token.text
+                    ingredientMatch = self.ingMatches[i]
+                    mainToken = self._ingredientName(parsedText, token, ingredientMatch) # The actual ingredient name, whole phrase and all (e.g. ground beef)
 
                     # Now assign values based on the ingredient name
                     dictKey = mainToken + " " + str(i) # This is the key with which all info for this ingredient can be retrieved
-                    self.ingPredicates[dictKey] = dict()
-                    self.ingPredicates[dictKey]["isa"] = mainToken
-                    for child in token.children: # Only related words are considered to be useful
-                        requestObj = requests.get("http://api.conceptnet.io/c/en/" + child.text.lower() + "_" + mainToken.lower() + "?offset=0&limit=" + str(self.queryOffset)).json()
-
-                        for edge in requestObj["edges"]: # Check if there are two word phrases like ground beef, so we can make a note of the entire phrase
-                            eachEdge = edge["@id"].split(",") # Look for child.text + " " + token.text isa food
-                            if "isa" in eachEdge[0].lower() and "/" + child.text.lower() + "_" + mainToken.lower() + "/" in eachEdge[1].lower() and "food" in eachEdge[2].lower():
-                                self.ingPredicates[dictKey]["isa"] = child.text + " " + mainToken
-                                ing = ing.replace(child.text + " " + mainToken, "isa")
-                        if any([x.text.isdigit() for x in child.children]): # The measurement and amount, tied together by the parser
-                            for item in child.children:
-                                if item.text.isdigit():
-                                    self.ingPredicates[dictKey]["quantity"] = item.text
-                                    self.ingPredicates[dictKey]["measurement"] = child.text
-                    self.ingPredicates[dictKey]["sentence"] = ing
+                    self.ingPredicates[dictKey] = IngredientRecord(mainToken, ingredientMatch.quantity, ingredientMatch.measurement, ing)
+
+    ############################################################################
+    # Name: _ingredientName                                                    #
+    # Params: parsedText (the parsed ingredient line), token (its root word),  #
+    # ingredientMatch (what the phrase matcher found in the line)              #
+    # Returns: The ingredient name (mainToken in _ingParse)                    #
+    # Notes: A matched multi-word food (ground beef, chicken broth) is the     #
+    # whole name, and is known to be a food without asking anyone. Otherwise   #
+    # the root, or failing that the first word, that is a food gets used.      #
+    ############################################################################
+    def _ingredientName(self, parsedText, token, ingredientMatch):
+        mainToken = None
+
+        # Now let's check if the root word is actually food
+        if FoodMatcher.foodAt(ingredientMatch, token) is not None or self._isAFood(token.text.lower(), token):
+            mainToken = token
+        elif len(ingredientMatch.foods) > 0: # The vocabulary already knows a food in this line, so go with the first one
+            mainToken = ingredientMatch.foods[0][-1]
+        else: # If this fails, check every word in the sentence for food
+            for newToken in parsedText:
+                if self._isAFood(newToken.text.lower(), newToken):
+                    mainToken = newToken
+                    break # No need to keep going if we've got a food, as what came before the first food term was likely adjectives
+
+        # Sometimes, you get None for odd reasons. Seems better to go with what we have rather than adding an obscure layer of parsing.
+        if mainToken is None:
+            mainToken = token
+
+        # If the word is part of a multi-word food (e.g. chicken broth, ground beef), keep the whole phrase
+        foodSpan = FoodMatcher.foodAt(ingredientMatch, mainToken)
+        return foodSpan.text if foodSpan is not None else mainToken.text
 
     ############################################################################
     # Name: _isAFood                                                           #
     # Params: candidate (this is the thing that you are determining is a food  #
-    # or not)                                                                  #
+    # or not), token (the spaCy token for it, if there is one)                 #
     # Returns: Boolean                                                         #
-    # Notes: Leverage ConceptNet to see if candidate is a food. Since          #
-    # ConceptNet is not particularly reliable, we also made use of our         #
-    # allFoods set (which was built in __init__). We also collect spices for   #
-    # the transformation to another cuisine.                                   #
-    ############################################################################
-    def _isAFood(self, candidate):
-        requestJSON = requests.get("http://api.conceptnet.io/c/en/" + candidate + "?offset=0&limit=" + str(self.queryOffset)).json()
-        finalVerdict = False # Is the ingredient a food or not
-        if candidate in self.allFoods: # First check against our set of foods
-            finalVerdict = True
-        else: # If it's not there, then see if ConceptNet calls it a food
-            for edge in requestJSON["edges"]:
-                eachEdge = edge["@id"].split(",")
-                if "isa" in eachEdge[0].lower() and "/" + candidate.lower() + "/" in eachEdge[1].lower() and "/food" in eachEdge[2].lower():
-                    finalVerdict = True
-        return finalVerdict
+    # Notes: Since ConceptNet is not particularly reliable, we first check our #
+    # allFoods set, then rule out words spaCy already knows cannot be food,    #
+    # and only then ask the offline index or ConceptNet (see _classifier).     #
+    ############################################################################
+    def _isAFood(self, candidate, token = None):
+        return self._classifier().classify(FOOD, candidate, token).isMatch
 
     ############################################################################
     # Name: _instParse                                                         #
@@ -154,134 +314,348 @@ class RecipeBot:
     ############################################################################
     def _instParse(self):
         for i in range(len(self.recipeData["instructions"])):
-            inst = self.recipeData["instructions"][i]
-            parsedText = self.nlp(inst)
-            additionalRoot = False # Turns true if the potential for a second root word pops up; semaphore to avoid storing that root word
-            mainToken = None # This is the root word that turns into the primary method
-            for token in parsedText:
-                if token.dep_ == "ROOT" and not additionalRoot: # If you have multiple root words, go with the first one
-                    additionalRoot = True # So we don't end up checking more root words - the first one (reading left-to-right) is usually what you want
-
-                    if self._isAnAction(token.text): # Now let's check if the root word is actually a verb
-                        mainToken = token.text
-                    else: # If the above fails, check every word in the sentence for the first verb that is an action
-                        for newToken in parsedText:
-                            if self._isAnAction(newToken.text) and mainToken is None:
-                                mainToken = newToken.text
-
-                    # Sometimes, you get None for odd reasons. Seems better to go with what we have rather than adding an obscure layer of parsing
-                    if mainToken is None:
-                        mainToken = token.text
-
-                    # Now we can assign the primary method and get a cooking tool for it
-                    self.instPredicates[i] = dict()
-                    self.instPredicates[i]["primaryMethod"] = mainToken
-                    for child in token.children: # Now we start relying on ConceptNet to check if any of these children are cooking tools
-                        requestObj = requests.get("http://api.conceptnet.io/c/en/" + child.text + "?offset=0&limit=" + str(self.queryOffset)).json()
-                        for edge in requestObj["edges"]:
-                            if "usedfor" in edge["@id"].lower() and edge["end"]["label"].lower() == "cook":
-                                self.instPredicates[i]["toolFor"] = child.text
-                    self.instPredicates[i]["sentence"] = inst
+            self._instParseStep(i)
+
+    ############################################################################
+    # Name: _instParseStep                                                     #
+    # Params: i (zero-indexed step number)                                     #
+    # Returns: None                                                            #
+    # Notes: One step of _instParse, so that steps can also be parsed one at a #
+    # time (see _parseStepInBackground). The record only goes into             #
+    # self.instPredicates once it is complete.                                 #
+    ############################################################################
+    def _instParseStep(self, i):
+        inst = self.recipeData["instructions"][i]
+        parsedText = self.instDocs[i]
+        additionalRoot = False # Turns true if the potential for a second root word pops up; semaphore to avoid storing that root word
+        for token in parsedText:
+            if token.dep_ == "ROOT" and not additionalRoot: # If you have multiple root words, go with the first one
+                additionalRoot = True # So we don't end up checking more root words - the first one (reading left-to-right) is usually what you want
+                mainToken = self._primaryMethod(parsedText, token) # This is the root word that turns into the primary method
+
+                # Now we can assign the primary method and get a cooking tool for it
+                stepRecord = StepRecord(mainToken, sentence = inst)
+                for child in token.children: # Now we start relying on ConceptNet to check if any of these children are cooking tools
+                    if self._isATool(child.text, child):
+                        stepRecord.toolFor = child.text
+                self.instPredicates[i] = stepRecord
+
+    ############################################################################
+    # Name: _primaryMethod                                                     #
+    # Params: parsedText (the parsed instruction), token (its root word)       #
+    # Returns: The primary method (mainToken in _instParse)                    #
+    # Notes: Split out of _instParse for the same reason as _ingredientName.   #
+    ############################################################################
+    def _primaryMethod(self, parsedText, token):
+        mainToken = None
+
+        if self._isAnAction(token.text, token): # Now let's check if the root word is actually a verb
+            mainToken = token.text
+        else: # If the above fails, check every word in the sentence for the first verb that is an action
+            for newToken in parsedText:
+                if mainToken is None and self._isAnAction(newToken.text, newToken):
+                    mainToken = newToken.text
+
+        # Sometimes, you get None for odd reasons. Seems better to go with what we have rather than adding an obscure layer of parsing
+        if mainToken is None:
+            mainToken = token.text
+
+        return mainToken
+
+    ############################################################################
+    # Name: _isATool                                                           #
+    # Params: candidate (this is the thing that you are determining is a       #
+    # cooking tool), token (the spaCy token for it, if there is one)           #
+    # Returns: Boolean                                                         #
+    # Notes: A tool is anything ConceptNet says is used for cooking.           #
+    ############################################################################
+    def _isATool(self, candidate, token = None):
+        return self._classifier().classify(TOOL, candidate, token).isMatch
+
+    ############################################################################
+    # Name: _classifier                                                        #
+    # Params: None                                                             #
+    # Returns: The TermClassifier for this bot                                 #
+    # Notes: Built on first use. The tiers go from cheapest to most expensive: #
+    # our own word lists, spaCy's tags, the offline index (if there is one),   #
+    # the local term model (if there is one), and ConceptNet itself only when  #
+    # nothing else could decide. With an index the model and the remote tier   #
+    # are left out, since the index has the final say.                         #
+    ############################################################################
+    def _classifier(self):
+        if self.termClassifier is None:
+            tiers = [LexiconTier(self.allFoods, self.pairedWords, self.cookingVerbs), PartOfSpeechTier()]
+            if self.conceptIndex is not None:
+                tiers.append(IndexTier(self.conceptIndex))
+            else:
+                if self.termModel is not None:
+                    tiers.append(ModelTier(self.termModel, self.termModelConfidence))
+                tiers.append(RemoteTier(self._queryConceptNet))
+                if self.termModel is not None: # Only asked when ConceptNet cannot be reached, so the model's best guess beats a flat no
+                    tiers.append(ModelTier(self.termModel, 0.5, "termModelFallback"))
+            self.termClassifier = TermClassifier(tiers)
+        return self.termClassifier
+
+    ############################################################################
+    # Name: _queryConceptNet                                                   #
+    # Params: term (the word or underscore-joined phrase to look up)           #
+    # Returns: The JSON response from ConceptNet (as a dict)                   #
+    # Notes: Every ConceptNet lookup goes through here so that it can be       #
+    # answered from the persistent cache when possible. Terms are normalized   #
+    # (lowercase, underscores) since that is how ConceptNet names its nodes.   #
+    ############################################################################
+    def _queryConceptNet(self, term):
+        normalizedTerm = ConceptCache.normalizeTerm(term)
+        if self.prefetched is not None and normalizedTerm in self.prefetched:
+            count("conceptnet.prefetched")
+            return self.prefetched[normalizedTerm]
+
+        query = "offset=0&limit=" + str(self.queryOffset)
+        if self.conceptCache is not None:
+            cachedJSON = self.conceptCache.get(normalizedTerm, query)
+            if cachedJSON is not None:
+                count("conceptnet.cacheHit")
+                return cachedJSON
+            count("conceptnet.cacheMiss")
+
+        requestJSON = self._fetchConceptNet(normalizedTerm)
+        if self.conceptCache is not None:
+            self.conceptCache.put(normalizedTerm, query, requestJSON)
+        return requestJSON
+
+    ############################################################################
+    # Name: _fetchConceptNet                                                   #
+    # Params: term (already normalized by _queryConceptNet)                    #
+    # Returns: The JSON response from ConceptNet (as a dict)                   #
+    # Notes: The actual network call, with no caching involved. Raises         #
+    # UpstreamUnavailable (see httpClient.py) when ConceptNet cannot be        #
+    # reached, which the classifier falls back from.                           #
+    ############################################################################
+    @timedFunction("conceptnet.request")
+    def _fetchConceptNet(self, term):
+        return client.get("conceptnet", self.conceptNetURL + term + "?offset=0&limit=" + str(self.queryOffset), session = self._httpSession()).json()
+
+    ############################################################################
+    # Name: _httpSession                                                       #
+    # Params: None                                                             #
+    # Returns: The pooled requests.Session every ConceptNet request shares     #
+    # Notes: Made on first use, so requests is not imported until needed.      #
+    ############################################################################
+    def _httpSession(self):
+        if RecipeBot.httpSession is None:
+            RecipeBot.httpSession = pooledSession(max(1, self.prefetchConcurrency))
+        return RecipeBot.httpSession
+
+    ############################################################################
+    # Name: _findRoot                                                          #
+    # Params: parsedText (a parsed ingredient or instruction)                  #
+    # Returns: The first root token, or None if there is not one               #
+    # Notes: Same root the parsers pick (the first one, reading left-to-right).#
+    ############################################################################
+    def _findRoot(self, parsedText):
+        for token in parsedText:
+            if token.dep_ == "ROOT":
+                return token
+        return None
+
+    ############################################################################
+    # Name: _prefetchConceptNet                                                #
+    # Params: ingDocs, ingMatches, instDocs (the lines to prefetch for, every  #
+    # parsed line of the recipe by default)                                    #
+    # Returns: The latency summary of the prefetch, or None with an index      #
+    # Notes: Walks every parsed ingredient and instruction to collect the      #
+    # terms the parsers will look up, then fetches them concurrently. Some     #
+    # terms depend on earlier answers (the fallback scans only happen when the #
+    # root is not a food/action), so this goes in two rounds. The second round #
+    # only reuses the answers already fetched, so working it out costs         #
+    # nothing. Multi-word foods never need ConceptNet (see foodMatcher.py).    #
+    # With a term model, every word of every line is scored in one batch       #
+    # first, and only the words it is unsure about get fetched at all.         #
+    ############################################################################
+    def _prefetchConceptNet(self, ingDocs = None, ingMatches = None, instDocs = None):
+        ingDocs = ingDocs if ingDocs is not None else self.ingDocs
+        ingMatches = ingMatches if ingMatches is not None else self.ingMatches
+        instDocs = instDocs if instDocs is not None else self.instDocs
+        if self.prefetched is None: # Later calls (for steps parsed in the background) add to what is already there
+            self.prefetched = dict()
+        if self.conceptIndex is not None: # Nothing to fetch, everything is answered locally
+            return None
+        if self.termModel is not None:
+            with timed("termModel.prime"):
+                self.termModel.prime([token.text for parsedText in list(ingDocs) + list(instDocs) for token in parsedText])
+
+        classifier = self._classifier()
+        prefetcher = ConceptPrefetcher(self._fetchConceptNet, self.prefetchConcurrency)
+        requested = set()
+        alreadyCached = 0
+        ingRoots = [self._findRoot(parsedText) for parsedText in ingDocs]
+        instRoots = [self._findRoot(parsedText) for parsedText in instDocs]
+
+        with classifier.uncounted(): # Working out what to fetch should not show up in the tier counters
+            # Round 1: the root words, plus the instruction children that get checked for tools
+            roundTerms = [root.text.lower() for root, ingredientMatch in zip(ingRoots, ingMatches) \
+            if root is not None and FoodMatcher.foodAt(ingredientMatch, root) is None and classifier.needsRemote(FOOD, root.text, root)]
+            roundTerms += [root.text.lower() for root in instRoots if root is not None and classifier.needsRemote(ACTION, root.text, root)]
+            roundTerms += [child.text for root in instRoots if root is not None for child in root.children if classifier.needsRemote(TOOL, child.text, child)]
+            alreadyCached += self._prefetchTerms(prefetcher, roundTerms, requested)
+
+            # Round 2: every word of the lines whose root turned out not to be a food/action
+            roundTerms = []
+            for parsedText, root, ingredientMatch in zip(ingDocs, ingRoots, ingMatches):
+                if root is not None and len(ingredientMatch.foods) == 0 and not self._isAFood(root.text.lower(), root):
+                    roundTerms += [newToken.text.lower() for newToken in parsedText if classifier.needsRemote(FOOD, newToken.text, newToken)]
+            for parsedText, root in zip(instDocs, instRoots):
+                if root is not None and not self._isAnAction(root.text, root):
+                    roundTerms += [newToken.text for newToken in parsedText if classifier.needsRemote(ACTION, newToken.text, newToken)]
+            alreadyCached += self._prefetchTerms(prefetcher, roundTerms, requested)
+
+        return prefetcher.report(len(requested), alreadyCached)
+
+    ############################################################################
+    # Name: _prefetchTerms                                                     #
+    # Params: prefetcher (the ConceptPrefetcher for this recipe), terms (what  #
+    # to look up), requested (set of every term seen so far this recipe)       #
+    # Returns: How many new terms were answered by the persistent cache        #
+    # Notes: Fetched responses go into both self.prefetched and the cache.     #
+    ############################################################################
+    def _prefetchTerms(self, prefetcher, terms, requested):
+        query = "offset=0&limit=" + str(self.queryOffset)
+        toFetch = []
+        alreadyCached = 0
+        for term in terms:
+            normalizedTerm = ConceptCache.normalizeTerm(term)
+            if normalizedTerm == "" or normalizedTerm in requested or normalizedTerm in self.prefetched:
+                continue
+            requested.add(normalizedTerm)
+            cachedJSON = self.conceptCache.get(normalizedTerm, query) if self.conceptCache is not None else None
+            if cachedJSON is not None:
+                self.prefetched[normalizedTerm] = cachedJSON
+                alreadyCached += 1
+                count("conceptnet.cacheHit")
+            else:
+                toFetch.append(normalizedTerm)
+                if self.conceptCache is not None:
+                    count("conceptnet.cacheMiss")
+
+        results, failures = prefetcher.fetchAll(toFetch) # Anything that failed is just left for the parsers to retry
+        for normalizedTerm, requestJSON in results.items():
+            self.prefetched[normalizedTerm] = requestJSON
+            if self.conceptCache is not None:
+                self.conceptCache.put(normalizedTerm, query, requestJSON)
+        return alreadyCached
 
     ############################################################################
     # Name: _isAnAction                                                        #
-    # Params: candidate (this is the thing that you are determining is a verb).#
+    # Params: candidate (this is the thing that you are determining is a       #
+    # verb), token (the spaCy token for it, if there is one)                   #
     # Returns: Boolean                                                         #
     # Notes: Similar to _isAFood. This is just for the primaryMethod and       #
     # checks for verbs.                                                        #
     ############################################################################
-    def _isAnAction(self, candidate):
-        requestJSON = requests.get("http://api.conceptnet.io/c/en/" + candidate.lower() + "?offset=0&limit=" + str(self.queryOffset)).json()
-        if candidate.lower() in self.cookingVerbs: # Since ConceptNet can be bad at detecting what is a verb
-            return True
-        else:
-            for edge in requestJSON["edges"]:
-                eachEdge = edge["@id"].split(",") # Check if this word is ever used as a verb
-                if "mannerof" in eachEdge[0].lower() and ("/" + candidate.lower() + "/v/" in eachEdge[1].lower() or \
-                "/" + candidate.lower() + "/v/" in eachEdge[2].lower()): # If the found root word is a verb
-                    return True
-        return False
-
-
-    ############################################################################
-    # Name: _processCommand                                                    #
-    # Params: prompt (what we are asking of the user), validAns                #
-    # (valid answers), buildAns (if true, then we need to build the closest    #
-    # valid answer)                                                            #
-    # Returns: userDecision (what the user wants to do next).                  #
-    # Notes: Asks and waits until the user gives a valid input.                #
-    ############################################################################
-    def _processCommand(self, prompt, validAns, buildAns = False):
-        userDecision = input(prompt)
-
-        if buildAns: # Then you need to check for a valid answer against the set of known commands
-            lowestEditDist = float("inf")
-            bestCmd = None
-
-            # If someone said "yes" or something like that, then we should repeat the current step
-            if userDecision.lower() == "yes" or userDecision.lower() == "y":
-                return "repeat"
-            else: # But if they said no without saying what to do next
-                while userDecision.lower() == "no" or userDecision.lower() == "n":
-                    userDecision = self._processCommand("\nWhat should I do next then?: ", None, True)
-
-            # Check for navigation commands first
-            for navType in self.botCommandTypes["navTypes"]:
-                for navCmd in self.botCommands[navType]:
-                    if navCmd in userDecision.lower():
-                        return userDecision.lower()
-
-            # Now for the "how to" commands
-            for howToCmd in self.botCommands["questions"]:
-                loweredHowToCmd = howToCmd.lower() # Make comparisons more forgiving for the user
-                if loweredHowToCmd == "how do i do that?":
-                    if edit_distance(userDecision.lower(), "how do i do that?") < 2: # This gets a special case for itself
-                        return "How do I do that?"
-                else: # This may seem a bit odd, but hopefully the comments explain the logic well
-                    splitDecision = userDecision.lower().split(" ") # The issue with general "how do I ...?" is that we don't know what is in the ...
-                    howToCmdSplit = loweredHowToCmd.split(" ") # So we need to compare the edit distance of the first x words of each command
-                    if len(splitDecision) >= len(howToCmdSplit): # Where x is the length of a valid bot command
-                        # So "How do I cook the food?" would match "How do I" since the first 3 words match, but "How does that..." would not match "How do I"
-                        if edit_distance(" ".join(splitDecision[:len(howToCmdSplit)]), loweredHowToCmd) < lowestEditDist and \
-                        edit_distance(" ".join(splitDecision[:len(howToCmdSplit)]), loweredHowToCmd) < 2:
-                            bestCmd = howToCmd + " " + " ".join(splitDecision[len(howToCmdSplit):]) # Construct "best command" with user given context
-                            lowestEditDist = edit_distance(" ".join(splitDecision[:len(howToCmdSplit)]), loweredHowToCmd)
-
-            if not bestCmd is None:
-                return bestCmd # Return the best command found
-            else: # If you got here, then we need to redo the above checks after getting a new command
-                userDecision = self._processCommand("\nI'm afraid that I do not understand that command. Please try again, and if there were numerical prompts, enter just the number: ",
-                None, True)
-
-        else: # It is a straightforward check otherwise
-            while userDecision.lower() not in validAns:
-                userDecision = input("\nI'm afraid that I do not understand that command. Please try again, and if there were numerical prompts, enter just the number: ")
-
-        return userDecision
+    def _isAnAction(self, candidate, token = None):
+        return self._classifier().classify(ACTION, candidate, token).isMatch
+
+
+    ############################################################################
+    # Name: _matchCommand                                                      #
+    # Params: userDecision (what the user typed at a step)                     #
+    # Returns: The command to act on, "no" if the user said no without saying  #
+    # what to do next, or None if nothing matched                              #
+    # Notes: Builds the closest valid answer against the set of known          #
+    # commands. This used to ask again (recursively) on its own; now the       #
+    # caller just changes the prompt and waits for the next turn.              #
+    ############################################################################
+    def _matchCommand(self, userDecision):
+        # If someone said "yes" or something like that, then we should repeat the current step
+        if userDecision.lower() == "yes" or userDecision.lower() == "y":
+            return "repeat"
+        elif userDecision.lower() == "no" or userDecision.lower() == "n": # But if they said no without saying what to do next
+            return "no"
+
+        # Check for navigation commands first
+        if len(self.intentMatcher.keywords(userDecision)) > 0:
+            return userDecision.lower()
+
+        # Now for the "how to" commands. "How do I cook the food?" matches "How do I" since the first 3 words match, but "How does that..." would not
+        return self.intentMatcher.question(userDecision) # None if nothing was found
+
+    ############################################################################
+    # Name: handleTurn                                                         #
+    # Params: userInput (what the user just said)                              #
+    # Returns: None                                                            #
+    # Notes: This is the whole conversation, one turn at a time. Which state   #
+    # the bot is in decides what the input means; handling it says whatever    #
+    # needs saying and moves to the next state, leaving the next question in   #
+    # self.prompt. Nothing here calls back into the conversation, so a session #
+    # can go on forever without the stack (or the cost of a turn) growing.     #
+    ############################################################################
+    @timedFunction("turn")
+    def handleTurn(self, userInput):
+        count("turn." + str(self.state)) # Which kind of question the user was answering
+        if self.transcriptID is not None: # Recorded before handling it, so a turn that crashes is still there to replay
+            self.transcriptRecorder.turn(self.transcriptID, userInput, self.state)
+        if self.state in self.choiceStates: # Questions with numbered answers
+            if userInput.lower() not in self.choiceStates[self.state]:
+                self.prompt = self.notUnderstoodPrompt
+            elif self.state == "start" and userInput == "1":
+                self._ingredientList()
+            elif self.state == "start" and userInput == "2":
+                self._instructionNavigation(0)
+            elif self.state == "ingredients" and userInput == "1":
+                self._instructionNavigation(0)
+            elif self.state == "ingredients" and userInput == "2":
+                self._ingredientList()
+            elif self.state == "searchFeedback":
+                self._handleSearchFeedback(userInput)
+
+        elif self.state in ("newRecipe", "chooseRecipe"):
+            self._handleRecipeChoice(userInput)
+
+        elif self.state == "step":
+            givenCommand = self._matchCommand(userInput)
+            if givenCommand is None: # Ask again, and try the same checks on whatever comes back
+                self.prompt = self.notUnderstoodPrompt
+            elif givenCommand == "no":
+                self.prompt = "\nWhat should I do next then?: "
+            elif not self._handleNavCmds(givenCommand, self.currentStep) and not self._handleQuestions(givenCommand, self.currentStep, self._stepSentence(self.currentStep)): # If for whatever reason, something goes completely wrong
+                self._say("\nI'm sorry, something went really wrong. You should not have reached this branch. Sous-chef will cycle back to the previous valid state.")
+                self._instructionNavigation(self.currentStep, printInst = False)
+
+    ############################################################################
+    # Name: isDone                                                             #
+    # Params: None                                                             #
+    # Returns: Boolean                                                         #
+    # Notes: True once the user has finished (or quit) the recipe.             #
+    ############################################################################
+    def isDone(self):
+        return self.state == "done"
 
     ############################################################################
     # Name: _ingredientList                                                    #
     # Params: None                                                             #
-    # Returns: userDecision (what the user wants to do next).                  #
+    # Returns: None                                                            #
     # Notes: Prints out the ingredient list and asks about what's next.        #
     ############################################################################
     def _ingredientList(self):
-        print("\nSure, the ingredients are listed below: ")
+        self._say("\nSure, the ingredients are listed below: ")
         for ingKeys in self.ingPredicates.keys():
-            print("- " + self.ingPredicates[ingKeys]["sentence"])
+            self._say("- " + self.ingPredicates[ingKeys].sentence)
 
         # Now for what's next
-        givenCommand = int(self._processCommand("\nWould you like me to [1] move on to the first step or [2] repeat the list? Enter your choice here: ",
-        ["1", "2"]))
+        self.state = "ingredients"
+        self.prompt = "\nWould you like me to [1] move on to the first step or [2] repeat the list? Enter your choice here: "
 
-        # Go to the right place depending on the request
-        if givenCommand == 1:
-            self._instructionNavigation(0)
-        elif givenCommand == 2:
-            self._ingredientList()
-        else: # Just a placeholder that will never be reached, hopefully, but just in case...
-            print("\nI'm sorry, something went really wrong. You should not have reached this branch. Sous-chef will cycle back to the previous valid state.")
-            self._ingredientList()
+    ############################################################################
+    # Name: _stepSentence                                                      #
+    # Params: stepIdx (zero-indexed step number)                               #
+    # Returns: The instruction for that step                                   #
+    # Notes: Straight from the predicates by index. Falls back to the raw      #
+    # instruction if the parser could not make a predicate for the step.       #
+    ############################################################################
+    def _stepSentence(self, stepIdx):
+        if stepIdx in self.instPredicates:
+            return self.instPredicates[stepIdx].sentence
+        return self.recipeData["instructions"][stepIdx]
 
     ############################################################################
     # Name: _instructionNavigation                                             #
@@ -289,129 +663,146 @@ class RecipeBot:
     # zero-indexed), printInst (tells the script whether to print the          #
     # instruction)                                                             #
     # Returns: None                                                            #
-    # Notes: Helps the user navigate through instructions and handles anything #
-    # anything that requires an external resource (Google, YouTube, etc.).     #
+    # Notes: Moves the user to a step and gets the prompt ready for their next #
+    # command. Going past the last step ends the conversation.                 #
     ############################################################################
+    @timedFunction("turn.navigate")
     def _instructionNavigation(self, currentStep, printInst = True):
+        if self.stepScheduler is not None: # Make sure the step is parsed (right now, if the background worker has not got to it) and move the worker along
+            self.stepScheduler.ensure(currentStep)
         if len(self.recipeData["instructions"]) == currentStep : # If the current step goes past the last possible instruction number, then we are done
-            print("\n------------------------------------------------------------------------")
-            print("\nLooks like you're all done! Good work and enjoy your food! Thanks for using " + self.name + " and see you next time!\n")
-            return True # Once the program sees true, everything should unwind quietly
+            self._say("\n------------------------------------------------------------------------")
+            self._say("\nLooks like you're all done! Good work and enjoy your food! Thanks for using " + self.name + " and see you next time!\n")
+            self.state = "done" # Once the loop in converse sees this, everything winds down quietly
+            self.prompt = None
         else:
-            for key in self.instPredicates.keys():
-                instOfInterest = self.instPredicates[key]
-                if key == currentStep: # If this is the instruction we are dealing with
-                    if printInst: # Check if we need to print the instruction (False if this was recursed on by an external resource command)
-                        print("\n------------------------------------------------------------------------")
-                        if currentStep == 0:
-                            print("\nThe 1st step is: " + instOfInterest["sentence"])
-                        elif currentStep == 1:
-                            print("\nThe 2nd step is: " + instOfInterest["sentence"])
-                        elif currentStep == 2:
-                            print("\nThe 3rd step is: " + instOfInterest["sentence"])
-                        else:
-                            print("\nThe " + str(key + 1) + "th step is: " + instOfInterest["sentence"])
-
-                    # Come up with 3 different prompts and randomly pick
-                    nextPrompts = ["\nLet me know what you would like to do next. I can repeat the instruction too: ",
-                    "\nReady for another command. Let me know if I should repeat what I just said: ",
-                    "\nWould you like me to repeat that? Otherwise, I am ready for whatever you would like to do next: "]
-                    givenCommand = self._processCommand(nextPrompts[random.randint(0, len(nextPrompts) - 1)], None, True) # Valid commands are built in the function
-
-                    if not self._handleNavCmds(givenCommand, currentStep) and not self._handleQuestions(givenCommand, currentStep, instOfInterest["sentence"]): # If for whatever reason, something goes completely wrong
-                        print("\nI'm sorry, something went really wrong. You should not have reached this branch. Sous-chef will cycle back to the previous valid state.")
-                        self._instructionNavigation(currentStep, printInst = False)
+            if printInst: # Check if we need to print the instruction (False if this was an external resource command)
+                self._say("\n------------------------------------------------------------------------")
+                if currentStep == 0:
+                    self._say("\nThe 1st step is: " + self._stepSentence(currentStep))
+                elif currentStep == 1:
+                    self._say("\nThe 2nd step is: " + self._stepSentence(currentStep))
+                elif currentStep == 2:
+                    self._say("\nThe 3rd step is: " + self._stepSentence(currentStep))
+                else:
+                    self._say("\nThe " + str(currentStep + 1) + "th step is: " + self._stepSentence(currentStep))
+
+            # Randomly pick one of the prompts; valid commands are built in _matchCommand
+            if self.state != "step" or currentStep != self.currentStep: # Only moving to a new step needs new searches
+                self._prefetchSearches(currentStep)
+            self.state = "step"
+            self.currentStep = currentStep
+            self.prompt = self.nextPrompts[random.randint(0, len(self.nextPrompts) - 1)]
 
     ############################################################################
     # Name: _handleNavCmds                                                     #
     # Params: userCmd (the command the user gave), instIdx (the step that the  #
     # user is currently on)                                                    #
-    # Returns: None                                                            #
+    # Returns: True if it was a navigation command                             #
     # Notes: Handles all commands that deal with navigating between            #
     # instructions.                                                            #
     ############################################################################
     def _handleNavCmds(self, userCmd, instIdx):
-        if "repeat" in userCmd.lower(): # Repeat the instruction
+        foundKeywords = self.intentMatcher.keywords(userCmd) # Every navigation keyword in the command, by type, from one scan
+        otherKeywords = foundKeywords.get("otherNav", set())
+
+        if "recipeNav" in foundKeywords: # "Load a new recipe"
+            self.state = "newRecipe" # The answer comes back through _handleRecipeChoice
+            self.prompt = "\nSure! Type in a URL that points to the recipe you would like to work on next" + \
+            (", or search for one: " if self.recipeCatalog is not None else ": ")
+
+        elif "repeat" in otherKeywords: # Repeat the instruction
             self._instructionNavigation(instIdx)
 
-        elif "th step" in userCmd.lower() or \
-        "st step" in userCmd.lower() or \
-        "nd step" in userCmd.lower() or \
-        "rd step" in userCmd.lower(): # It's a "Take me to the nth step" command
-            cmdProcessed = False # If this turns to True, then we know we can "unwind" from the recursion and avoid the "error handling" below
-            splitCmd = userCmd.split(" ")
-            for token in splitCmd:
-                if "th" in token or "st" in token or "nd" in token or "rd" in token:
-                    numberNextTo = None # This is the part of the phrase where the number will be found
-                    if "th" in token:
-                        numberNextTo = "th"
-                    elif "st" in token:
-                        numberNextTo = "st"
-                    elif "nd" in token:
-                        numberNextTo = "nd"
-                    elif "rd" in token:
-                        numberNextTo = "rd"
-
-                    # Now we jump to the appropriate step (including error checking)
-                    stepNum = token.replace(numberNextTo, "")
-                    stepNumWords = {"fir": 0, "seco": 1, "thi": 2, "four": 3, "fif": 4, "six": 5, "seven": 6, "eigh": 7, "nin": 8, "la": len(self.recipeData["instructions"]) - 1}
-                    if stepNum.isdigit() or stepNum.replace("-", "").isdigit(): # Check for a number and jump there (extra check for negatives)
-                        if int(stepNum) - 1 <= 0: # Don't look for the 0th step
-                            print("\nYou would be going to an unreachable step. Please try another command.")
-                            cmdProcessed = True
-                            self._instructionNavigation(instIdx, printInst = False)
-                        elif int(stepNum) > len(self.recipeData["instructions"]): # You try to jump too far ahead
-                            print("""\nThis recipe does not have quite that many steps. If you would like to move to the last possible instruction, try \"Take me to the last step\".
-                            There are """ + str(len(self.recipeData["instructions"])) + " steps in total.")
-                            cmdProcessed = True
-                            self._instructionNavigation(instIdx, printInst = False)
-                        else:
-                            cmdProcessed = True
-                            self._instructionNavigation(int(stepNum) - 1)
-                    elif stepNum in stepNumWords.keys(): # If a word was used to denote the number (e.g. "sixth" instead of 6)
-                        if len(self.recipeData["instructions"]) >= stepNumWords[stepNum]: # If it is possible to jump there
-                            cmdProcessed = True
-                            self._instructionNavigation(stepNumWords[stepNum]) # Jump there
-                        else:
-                            print("""\nThis recipe does not have quite that many steps. If you would like to move to the last possible instruction, try \"Take me to the last step\".
-                            There are """ + str(len(self.recipeData["instructions"])) + " steps in total.")
-                            cmdProcessed = True
-                            self._instructionNavigation(instIdx, printInst = False)
-
-            # If you are here, then there was no command that was understood, so as usual, cycle back to a valid state. This is the "error handling" mentioned earlier
-            if not cmdProcessed:
-                print("\nI'm afraid that I do not understand that command. Please try again and note that using numbers instead of words might help.")
+        elif len(otherKeywords) > 0: # It's a "Take me to the nth step" command
+            stepNum = self.intentMatcher.stepReference(userCmd) # Only the first number in the command counts
+            if stepNum == lastStep:
+                stepNum = len(self.recipeData["instructions"])
+
+            # Now we jump to the appropriate step (including error checking)
+            if stepNum is None: # There was no step number that was understood, so as usual, cycle back to a valid state
+                self._say("\nI'm afraid that I do not understand that command. Please try again and note that using numbers instead of words might help.")
+                self._instructionNavigation(instIdx, printInst = False)
+            elif stepNum - 1 < 0: # Don't look for the 0th step
+                self._say("\nYou would be going to an unreachable step. Please try another command.")
                 self._instructionNavigation(instIdx, printInst = False)
+            elif stepNum > len(self.recipeData["instructions"]): # You try to jump too far ahead
+                self._say("""\nThis recipe does not have quite that many steps. If you would like to move to the last possible instruction, try \"Take me to the last step\".
+                There are """ + str(len(self.recipeData["instructions"])) + " steps in total.")
+                self._instructionNavigation(instIdx, printInst = False)
+            else:
+                self._instructionNavigation(stepNum - 1)
 
-        elif any([navCmd in userCmd.lower() for navCmd in self.botCommands["beginningNav"]]): # First step command (that does not use the word "first" - see above)
+        elif "beginningNav" in foundKeywords: # First step command (that does not use the word "first" - see above)
             self._instructionNavigation(0)
 
-        elif any([navCmd in userCmd.lower() for navCmd in self.botCommands["endingNav"]]): # Last step command (that does not use the word "last" - see above)
+        elif "endingNav" in foundKeywords: # Last step command (that does not use the word "last" - see above)
             self._instructionNavigation(len(self.recipeData["instructions"]) - 1)
 
-        elif any([navCmd in userCmd.lower() for navCmd in self.botCommands["forwardNav"]]): # Next step command
+        elif "forwardNav" in foundKeywords: # Next step command
             self._instructionNavigation(instIdx + 1)
 
-        elif any([navCmd in userCmd.lower() for navCmd in self.botCommands["backwardNav"]]): # Previous step command
+        elif "backwardNav" in foundKeywords: # Previous step command
             if instIdx - 1 < 0: # Don't look for the 0th step
-                print("\nYou would be going to an unreachable step. Please try another command.")
+                self._say("\nYou would be going to an unreachable step. Please try another command.")
                 self._instructionNavigation(instIdx, printInst = False)
             else:
                 self._instructionNavigation(instIdx - 1)
 
-        elif any([navCmd in userCmd.lower() for navCmd in self.botCommands["doneNav"]]): # If the user just says that they are done
+        elif "doneNav" in foundKeywords: # If the user just says that they are done
             self._instructionNavigation(len(self.recipeData["instructions"])) # Goes to the ending branch instead of a hard exit
 
         else:
             return False # Not a navigation command
 
-        return True # Probably not needed, but here for completeness
+        return True
+
+    ############################################################################
+    # Name: _searchQuery                                                       #
+    # Params: query (what the user wants to know how to do)                    #
+    # Returns: The query as it is sent to the search backends                  #
+    # Notes: None                                                              #
+    ############################################################################
+    def _searchQuery(self, query):
+        return query + " when it comes to cooking"
+
+    ############################################################################
+    # Name: _stepQuery                                                         #
+    # Params: stepIdx (zero-indexed step number)                               #
+    # Returns: The "how do I do that?" query for that step                     #
+    # Notes: None                                                              #
+    ############################################################################
+    def _stepQuery(self, stepIdx):
+        return self._searchQuery("How do I " + self._stepSentence(stepIdx) + " when it comes to cooking")
+
+    ############################################################################
+    # Name: _searcher                                                          #
+    # Params: None                                                             #
+    # Returns: The SearchPrefetcher                                            #
+    # Notes: Built on first use and then shared by every bot.                  #
+    ############################################################################
+    def _searcher(self):
+        if RecipeBot.searcher is None:
+            backends = stubBackends() if self.useStubSearch else liveBackends()
+            RecipeBot.searcher = SearchPrefetcher(backends, self.searchTTL, self.searchBudget)
+        return RecipeBot.searcher
+
+    ############################################################################
+    # Name: _prefetchSearches                                                  #
+    # Params: stepIdx (the step the user just moved to)                        #
+    # Returns: None                                                            #
+    # Notes: Starts looking up "how do I do that?" for this step and the next  #
+    # few, so the answer is usually there before the question is.              #
+    ############################################################################
+    def _prefetchSearches(self, stepIdx):
+        lastIdx = min(len(self.recipeData["instructions"]) - 1, stepIdx + self.searchLookahead)
+        self._searcher().prefetch([self._stepQuery(i) for i in range(stepIdx, lastIdx + 1)])
 
     ############################################################################
     # Name: _handleQuestions                                                   #
     # Params: userCmd (the command the user gave), instIdx (the step that the  #
     # user is currently on), instruction (current instruction)                 #
-    # Returns: None                                                            #
+    # Returns: True if it was a question we could handle                       #
     # Notes: Handles all commands that deal with the user asking for more      #
     # information.                                                             #
     ############################################################################
@@ -424,93 +815,472 @@ class RecipeBot:
 
             elif "how do i" in userCmd.lower() or \
             "how to" in userCmd.lower(): # Any vague "how to" command
-                queryToUse = self._generateQuery(userCmd, instruction)
-
-            try: # First try searching YouTube
-                searchRes = json.loads(YoutubeSearch(queryToUse + " when it comes to cooking", max_results=1).to_json())["videos"][0] # Get the search result
-                print("\nThere's a YouTube video that may be of some help. Check this out: " + \
-                "https://www.youtube.com" + searchRes["url_suffix"])
-                userResponse = self._processCommand("\nDoes this answer your question? (Y or Yes/N or No): ", ["yes", "no", "y", "n"])
-                if userResponse.lower() == "n" or userResponse.lower() == "no": # If the YouTube search is not enough, try Google
-                    searchRes = search(queryToUse + " when it comes to cooking")[0] # Get the first Google result
-                    print("\nThere's a Google result that may be of some additional help. Check this out: " + searchRes)
-            except: # If we cannot fetch anything from YouTube, try Google
-                if not queryToUse is None: # Extra layer of checking
-                    searchRes = search(queryToUse + " when it comes to cooking")[0] # Get the first Google result
-                    print("\nThere's a Google result that may be of some help. Check this out: " + searchRes)
-                else:
-                    return False
+                queryToUse = self._generateQuery(userCmd, instIdx)
+
+            if queryToUse is None: # Extra layer of checking
+                return False
+
+            searchDeadline = time.monotonic() + self._searcher().budget # The whole question gets one budget, however many backends it takes
+            self._searcher().prefetch([self._searchQuery(queryToUse)]) # Google starts alongside YouTube in case it is needed
+            searchRes = self._searcher().lookup(VIDEO, self._searchQuery(queryToUse)) # First try YouTube (usually prefetched already)
+            if searchRes is not None:
+                self._say("\nThere's a YouTube video that may be of some help. Check this out: " + searchRes)
+                self.state = "searchFeedback" # The answer comes back through _handleSearchFeedback
+                self.pendingQuery = queryToUse
+                self.prompt = "\nDoes this answer your question? (Y or Yes/N or No): "
+                return True
+
+            searchRes = self._searcher().lookup(WEB, self._searchQuery(queryToUse), max(0.0, searchDeadline - time.monotonic())) # If we cannot fetch anything from YouTube (in time), try Google
+            if searchRes is not None:
+                self._say("\nThere's a Google result that may be of some help. Check this out: " + searchRes)
+            else:
+                self._say("\nI'm sorry, I could not find anything on that in time. Try asking again in a moment.")
             self._instructionNavigation(instIdx, printInst = False)
 
         elif "how many steps are there" in userCmd.lower():
-            print("\nThere are " + str(len(self.instPredicates.keys())) + " steps.")
+            self._say("\nThere are " + str(len(self.recipeData["instructions"])) + " steps.") # Not every step may be parsed yet
+            self._instructionNavigation(instIdx, printInst = False)
+
+        elif "which step" in userCmd.lower(): # "Which steps use the butter?"
+            ingNames, stepIdxs = self._index().stepsUsing(userCmd.lower().replace("which steps use", "").replace("which step uses", ""))
+            if len(ingNames) == 0:
+                self._say("\nI could not find that ingredient in this recipe. Try the name from the ingredient list.")
+            elif len(stepIdxs) == 0:
+                self._say("\nNone of the steps mention the " + " or the ".join(ingNames) + ".")
+            else:
+                stepNames = [str(stepIdx + 1) for stepIdx in stepIdxs]
+                stepList = stepNames[0] if len(stepNames) == 1 else ", ".join(stepNames[:-1]) + " and " + stepNames[-1]
+                self._say("\nThe " + " and the ".join(ingNames) + (" is" if len(ingNames) == 1 else " are") + " used in step" + ("" if len(stepNames) == 1 else "s") + " " + stepList + ".")
             self._instructionNavigation(instIdx, printInst = False)
 
         else: # Not a question that we can understand
             return False
 
-        return True # Probably not needed, but here for completeness
+        return True
+
+    ############################################################################
+    # Name: _handleSearchFeedback                                              #
+    # Params: userResponse (the user's answer to "Does this answer your        #
+    # question?")                                                              #
+    # Returns: None                                                            #
+    # Notes: If the YouTube video was not enough, try Google, then go back to  #
+    # the step the user was on.                                                #
+    ############################################################################
+    def _handleSearchFeedback(self, userResponse):
+        if userResponse.lower() == "n" or userResponse.lower() == "no": # If the YouTube search is not enough, try Google
+            searchRes = self._searcher().lookup(WEB, self._searchQuery(self.pendingQuery)) # Get the first Google result
+            if searchRes is not None:
+                self._say("\nThere's a Google result that may be of some additional help. Check this out: " + searchRes)
+            else:
+                self._say("\nI'm sorry, I could not find anything else on that.")
+        self.pendingQuery = None
+        self._instructionNavigation(self.currentStep, printInst = False)
+
+    ############################################################################
+    # Name: _handleRecipeChoice                                                #
+    # Params: userInput (a URL, a catalog search, or the number of one of the  #
+    # search results)                                                          #
+    # Returns: None                                                            #
+    # Notes: The answer to "load a new recipe". Searching works the same as at #
+    # the very first prompt, just one turn at a time.                          #
+    ############################################################################
+    def _handleRecipeChoice(self, userInput):
+        userInput = userInput.strip()
+        if self.state == "chooseRecipe" and userInput.isdigit() and 1 <= int(userInput) <= len(self.catalogChoices):
+            catalogRecipe = self.recipeCatalog.recipe(self.catalogChoices[int(userInput) - 1].recipeNumber)
+            self._switchRecipe(catalogRecipe.pop("url"), catalogRecipe)
+        elif userInput == "":
+            self.prompt = self.notUnderstoodPrompt
+        elif self.recipeCatalog is not None and urlPattern.match(userInput) is None:
+            self.catalogChoices, self.prompt = self._searchCatalog(userInput)
+            self.state = "chooseRecipe"
+        else:
+            self._switchRecipe(userInput)
+
+    ############################################################################
+    # Name: _switchRecipe                                                      #
+    # Params: recipeURL, recipeData (the recipe, if it is already scraped)     #
+    # Returns: None                                                            #
+    # Notes: Swaps the new recipe in and starts over with it, in the same      #
+    # process and with the same spaCy model. The recipe is fetched before      #
+    # anything is swapped, so a URL that does not work leaves the user where   #
+    # they were. The old recipe is either in the recipe cache by now or gets   #
+    # dropped, along with whatever its background parsing had left to do.      #
+    ############################################################################
+    @timedFunction("turn.switchRecipe")
+    def _switchRecipe(self, recipeURL, recipeData = None):
+        newRecipe = self._openRecipe(recipeURL, recipeData)
+        if not newRecipe.parsed and newRecipe.recipeData is None:
+            self._say("\nOne moment while I get that recipe.")
+            try:
+                newRecipe.recipeData = fetchRecipe(recipeURL)
+            except Exception:
+                newRecipe.recipeData = None
+            if newRecipe.recipeData is None:
+                self.prompt = "\nI could not load a recipe from that. Please try another URL" + (", or search for one: " if self.recipeCatalog is not None else ": ")
+                return
+
+        if self.stepScheduler is not None: # Otherwise it would keep parsing the old recipe's steps into the new one
+            self.stepScheduler.cancel()
+        self.recipe = newRecipe
+        self.catalogChoices = None
+        self.pendingQuery = None
+        self.currentStep = 0
+        self.startConversation()
 
     ############################################################################
     # Name: _generateQuery                                                     #
     # Params: currCmd (the command that triggered the query),                  #
-    # currStep (the instruction the user is currently working on)              #
+    # stepIdx (the step the user is currently working on)                      #
     # Returns: None                                                            #
     # Notes: Based on any ambigous phrasing in the user's question, we replace #
     # the ambiguous words with the parsed ingredients in the current step.     #
+    # Which ingredients are in which step is worked out once (see _index), so  #
+    # this is just a lookup.                                                   #
     ############################################################################
-    def _generateQuery(self, currCmd, currStep):
+    def _generateQuery(self, currCmd, stepIdx):
+        stepIngredients = self._index().ingredientsIn(stepIdx)
         if "that" in currCmd: # We need to specify "how do I cook that?"
-            for ing in self.ingPredicates:
-                if self.ingPredicates[ing]["isa"] in currStep: # Look for the first ingredient you see in the query and just return that
-                    return currCmd.replace("that", self.ingPredicates[ing]["isa"])
+            if len(stepIngredients) > 0: # Just go with the first ingredient in the step
+                return currCmd.replace("that", stepIngredients[0])
         elif "those" in currCmd: # Specify "how do I cook those?"
             newCmd = currCmd.replace("those", "") # First get rid of the vague word
-            for ing in self.ingPredicates:
-                if self.ingPredicates[ing]["isa"] in currStep: # Append each detected ingredient to the query
-                    newCmd += ", " + self.ingPredicates[ing]["isa"]
+            for ingName in stepIngredients: # Append each detected ingredient to the query
+                newCmd += ", " + ingName
             return newCmd
         else:
             return currCmd
 
+    ############################################################################
+    # Name: _index                                                             #
+    # Params: None                                                             #
+    # Returns: The RecipeIndex for this recipe                                 #
+    # Notes: Built once from the predicates, the first time it is needed after #
+    # parsing (whether the predicates came from the parser or the store).      #
+    ############################################################################
+    def _index(self):
+        if self.recipeIndex is None:
+            self.recipeIndex = RecipeIndex(self.ingPredicates, [self._stepSentence(i) for i in range(len(self.recipeData["instructions"]))])
+        return self.recipeIndex
+
     ############################################################################
     # Name: _allParsing                                                        #
     # Params: None                                                             #
     # Returns: None                                                            #
-    # Notes: Any and all parsing methods to be called go here.                 #
+    # Notes: Any and all parsing methods to be called go here. A recipe that   #
+    # came out of the recipe cache is already parsed.                          #
     ############################################################################
     def _allParsing(self):
-        newTransformer._ingParse()
-        newTransformer._instParse()
+        if self.recipe.parsed:
+            return
+        if self.recipeData is None: # Still being fetched in the background
+            with timed("parse.waitForRecipe"):
+                self.recipeData = self.recipeLoader.get()
+            if self.recipeData is None:
+                raise ValueError("Could not load a recipe from " + self.recipeURL)
+        if self.recipeStore is not None:
+            with timed("parse.storeLookup"):
+                storedPredicates = self.recipeStore.get(self.recipeURL, self.recipeData)
+            if storedPredicates is not None: # Parsed before, and neither the recipe nor the parser has changed since
+                self.ingPredicates, self.instPredicates = storedPredicates
+                self.restoredFromStore = True
+                self._index()
+                self._keepRecipe()
+                return
+        if self.progressiveParsing:
+            self._parseProgressively()
+            return
+        with timed("parse.spacy"):
+            self._parseDocs()
+        with timed("parse.conceptPrefetch"):
+            self.prefetchReport = self._prefetchConceptNet()
+        with timed("parse.ingredients"):
+            self._ingParse()
+        with timed("parse.instructions"):
+            self._instParse()
+        with timed("parse.index"):
+            self._index()
+        self._finishParse()
 
     ############################################################################
-    # Name: converse                                                           #
+    # Name: _parseProgressively                                                #
     # Params: None                                                             #
     # Returns: None                                                            #
-    # Notes: This is really the entire spindle (i.e. function that ties        #
-    # everything together). While it handles the highest level of the          #
-    # conversation, the rest gets delegated to the methods above.              #
+    # Notes: Like the rest of _allParsing, but only the ingredients and the    #
+    # first step are parsed before returning, so the time to the first prompt  #
+    # does not grow with the number of steps. The other steps are handed to a  #
+    # StepScheduler, which parses them in the background ahead of the user.    #
     ############################################################################
-    def converse(self):
+    def _parseProgressively(self):
+        instructions = self.recipeData["instructions"]
+        with timed("parse.spacy"):
+            self.ingDocs, firstDocs = parseRecipes(self.nlp, [{"ingredients": self.recipeData["ingredients"], "instructions": instructions[:1]}],
+            self.batchSize, self.nProcess)[0]
+            self.ingMatches = self.foodMatcherLoader.get().matchAll(self.ingDocs)
+        self.instDocs = firstDocs + [None] * (len(instructions) - len(firstDocs)) # Filled in as the steps get parsed
+        with timed("parse.conceptPrefetch"):
+            self.prefetchReport = self._prefetchConceptNet(self.ingDocs, self.ingMatches, firstDocs)
+        with timed("parse.ingredients"):
+            self._ingParse()
+        with timed("parse.index"):
+            self._index() # Only needs the ingredients and the step sentences
+        self.stepScheduler = StepScheduler(len(instructions), self._parseStepInBackground, self._finishParse)
+        self.stepScheduler.ensure(0)
+        self.stepScheduler.start()
+
+    ############################################################################
+    # Name: _parseStepInBackground                                             #
+    # Params: stepIdx (zero-indexed step number)                               #
+    # Returns: None                                                            #
+    # Notes: Runs on the StepScheduler's worker, or on the user's turn when    #
+    # they jump ahead of it. Every step gets its own spaCy call and its own    #
+    # small ConceptNet prefetch, so no step waits on any other.                #
+    ############################################################################
+    def _parseStepInBackground(self, stepIdx):
+        with timed("parse.step"):
+            if self.instDocs[stepIdx] is None:
+                stepDoc = self.nlp(self.recipeData["instructions"][stepIdx])
+                self._prefetchConceptNet([], [], [stepDoc])
+                self.instDocs[stepIdx] = stepDoc
+            self._instParseStep(stepIdx)
+
+    ############################################################################
+    # Name: _storeParse                                                        #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Saves the finished parse in the recipe store, if there is one.    #
+    # With progressive parsing this happens once the last step is parsed.      #
+    ############################################################################
+    def _storeParse(self):
+        if self.recipeStore is not None:
+            self.recipeStore.put(self.recipeURL, self.recipeData, self.ingPredicates, self.instPredicates)
+
+    ############################################################################
+    # Name: _finishParse                                                       #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Runs once every step is parsed (on the StepScheduler's worker     #
+    # with progressive parsing). A parse that had to fall back because         #
+    # ConceptNet was unreachable is neither stored nor cached, so the recipe   #
+    # gets parsed properly the next time it is opened.                         #
+    ############################################################################
+    def _finishParse(self):
+        if self.termClassifier is not None and self.termClassifier.remoteUnavailable() > 0:
+            count("parse.degraded") # Some answers were fallbacks while ConceptNet was down, so this parse is not kept for later
+            self.recipe.parsed = True
+            self.recipe.release()
+            return
+        self._storeParse()
+        self._keepRecipe()
+
+    ############################################################################
+    # Name: _keepRecipe                                                        #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Lets go of the parses and ConceptNet answers, which nothing needs #
+    # once the predicates are made, and puts the recipe in the recipe cache so #
+    # switching back to it later skips all of this.                            #
+    ############################################################################
+    def _keepRecipe(self):
+        recipe = self.recipe
+        recipe.parsed = True
+        recipe.release()
+        if self.recipeCache is not None:
+            self.recipeCache.put(recipe)
+
+    ############################################################################
+    # Name: parserVersion                                                      #
+    # Params: None                                                             #
+    # Returns: The version stored recipes are tagged with (see recipeStore.py) #
+    # Notes: Everything that decides what ends up in the predicates belongs in #
+    # this list, so that changing any of it retires the stored parses.         #
+    ############################################################################
+    @classmethod
+    def parserVersion(cls):
+        return parserVersion(modelName, [cls._parseDocs, cls._ingParse, cls._ingredientName, cls._isAFood,
+        cls._instParse, cls._instParseStep, cls._primaryMethod, cls._isATool, cls._isAnAction, cls._classifier, cls._findRoot,
+        sys.modules[parseRecipes.__module__], sys.modules[TermClassifier.__module__], sys.modules[IngredientRecord.__module__],
+        sys.modules[FoodMatcher.__module__], tuple(readPhrases(cls.foodPhrasesPath)),
+        cls.allFoods, cls.pairedWords, cls.cookingVerbs, cls.conceptIndex is not None,
+        (cls.termModel.digest, cls.termModelConfidence) if cls.termModel is not None and cls.conceptIndex is None else None])
+
+    ############################################################################
+    # Name: _parseDocs                                                         #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Runs spaCy over every ingredient and instruction up front, in     #
+    # one batched nlp.pipe call, so the ConceptNet prefetch and the parsers    #
+    # can share the same parses. The phrase matcher then goes over every       #
+    # ingredient line too, for the same reason.                                #
+    ############################################################################
+    def _parseDocs(self):
+        self.ingDocs, self.instDocs = parseRecipes(self.nlp, [self.recipeData], self.batchSize, self.nProcess)[0]
+        self.ingMatches = self.foodMatcherLoader.get().matchAll(self.ingDocs)
+
+    ############################################################################
+    # Name: startConversation                                                  #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Gets everything parsed and asks the first question. After this,   #
+    # the conversation is driven one turn at a time through handleTurn.        #
+    ############################################################################
+    def startConversation(self):
         self._allParsing() # This just pushes the parsing to another method in the name of modularity
+        if self.transcriptRecorder is not None:
+            self.transcriptID = self.transcriptRecorder.start(self.recipeURL, self.recipeData)
+        if self.showPrefetchReport and self.prefetchReport is not None:
+            print("\nConceptNet prefetch: " + json.dumps(self.prefetchReport))
+        if self.showTierReport:
+            print("\nTerm classification: " + json.dumps(self._classifier().report()))
+        if self.showStartupProfile:
+            recordTime("ready for the first prompt", time.perf_counter() - processStart)
+            print(startupReport())
 
         # Now we give the user a heads-up that it is time to begin
         # First tell the user what's going on:
-        print("\n Thanks so much for your patience! We'll be working with " + self.recipeData["recipeName"] + ".")
+        self._say("\n Thanks so much for your patience! We'll be working with " + self.recipeData["recipeName"] + ".")
 
         # Now ask them what they want to do next (i.e. ingredients or the first step?)
-        givenCommand = int(self._processCommand("Where would you like to start? [1] Show the ingredient list.\n[2] Go to the first step. Enter here: ", ["1", "2"]))
+        self.state = "start"
+        self.prompt = "Where would you like to start? [1] Show the ingredient list.\n[2] Go to the first step. Enter here: "
 
-        # Go to the right place depending on the request
-        if givenCommand == 1:
-            self._ingredientList()
-        elif givenCommand == 2:
-            self._instructionNavigation(0)
-        else: # Just a placeholder that will never be reached, hopefully, but just in case...
-            print("\nI'm sorry, something went really wrong. You should not have reached this branch. The system will exit on its own.")
-            sys.exit(0)
+    ############################################################################
+    # Name: converse                                                           #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: This is really the entire spindle (i.e. function that ties        #
+    # everything together). It is just a loop of asking the current question   #
+    # and handing the answer to handleTurn until the user is done.             #
+    ############################################################################
+    def converse(self):
+        self.startConversation()
+        while not self.isDone():
+            self.handleTurn(self._ask(self.prompt))
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Talk through an allrecipes.com recipe with " + RecipeBot.name + ".")
+    parser.add_argument("--cache-path", default = ConceptCache.defaultPath, help = "Where the ConceptNet response cache is stored")
+    parser.add_argument("--cache-ttl", type = float, default = ConceptCache.defaultTTL, help = "Seconds before a cached ConceptNet response goes stale")
+    parser.add_argument("--cache-size", type = int, default = ConceptCache.defaultMaxEntries, help = "Most ConceptNet responses to keep before evicting the least recently used")
+    parser.add_argument("--no-cache", action = "store_true", help = "Always ask ConceptNet, never use the cache")
+    parser.add_argument("--clear-cache", action = "store_true", help = "Empty the ConceptNet cache and exit")
+    parser.add_argument("--warm-cache", metavar = "TERMS_FILE", help = "Look up every term in the file (one per line) so it is cached, then exit")
+    parser.add_argument("--concept-index", metavar = "INDEX_FILE", help = "Answer ConceptNet questions from an index built by conceptIndex.py instead of the API")
+    parser.add_argument("--term-model", metavar = "MODEL_FILE", help = "Answer the questions it is sure about with a model trained by termModel.py instead of ConceptNet")
+    parser.add_argument("--term-model-confidence", type = float, default = defaultConfidence, help = "How sure the term model has to be (0.5 to 1) before ConceptNet is skipped")
+    parser.add_argument("--concurrency", type = int, default = defaultConcurrency, help = "Most ConceptNet requests to keep in flight while prefetching")
+    parser.add_argument("--prefetch-stats", action = "store_true", help = "Print how long the ConceptNet prefetch took for the recipe")
+    parser.add_argument("--batch-size", type = int, default = defaultBatchSize, help = "Lines spaCy parses per batch")
+    parser.add_argument("--n-process", type = int, default = defaultProcesses, help = "Processes spaCy spreads parsing over")
+    parser.add_argument("--food-phrases", default = defaultPhrasesPath, help = "File of multi-word foods (one per line) the ingredient parser recognizes")
+    parser.add_argument("--progressive", action = "store_true", help = "Start the conversation once the ingredients and first step are parsed, and parse the other steps in the background")
+    parser.add_argument("--tier-stats", action = "store_true", help = "Print which tier (word lists, spaCy tags, index, term model, ConceptNet) answered each question")
+    parser.add_argument("--startup-profile", action = "store_true", help = "Print how long each import and load took before the first prompt")
+    parser.add_argument("--recipe-catalog", metavar = "INDEX_FILE", help = "Let the user search recipes in an index built by recipeSearch.py instead of typing a URL")
+    parser.add_argument("--recipe-store", default = RecipeStore.defaultPath, help = "Where parsed recipes are stored")
+    parser.add_argument("--recipe-store-size", type = int, default = RecipeStore.defaultMaxEntries, help = "Most parsed recipes to keep before evicting the least recently used")
+    parser.add_argument("--no-recipe-store", action = "store_true", help = "Always parse the recipe, never use the store")
+    parser.add_argument("--recipe-cache-size", type = int, default = defaultMaxRecipes, help = "Most parsed recipes to keep in memory for switching back to (0 keeps none)")
+    parser.add_argument("--recipe-cache-mb", type = float, default = defaultMaxBytes / (1024 * 1024), help = "Most memory, in MB, the parsed recipes kept in memory may take")
+    parser.add_argument("--clear-recipe-store", action = "store_true", help = "Empty the parsed recipe store and exit")
+    parser.add_argument("--warm-recipes", metavar = "URLS_FILE", help = "Parse and store every recipe in the file (one URL per line), then exit")
+    parser.add_argument("--search-stub", action = "store_true", help = "Answer how-to questions with offline stand-in links")
+    parser.add_argument("--search-budget", type = float, default = defaultBudget, help = "Most seconds a how-to question waits on a search")
+    parser.add_argument("--search-lookahead", type = int, default = defaultLookahead, help = "Upcoming steps whose searches are started ahead of time")
+    parser.add_argument("--search-ttl", type = float, default = defaultTTL, help = "Seconds a search result stays cached")
+    parser.add_argument("--search-stats", action = "store_true", help = "Print how many how-to searches were answered from the prefetch when the conversation ends")
+    parser.add_argument("--profile", action = "store_true", help = "Print how long every stage, request and turn took when the conversation ends")
+    parser.add_argument("--profile-log", metavar = "LOG_FILE", help = "Append one JSON line per timed event to this file")
+    parser.add_argument("--metrics-port", type = int, help = "Serve live timings and cache stats as JSON on http://127.0.0.1:<port>/metrics")
+    parser.add_argument("--record", metavar = "TRANSCRIPT_FILE", help = "Append the recipe and everything typed to this file, for loadGenerator.py to replay")
+    parser.add_argument("--cache-stats", action = "store_true", help = "Print cache hit/miss counts when the conversation ends")
+    args = parser.parse_args()
+
+    RecipeBot.prefetchConcurrency = args.concurrency
+    RecipeBot.showPrefetchReport = args.prefetch_stats
+    RecipeBot.showTierReport = args.tier_stats
+    RecipeBot.progressiveParsing = args.progressive
+    RecipeBot.foodPhrasesPath = args.food_phrases
+    RecipeBot.batchSize = args.batch_size
+    RecipeBot.nProcess = args.n_process
+    RecipeBot.showStartupProfile = args.startup_profile
+    RecipeBot.useStubSearch = args.search_stub
+    RecipeBot.searchBudget = args.search_budget
+    RecipeBot.searchLookahead = args.search_lookahead
+    RecipeBot.searchTTL = args.search_ttl
+    if args.concept_index is not None:
+        RecipeBot.conceptIndex = ConceptIndex(args.concept_index)
+    if args.term_model is not None:
+        RecipeBot.termModel = loadTermModel(args.term_model)
+        RecipeBot.termModelConfidence = args.term_model_confidence
+    if not args.no_cache:
+        RecipeBot.conceptCache = ConceptCache(args.cache_path, args.cache_ttl, args.cache_size)
+
+    if args.recipe_catalog is not None:
+        RecipeBot.recipeCatalog = RecipeCatalog(args.recipe_catalog)
+    if not args.no_recipe_store:
+        RecipeBot.recipeStore = RecipeStore(args.recipe_store, args.recipe_store_size, RecipeBot.parserVersion())
+    if args.recipe_cache_size > 0:
+        RecipeBot.recipeCache = RecipeCache(args.recipe_cache_size, int(args.recipe_cache_mb * 1024 * 1024))
+
+    if RecipeBot.conceptCache is not None:
+        metrics.addSource("conceptCache", RecipeBot.conceptCache.stats)
+    if RecipeBot.recipeStore is not None:
+        metrics.addSource("recipeStore", RecipeBot.recipeStore.stats)
+    if RecipeBot.recipeCache is not None:
+        metrics.addSource("recipeCache", RecipeBot.recipeCache.stats)
+    metrics.addSource("search", lambda: RecipeBot.searcher.stats() if RecipeBot.searcher is not None else dict()) # Only made on the first step
+    if args.profile_log is not None:
+        metrics.openLog(args.profile_log)
+    if args.record is not None:
+        RecipeBot.transcriptRecorder = TranscriptRecorder(args.record)
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+
+    if args.clear_recipe_store or args.warm_recipes is not None:
+        if RecipeBot.recipeStore is None:
+            sys.exit("The recipe store is disabled, so there is nothing to clear or warm.")
+        if args.clear_recipe_store:
+            RecipeBot.recipeStore.clear()
+            print("Cleared the recipe store at " + RecipeBot.recipeStore.path)
+        if args.warm_recipes is not None:
+            RecipeBot.progressiveParsing = False # Nobody is waiting on a first prompt, and the store should be written before exiting
+            with open(args.warm_recipes) as urlsFile:
+                urls = [line.strip() for line in urlsFile if line.strip() != ""]
+            parsed = 0
+            for url in urls:
+                try:
+                    recipeWarmer = RecipeBot(url, outputFunc = lambda message: None)
+                    recipeWarmer._allParsing()
+                    parsed += 0 if recipeWarmer.restoredFromStore else 1
+                except Exception as warmError:
+                    print("Could not parse " + url + ": " + repr(warmError))
+            print("Warmed the recipe store: " + str(parsed) + " of " + str(len(urls)) + " recipes were parsed.")
+        sys.exit(0)
+
+    if args.clear_cache or args.warm_cache is not None:
+        if RecipeBot.conceptCache is None:
+            sys.exit("The cache is disabled, so there is nothing to clear or warm.")
+        if args.clear_cache:
+            RecipeBot.conceptCache.clear()
+            print("Cleared the ConceptNet cache at " + RecipeBot.conceptCache.path)
+        if args.warm_cache is not None:
+            with open(args.warm_cache) as termsFile:
+                terms = [line.strip() for line in termsFile]
+            cacheWarmer = RecipeBot.__new__(RecipeBot) # No recipe is needed just to make lookups
+            fetched = RecipeBot.conceptCache.warm(terms, "offset=0&limit=" + str(RecipeBot.queryOffset), cacheWarmer._fetchConceptNet)
+            print("Warmed the ConceptNet cache: " + str(fetched) + " of " + str(len(terms)) + " terms were fetched.")
+        sys.exit(0)
+
     newTransformer = RecipeBot()
     print("\nThank you! This conversation will continue momentarily, but some things need to be readied first. This could take a little while.")
     newTransformer.converse()
+
+    if args.cache_stats and RecipeBot.conceptCache is not None:
+        print(RecipeBot.conceptCache.stats())
+    if args.cache_stats and RecipeBot.recipeStore is not None:
+        print(RecipeBot.recipeStore.stats())
+    if args.search_stats and RecipeBot.searcher is not None:
+        print(RecipeBot.searcher.stats())
+    if args.profile:
+        print(metrics.summary())
@@ -0,0 +1,108 @@
+### Command line client for recipeServer.py
+### Lets you talk to a session on the server the same way you would talk to recipeBot.py,
+### so the server can be tried out without a browser. With --script, the lines of a file are
+### sent one at a time instead of reading from the keyboard.
+import http.client
+import argparse
+import json
+import sys
+
+class RecipeClient:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: host, port (where recipeServer.py is listening)                  #
+    # Returns: None                                                            #
+    # Notes: One keep-alive connection is reused for the whole conversation.   #
+    ############################################################################
+    def __init__(self, host = "127.0.0.1", port = 8337):
+        self.connection = http.client.HTTPConnection(host, port, timeout = 600)
+        self.sessionID = None
+
+    ############################################################################
+    # Name: _request                                                           #
+    # Params: method, path, message (dict to send as the JSON body)            #
+    # Returns: The decoded JSON response                                       #
+    # Notes: None                                                              #
+    ############################################################################
+    def _request(self, method, path, message = None):
+        body = json.dumps(message) if message is not None else None
+        self.connection.request(method, path, body = body, headers = {"Content-Type": "application/json"})
+        return json.loads(self.connection.getresponse().read())
+
+    ############################################################################
+    # Name: start                                                              #
+    # Params: recipeURL (the recipe to cook)                                   #
+    # Returns: The server's response (with the bot's first replies)            #
+    # Notes: None                                                              #
+    ############################################################################
+    def start(self, recipeURL):
+        response = self._request("POST", "/sessions", {"url": recipeURL})
+        self.sessionID = response.get("session")
+        return response
+
+    ############################################################################
+    # Name: say                                                                #
+    # Params: text (what the user says)                                        #
+    # Returns: The server's response (with the bot's replies)                  #
+    # Notes: None                                                              #
+    ############################################################################
+    def say(self, text):
+        return self._request("POST", "/sessions/" + self.sessionID, {"text": text})
+
+    ############################################################################
+    # Name: close                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Ends the session on the server and closes the connection.         #
+    ############################################################################
+    def close(self):
+        if self.sessionID is not None:
+            self._request("DELETE", "/sessions/" + self.sessionID)
+        self.connection.close()
+
+############################################################################
+# Name: showResponse                                                       #
+# Params: response (from RecipeClient.start or RecipeClient.say)           #
+# Returns: True if the conversation can keep going                         #
+# Notes: The last reply is the bot's question, so it is printed without a  #
+# newline, the same way input() would show it.                             #
+############################################################################
+def showResponse(response):
+    if "error" in response:
+        print("\n[server] " + response["error"])
+        return "replies" in response
+    replies = response.get("replies", [])
+    for reply in replies[:-1]:
+        print(reply)
+    if len(replies) > 0:
+        print(replies[-1], end = "" if not response["done"] else "\n")
+    return not response["done"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Talk to a recipeServer.py session.")
+    parser.add_argument("url", help = "The recipe to cook")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8337)
+    parser.add_argument("--script", help = "Send the lines of this file instead of reading from the keyboard")
+    args = parser.parse_args()
+
+    client = RecipeClient(args.host, args.port)
+    userLines = open(args.script) if args.script is not None else None
+    try:
+        keepGoing = showResponse(client.start(args.url))
+        while keepGoing:
+            if userLines is not None:
+                userInput = userLines.readline()
+                if userInput == "":
+                    break
+                print(userInput.rstrip("\n"))
+            else:
+                userInput = input()
+            keepGoing = showResponse(client.say(userInput.rstrip("\n")))
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        client.close()
+        if userLines is not None:
+            userLines.close()
+        sys.stdout.write("\n")
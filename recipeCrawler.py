@@ -0,0 +1,220 @@
+### Bulk recipe crawler
+### Fetches a whole list of recipes (a file of URLs, or a sitemap) in one process instead of one
+### `python recipeScraper.py <url>` per recipe. Pages are fetched concurrently over one bounded
+### connection pool, each host is rate limited separately, and every recipe is written as a JSON
+### line as soon as it is done. Finished URLs go in a checkpoint file, so a crawl that gets
+### interrupted picks up where it left off.
+from concurrent.futures import ThreadPoolExecutor
+from conceptPrefetch import pooledSession
+from recipeScraper import parseRecipePage, streamPage, pageHeaders
+from httpClient import client, UpstreamUnavailable
+from urllib.parse import urlparse
+import xml.etree.ElementTree as ElementTree
+import threading
+import argparse
+import json
+import time
+import sys
+import os
+
+defaultWorkers = 8 # Pages being fetched at once
+defaultRate = 2.0 # Requests per second to any one host
+maxFailuresShown = 20 # How many failed URLs the report lists
+
+class HostRateLimiter:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: requestsPerSecond (the most requests any one host gets per       #
+    # second, or None for no limit)                                            #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, requestsPerSecond = defaultRate):
+        self.interval = 1.0 / requestsPerSecond if requestsPerSecond else 0.0
+        self.nextSlot = dict() # host -> the earliest time its next request may go out
+        self.lock = threading.Lock()
+
+    ############################################################################
+    # Name: wait                                                               #
+    # Params: url (the page about to be fetched)                               #
+    # Returns: None                                                            #
+    # Notes: Each caller reserves the next free slot for its host and sleeps   #
+    # outside the lock, so other hosts are never held up.                      #
+    ############################################################################
+    def wait(self, url):
+        host = urlparse(url).netloc.lower()
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.nextSlot.get(host, now))
+            self.nextSlot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+############################################################################
+# Name: fetchSitemap                                                       #
+# Params: url (of a sitemap, or of a plain list of URLs), session          #
+# Returns: Its content, as bytes                                           #
+# Notes: None                                                              #
+############################################################################
+def fetchSitemap(url, session):
+    response = client.get("sitemap", url, session = session, headers = pageHeaders)
+    response.raise_for_status()
+    return response.content
+
+############################################################################
+# Name: sitemapURLs                                                        #
+# Params: content (the text of a sitemap), session (to fetch any nested    #
+# sitemaps)                                                                #
+# Returns: A list of the page URLs in it                                   #
+# Notes: A sitemap index just points at more sitemaps, so those get        #
+# fetched and read in turn.                                                #
+############################################################################
+def sitemapURLs(content, session):
+    urls = []
+    pending = [content]
+    while len(pending) > 0:
+        root = ElementTree.fromstring(pending.pop(0))
+        isIndex = root.tag.endswith("sitemapindex")
+        for element in root.iter():
+            if element.tag.endswith("loc") and element.text is not None:
+                if isIndex:
+                    pending.append(fetchSitemap(element.text.strip(), session))
+                else:
+                    urls.append(element.text.strip())
+    return urls
+
+############################################################################
+# Name: loadURLs                                                           #
+# Params: source (a file with one URL per line, a sitemap file, or the URL #
+# of a sitemap), session (to fetch remote sitemaps)                        #
+# Returns: A list of URLs with the duplicates dropped                      #
+# Notes: Blank lines and lines starting with # are skipped.                #
+############################################################################
+def loadURLs(source, session):
+    if source.startswith("http://") or source.startswith("https://"):
+        content = fetchSitemap(source, session)
+    else:
+        with open(source, "rb") as sourceFile:
+            content = sourceFile.read()
+
+    if content.lstrip().startswith(b"<"): # Only a sitemap would start with a tag
+        urls = sitemapURLs(content, session)
+    else:
+        urls = [line.strip() for line in content.decode("utf-8").splitlines()]
+        urls = [url for url in urls if url != "" and not url.startswith("#")]
+    return list(dict.fromkeys(urls))
+
+############################################################################
+# Name: readCheckpoint                                                     #
+# Params: checkpointPath                                                   #
+# Returns: The set of URLs already written out by an earlier run           #
+# Notes: None                                                              #
+############################################################################
+def readCheckpoint(checkpointPath):
+    if not os.path.exists(checkpointPath):
+        return set()
+    with open(checkpointPath, encoding = "utf-8") as checkpointFile:
+        return set(line.strip() for line in checkpointFile if line.strip() != "")
+
+class RecipeCrawler:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: outputPath (JSON lines file to append recipes to),               #
+    # checkpointPath (file of finished URLs), workers (pages fetched at once), #
+    # requestsPerSecond (per host), poolSize (most open connections per host)  #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, outputPath, checkpointPath = None, workers = defaultWorkers, requestsPerSecond = defaultRate, poolSize = None):
+        self.outputPath = outputPath
+        self.checkpointPath = checkpointPath if checkpointPath is not None else outputPath + ".checkpoint"
+        self.workers = max(1, workers)
+        self.session = pooledSession(poolSize if poolSize is not None else self.workers)
+        self.rateLimiter = HostRateLimiter(requestsPerSecond)
+        self.writeLock = threading.Lock()
+        self.fetched = 0
+        self.failures = [] # (url, what went wrong)
+
+    ############################################################################
+    # Name: _crawlOne                                                          #
+    # Params: url (the recipe to fetch), outputFile, checkpointFile            #
+    # Returns: None                                                            #
+    # Notes: Every attempt at the page, retries included, waits for its own    #
+    # rate limiter slot, so a host that is struggling (or answering 429) is    #
+    # not hit any faster. The recipe line is flushed before the URL is         #
+    # checkpointed, so a crash in between only means the recipe gets fetched   #
+    # again.                                                                   #
+    ############################################################################
+    def _crawlOne(self, url, outputFile, checkpointFile):
+        try:
+            recipeData = parseRecipePage(streamPage(url, session = self.session, beforeAttempt = lambda: self.rateLimiter.wait(url)))
+            if recipeData is None:
+                raise ValueError("no schema.org Recipe in the page's JSON-LD")
+        except Exception as crawlError:
+            with self.writeLock:
+                self.failures.append((url, repr(crawlError)))
+            return
+
+        recipeLine = json.dumps(dict({"url": url}, **recipeData)) + "\n"
+        with self.writeLock:
+            outputFile.write(recipeLine)
+            outputFile.flush()
+            checkpointFile.write(url + "\n")
+            checkpointFile.flush()
+            self.fetched += 1
+
+    ############################################################################
+    # Name: crawl                                                              #
+    # Params: urls (the recipes to fetch)                                      #
+    # Returns: The report (see report)                                         #
+    # Notes: Anything already in the checkpoint is skipped. At most a few      #
+    # batches of URLs are queued at a time, so a huge sitemap does not sit in  #
+    # memory as futures.                                                       #
+    ############################################################################
+    def crawl(self, urls):
+        alreadyDone = readCheckpoint(self.checkpointPath)
+        remaining = [url for url in urls if url not in alreadyDone]
+        crawlStart = time.perf_counter()
+        queued = threading.BoundedSemaphore(self.workers * 4)
+
+        with open(self.outputPath, "a", encoding = "utf-8") as outputFile, open(self.checkpointPath, "a", encoding = "utf-8") as checkpointFile:
+            with ThreadPoolExecutor(max_workers = self.workers) as pool:
+                for url in remaining:
+                    queued.acquire()
+                    future = pool.submit(self._crawlOne, url, outputFile, checkpointFile)
+                    future.add_done_callback(lambda _: queued.release())
+
+        return self.report(len(urls), len(urls) - len(remaining), time.perf_counter() - crawlStart)
+
+    ############################################################################
+    # Name: report                                                             #
+    # Params: requested (URLs given), skipped (URLs already checkpointed),     #
+    # seconds (how long the crawl took)                                        #
+    # Returns: A dict summarizing the crawl                                    #
+    # Notes: None                                                              #
+    ############################################################################
+    def report(self, requested, skipped, seconds):
+        return {"requested": requested,
+        "skipped": skipped,
+        "fetched": self.fetched,
+        "failed": len(self.failures),
+        "seconds": seconds,
+        "recipesPerSecond": self.fetched / seconds if seconds > 0 else 0.0,
+        "failures": [{"url": url, "error": error} for url, error in self.failures[:maxFailuresShown]]}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Fetch many recipes at once into a JSON lines file.")
+    parser.add_argument("source", help = "A file with one URL per line, a sitemap file, or a sitemap URL")
+    parser.add_argument("--output", default = "recipes.jsonl", help = "JSON lines file to append recipes to")
+    parser.add_argument("--checkpoint", help = "File of finished URLs (defaults to the output path plus .checkpoint)")
+    parser.add_argument("--workers", type = int, default = defaultWorkers, help = "Pages fetched at once")
+    parser.add_argument("--rate", type = float, default = defaultRate, help = "Requests per second to any one host (0 for no limit)")
+    parser.add_argument("--pool-size", type = int, help = "Most open connections per host (defaults to --workers)")
+    args = parser.parse_args()
+
+    crawler = RecipeCrawler(args.output, args.checkpoint, args.workers, args.rate, args.pool_size)
+    try:
+        urls = loadURLs(args.source, crawler.session)
+    except (OSError, ElementTree.ParseError, UpstreamUnavailable) as sourceError:
+        sys.exit("Could not read URLs from " + args.source + ": " + str(sourceError))
+    print(json.dumps(crawler.report(len(urls), 0, 0.0) if len(urls) == 0 else crawler.crawl(urls), indent = 2))
@@ -0,0 +1,161 @@
+### Compact records for parsed recipes, plus the step/ingredient index
+### The parsers used to fill a dict of dicts per ingredient and per step. These records hold the
+### same predicates in fixed slots instead, which is smaller and catches typos in field names. Once
+### a recipe is parsed, RecipeIndex works out which ingredients every step mentions (and so which
+### steps use every ingredient) one time, so that questions about them are plain lookups instead of
+### scanning every ingredient against the step on every question.
+import re
+
+wordPattern = re.compile(r"[a-z]+") # What counts as a word when matching ingredient names in a question
+
+class Record:
+    __slots__ = () # Subclasses list their fields here, in order
+
+    ############################################################################
+    # Name: asDict                                                             #
+    # Params: None                                                             #
+    # Returns: The predicates as a plain dict, leaving out anything unset      #
+    # Notes: Used to store the record as JSON (see recipeStore.py).            #
+    ############################################################################
+    def asDict(self):
+        return dict((field, getattr(self, field)) for field in self.__slots__ if getattr(self, field) is not None)
+
+    ############################################################################
+    # Name: fromDict                                                           #
+    # Params: predicates (a dict from asDict)                                  #
+    # Returns: A record of the subclass                                        #
+    # Notes: None                                                              #
+    ############################################################################
+    @classmethod
+    def fromDict(cls, predicates):
+        return cls(**predicates)
+
+class IngredientRecord(Record):
+    __slots__ = ("isa", "quantity", "measurement", "sentence")
+
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: isa (the ingredient name, like "ground beef"), quantity,         #
+    # measurement (both None if the parser found none), sentence (the          #
+    # ingredient line)                                                         #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, isa, quantity = None, measurement = None, sentence = None):
+        self.isa = isa
+        self.quantity = quantity
+        self.measurement = measurement
+        self.sentence = sentence
+
+class StepRecord(Record):
+    __slots__ = ("primaryMethod", "toolFor", "sentence")
+
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: primaryMethod (the step's main action, like "whisk"), toolFor    #
+    # (the tool it uses, None if the parser found none), sentence (the step)   #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, primaryMethod, toolFor = None, sentence = None):
+        self.primaryMethod = primaryMethod
+        self.toolFor = toolFor
+        self.sentence = sentence
+
+############################################################################
+# Name: nameForms                                                          #
+# Params: word (one lowercase word)                                        #
+# Returns: The word along with its likely singular or plural               #
+# Notes: Just enough that "eggs" finds "egg" and the other way around.     #
+############################################################################
+def nameForms(word):
+    if word.endswith("es"):
+        return [word, word[:-1], word[:-2]]
+    if word.endswith("s"):
+        return [word, word[:-1]]
+    return [word, word + "s", word + "es"]
+
+class RecipeIndex:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: ingredients (dict of key -> IngredientRecord, in recipe order),  #
+    # stepSentences (every instruction, in order)                              #
+    # Returns: None                                                            #
+    # Notes: A step mentions an ingredient if the ingredient's name shows up   #
+    # anywhere in it, ignoring case. Ingredients keep their recipe order in    #
+    # stepIngredients. Names are indexed whole ("extra virgin olive oil") and  #
+    # by their last two words and last word ("olive oil", "oil"), which is how #
+    # people usually refer to them.                                            #
+    ############################################################################
+    def __init__(self, ingredients, stepSentences):
+        self.ingredients = ingredients
+        self.stepIngredients = [] # step index -> tuple of ingredient keys it mentions
+        self.ingredientSteps = dict((ingKey, []) for ingKey in ingredients) # ingredient key -> step indexes that use it
+        self.names = dict() # lowercase name (whole, last two words or last word) -> ingredient keys
+
+        loweredNames = [(ingKey, record.isa.lower()) for ingKey, record in ingredients.items()]
+        for stepIdx, sentence in enumerate(stepSentences):
+            loweredSentence = sentence.lower()
+            mentioned = tuple(ingKey for ingKey, name in loweredNames if name in loweredSentence)
+            self.stepIngredients.append(mentioned)
+            for ingKey in mentioned:
+                self.ingredientSteps[ingKey].append(stepIdx)
+
+        for ingKey, name in loweredNames:
+            words = wordPattern.findall(name)
+            if len(words) == 0: # Nothing a question could name it by
+                continue
+            for indexedName in set([" ".join(words), " ".join(words[-2:])] + words[-1:]):
+                self.names.setdefault(indexedName, []).append(ingKey)
+
+    ############################################################################
+    # Name: ingredientsIn                                                      #
+    # Params: stepIdx (zero-indexed step number)                               #
+    # Returns: The names of the ingredients the step mentions, in recipe order #
+    # Notes: None                                                              #
+    ############################################################################
+    def ingredientsIn(self, stepIdx):
+        if stepIdx < 0 or stepIdx >= len(self.stepIngredients):
+            return []
+        return [self.ingredients[ingKey].isa for ingKey in self.stepIngredients[stepIdx]]
+
+    ############################################################################
+    # Name: findIngredients                                                    #
+    # Params: text (what the user said, like "which steps use the butter?")    #
+    # Returns: The keys of the ingredients named in it, in recipe order        #
+    # Notes: Two-word names are tried before single words, so "ground beef"    #
+    # does not also match some other beef.                                     #
+    ############################################################################
+    def findIngredients(self, text):
+        words = wordPattern.findall(text.lower())
+        found = []
+        wordIdx = 0
+        while wordIdx < len(words):
+            matched = False
+            for span in (2, 1):
+                if wordIdx + span > len(words):
+                    continue
+                phrase = " ".join(words[wordIdx:wordIdx + span - 1] + [""])
+                for form in nameForms(words[wordIdx + span - 1]):
+                    if phrase + form in self.names:
+                        found.extend(ingKey for ingKey in self.names[phrase + form] if ingKey not in found)
+                        matched = True
+                        break
+                if matched:
+                    break
+            wordIdx += span if matched else 1
+        return [ingKey for ingKey in self.ingredients if ingKey in found]
+
+    ############################################################################
+    # Name: stepsUsing                                                         #
+    # Params: text (what the user said)                                        #
+    # Returns: (names of the ingredients found, sorted zero-indexed steps that #
+    # use any of them)                                                         #
+    # Notes: None                                                              #
+    ############################################################################
+    def stepsUsing(self, text):
+        ingKeys = self.findIngredients(text)
+        steps = set()
+        for ingKey in ingKeys:
+            steps.update(self.ingredientSteps[ingKey])
+        return [self.ingredients[ingKey].isa for ingKey in ingKeys], sorted(steps)
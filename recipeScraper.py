@@ -1,22 +1,42 @@
 ### Adapted from the documentation provided here: https://pypi.org/project/requests-html/
 ### Written by: Mukundan Kuthalam
-from requests_html import HTMLSession
+###
+### fetchRecipe is the fast path: a plain pooled HTTP client, the page streamed through a regex
+### scan for <script type="application/ld+json"> blocks (nothing else in the page is parsed), and
+### the schema.org Recipe node read with the json module (so escaped quotes and brackets are
+### fine). Everything is a single pass.
+### openSession/formulateJSON are the original requests_html path, kept as a fallback for pages
+### without JSON-LD. `python recipeScraper.py benchmark [page.html]` compares the two.
+from conceptPrefetch import pooledSession
+from httpClient import client
+from lazyLoader import lazyImport
+from instrumentation import timedFunction, count
+import threading
+import html
+import time
 import sys
 import json
 import re
 
+requestsHTML = lazyImport("requests_html") # Pulls in pyppeteer and friends, so only import it when a page is actually fetched
+
+pageSession = None # One pooled session for every page fetched by this process
+pageSessionLock = threading.Lock()
+pageHeaders = {"User-Agent": "Mozilla/5.0 (compatible; recipeBot)"} # Some recipe sites turn away the default requests agent
+
+@timedFunction("scrape.openSession")
 def openSession(url):
     request = None # HTTP Request to scrape the website source
 
     # Open a request to fetch the HTML content
     try:
-        session = HTMLSession()
-        request = session.get(url)
+        request = client.get("recipePage", url, session = requestsHTML.HTMLSession(), headers = pageHeaders)
     except:
         request = None
 
     return request
 
+@timedFunction("scrape.formulateJSON")
 def formulateJSON(request):
     finalJSON = dict() # Result that gets moved to a json
     # Keys used in the final JSON
@@ -106,6 +126,191 @@ def getInstructions(recipeInfo):
 
     return instructionsList
 
+# The fast path starts here
+
+scriptOpenTag = re.compile(r"<script\b([^>]*)>", re.IGNORECASE)
+scriptCloseTag = re.compile(r"</script\s*>", re.IGNORECASE)
+ldJSONType = re.compile(r"""type\s*=\s*["']?\s*application/ld\+json""", re.IGNORECASE)
+
+class LDJSONScanner:
+    # Keeps the text of every <script type="application/ld+json"> as the page streams through.
+    # Only script tags are looked at, and whatever has been searched is dropped from the buffer
+    def __init__(self):
+        self.blocks = []
+        self.buffer = ""
+        self.pieces = [] # The start of a JSON-LD block that spans several chunks
+        self.inScript = False
+        self.keepScript = False # True inside a JSON-LD script, False inside any other one
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        while True:
+            if self.inScript: # Script bodies are raw text, so the only thing to look for is the end of the script
+                closeTag = scriptCloseTag.search(self.buffer)
+                if closeTag is None:
+                    if self.keepScript: # Set the text aside rather than growing the buffer, so long blocks stay linear
+                        self.pieces.append(self.buffer[:-16])
+                    self.buffer = self.buffer[-16:] # "</script >" could be split across chunks
+                    return
+                if self.keepScript:
+                    self.blocks.append("".join(self.pieces) + self.buffer[:closeTag.start()])
+                    self.pieces = []
+                self.buffer = self.buffer[closeTag.end():]
+                self.inScript = False
+            else:
+                openTag = scriptOpenTag.search(self.buffer)
+                if openTag is None:
+                    partialTag = self.buffer.rfind("<") # A tag may be cut off at the end of the chunk
+                    self.buffer = self.buffer[partialTag:] if partialTag != -1 else ""
+                    return
+                self.keepScript = ldJSONType.search(openTag.group(1)) is not None
+                self.buffer = self.buffer[openTag.end():]
+                self.inScript = True
+
+    def close(self):
+        self.buffer = ""
+
+def getPageSession():
+    global pageSession
+    with pageSessionLock:
+        if pageSession is None:
+            pageSession = pooledSession()
+    return pageSession
+
+def streamPage(url, chunkSize = 64 * 1024, session = None, beforeAttempt = None):
+    # Yields the page a chunk at a time, so parsing starts before the whole thing has arrived. beforeAttempt runs before every try (see HTTPClient.get)
+    session = session if session is not None else getPageSession()
+    with client.get("recipePage", url, session = session, beforeAttempt = beforeAttempt, headers = pageHeaders, stream = True) as response:
+        response.raise_for_status()
+        if "charset=" not in response.headers.get("Content-Type", "").lower(): # requests guesses ISO-8859-1 for any text/html without one, which mangles "½" and "é"
+            response.encoding = "utf-8"
+        for chunk in response.iter_content(chunk_size = chunkSize, decode_unicode = True):
+            yield chunk
+
+def findLDJSON(chunks):
+    scanner = LDJSONScanner()
+    for chunk in chunks:
+        scanner.feed(chunk)
+    scanner.close()
+    return scanner.blocks
+
+def isRecipeNode(node):
+    nodeType = node.get("@type")
+    if isinstance(nodeType, list): # Some sites give a node several types, e.g. ["Recipe", "NewsArticle"]
+        return "Recipe" in nodeType
+    return nodeType == "Recipe"
+
+def findRecipeNode(blocks):
+    # Walks every JSON-LD block (including @graph lists and nested nodes) until a Recipe turns up
+    for block in blocks:
+        try:
+            pending = [json.loads(block)]
+        except ValueError: # A broken block should not hide a good one later in the page
+            continue
+        while len(pending) > 0:
+            node = pending.pop()
+            if isinstance(node, list):
+                pending += reversed(node) # Keep the page order, so the first recipe wins
+            elif isinstance(node, dict):
+                if isRecipeNode(node):
+                    return node
+                pending += reversed([value for value in node.values() if isinstance(value, (list, dict))])
+    return None
+
+def cleanText(text):
+    return html.unescape(text).strip() # JSON-LD text often still carries HTML entities like &amp;
+
+def instructionTexts(instructions):
+    # Flattens recipeInstructions, which can be a string, a list of strings, HowToSteps, or HowToSections holding any of those
+    texts = []
+    pending = [instructions]
+    while len(pending) > 0:
+        node = pending.pop()
+        if isinstance(node, str):
+            texts.append(node)
+        elif isinstance(node, list):
+            pending += reversed(node)
+        elif isinstance(node, dict):
+            if "itemListElement" in node: # A HowToSection (or a plain ItemList)
+                pending.append(node["itemListElement"])
+            elif "text" in node:
+                texts.append(node["text"])
+            elif "name" in node:
+                texts.append(node["name"])
+    return texts
+
+def splitSteps(texts):
+    # Since a single step can actually contain multiple steps, split on periods and semicolons the same way getInstructions does
+    instructionsList = []
+    for text in texts:
+        for sentence in re.split("[.;]", cleanText(text)):
+            if sentence.strip() != "":
+                instructionsList.append(sentence.strip().capitalize())
+    return instructionsList
+
+def recipeFromNode(recipeNode):
+    ingredients = recipeNode.get("recipeIngredient", recipeNode.get("ingredients", []))
+    if isinstance(ingredients, str):
+        ingredients = [ingredients]
+
+    return {"recipeName": cleanText(recipeNode.get("name", "")),
+    "ingredients": [cleanText(ingredient) for ingredient in ingredients if cleanText(ingredient) != ""],
+    "instructions": splitSteps(instructionTexts(recipeNode.get("recipeInstructions", [])))}
+
+def parseRecipePage(chunks):
+    # Same keys as formulateJSON, or None if the page has no Recipe in its JSON-LD
+    recipeNode = findRecipeNode(findLDJSON(chunks))
+    if recipeNode is None:
+        return None
+    return recipeFromNode(recipeNode)
+
+@timedFunction("scrape.fetchRecipe")
+def fetchRecipe(url):
+    recipeData = None
+    try:
+        recipeData = parseRecipePage(streamPage(url))
+    except Exception:
+        recipeData = None
+
+    # No JSON-LD (or the fetch itself failed), so fall back to the original scraper
+    if recipeData is None:
+        count("scrape.legacyFallback")
+        request = openSession(url)
+        if request is None: # The site could not be reached either way, which the caller has to handle
+            count("scrape.failed")
+            return None
+        try:
+            recipeData = formulateJSON(request)
+        except Exception: # No script on the page at all
+            count("scrape.failed")
+            recipeData = None
+    return recipeData
+
+def legacyParse(page):
+    # What formulateJSON does with the first script on the page, for the benchmark
+    recipeDetails = findLDJSON([page])[0]
+    return {"recipeName": getRecipeName(recipeDetails), "ingredients": getIngredients(recipeDetails), "instructions": getInstructions(recipeDetails)}
+
+def samplePage(ingredientCount = 2000, stepCount = 500):
+    # An allrecipes-style page, big enough for the difference in the parsers to show
+    recipeNode = {"@context": "http://schema.org", "@type": "Recipe", "mainEntityOfPage": "https://www.allrecipes.com/recipe/0/sample/",
+    "name": "Sample Quiche", "recipeIngredient": [str(number % 4 + 1) + " cups shredded potato number " + str(number) for number in range(ingredientCount)],
+    "recipeInstructions": [{"@type": "HowToStep", "text": "Heat the oven and stir batch " + str(number) + ". Bake until golden\n"} for number in range(stepCount)]}
+    return "<html><head><script type=\"application/ld+json\">" + json.dumps([recipeNode], indent = 2) + "</script></head><body>" + "<p>filler</p>" * 5000 + "</body></html>"
+
+def benchmark(page, repeats = 5):
+    timings = dict()
+    for parserName, parseFunc in [("jsonld", lambda: parseRecipePage([page])), ("legacy", lambda: legacyParse(page))]:
+        parseStart = time.perf_counter()
+        for _ in range(repeats):
+            parsed = parseFunc()
+        timings[parserName] = (time.perf_counter() - parseStart) / repeats
+        print("{:<8}{:>12.4f} s/page  {:>6} ingredients  {:>6} steps".format(parserName, timings[parserName], len(parsed["ingredients"]), len(parsed["instructions"])))
+    return timings
+
 if __name__ == "__main__":
-    request = openSession(sys.argv[1])
-    print(formulateJSON(request))
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark": # python recipeScraper.py benchmark [saved page.html]
+        page = open(sys.argv[2], encoding = "utf-8").read() if len(sys.argv) > 2 else samplePage()
+        benchmark(page)
+    else:
+        print(fetchRecipe(sys.argv[1]))
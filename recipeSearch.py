@@ -0,0 +1,350 @@
+### Local recipe search
+### Builds a searchable index from recipes that have already been scraped (the JSON lines that
+### recipeCrawler.py writes), so a session can start from "chicken and broth soup" instead of a
+### pasted URL, and the recipe it picks is loaded straight from the index without any scraping.
+### Recipe names and ingredient names go into an inverted index ranked with BM25, in one file that
+### gets memory-mapped (like conceptIndex.py), so searching tens of thousands of recipes only ever
+### touches the posting lists of the words searched for.
+###
+### File layout (integers are little-endian unsigned 32-bit unless noted):
+###   header:       magic "RSIX", version, number of recipes, number of terms, average recipe
+###                 length (32-bit float), reserved
+###   termOffsets:  (number of terms + 1) offsets into the term blob, terms sorted bytewise
+###   postOffsets:  (number of terms + 1) offsets into the postings, counted in entries
+###   postings:     per term, (recipe number, weighted term frequency) pairs
+###   lengths:      the weighted length of every recipe
+###   recipeOffsets:(number of recipes + 1) 64-bit offsets into the recipe blob
+###   term blob:    every term in UTF-8, back to back
+###   recipe blob:  every recipe as JSON ({"url": ..., plus what fetchRecipe returns}), back to back
+from foodMatcher import measurementUnits
+from recipeState import Recipe
+from collections import namedtuple
+import argparse
+import struct
+import array
+import math
+import mmap
+import json
+import time
+import sys
+import os
+import re
+
+indexMagic = b"RSIX"
+indexVersion = 1
+headerFormat = "<4sIIIfI"
+headerSize = struct.calcsize(headerFormat)
+
+nameWeight = 3 # A word in the recipe's name counts this many times over one in its ingredients
+k1 = 1.2 # BM25 term frequency saturation
+b = 0.75 # BM25 length normalization
+defaultResults = 5
+
+wordPattern = re.compile(r"[a-z]+")
+stopWords = set(["a", "an", "and", "or", "the", "of", "with", "in", "on", "for", "to", "from", "into", "at", "by", "my", "some", "any",
+"recipe", "recipes", "make", "how", "i", "want", "something", "like"])
+preparationWords = set(["chopped", "diced", "minced", "sliced", "grated", "shredded", "crushed", "peeled", "cubed", "halved", "quartered",
+"melted", "softened", "beaten", "divided", "drained", "rinsed", "packed", "sifted", "toasted", "cooked", "uncooked", "thawed", "frozen",
+"fresh", "freshly", "finely", "roughly", "coarsely", "thinly", "large", "medium", "small", "whole", "optional", "taste", "needed",
+"more", "about", "plus", "inch", "ground", "boneless", "skinless", "dried", "room", "temperature"])
+unitWords = set(measurementUnits)
+
+SearchResult = namedtuple("SearchResult", ["score", "recipeNumber", "name", "url"])
+
+############################################################################
+# Name: singular                                                           #
+# Params: word (lowercase)                                                 #
+# Returns: The word with a regular plural ending taken off                 #
+# Notes: Used on both the recipes and the searches, so "potatoes" and      #
+# "potato" end up as the same term either way.                             #
+############################################################################
+def singular(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and (word.endswith("oes") or word.endswith("ches") or word.endswith("shes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+############################################################################
+# Name: terms                                                              #
+# Params: text (a recipe name, an ingredient name or a search)             #
+# Returns: The list of index terms in it                                   #
+# Notes: None                                                              #
+############################################################################
+def terms(text):
+    return [singular(word) for word in wordPattern.findall(text.lower()) if word not in stopWords]
+
+############################################################################
+# Name: ingredientName                                                     #
+# Params: line (one ingredient line, like "2 cups chopped onions")         #
+# Returns: Roughly what the parser would make its isa ("onions")           #
+# Notes: A quick stand-in for the full parser when building big indexes:   #
+# anything in brackets or after a comma is dropped, along with numbers,    #
+# units and preparation words.                                             #
+############################################################################
+def ingredientName(line):
+    line = re.sub(r"\([^)]*\)", " ", line.lower()).split(",")[0]
+    words = [word for word in wordPattern.findall(line) if word not in unitWords and word not in preparationWords and word not in stopWords]
+    return " ".join(words)
+
+############################################################################
+# Name: buildIndex                                                         #
+# Params: recipesPath (JSON lines from recipeCrawler.py), indexPath (where #
+# to write the index), namesFunc (takes a recipe line and returns its      #
+# ingredient names, ingredientName on every line by default)               #
+# Returns: The number of recipes written                                   #
+# Notes: Recipes without a URL or without ingredients are skipped, and a   #
+# URL that shows up twice keeps its last version.                          #
+############################################################################
+def buildIndex(recipesPath, indexPath, namesFunc = None):
+    recipes = dict()
+    with open(recipesPath, encoding = "utf-8") as recipesFile:
+        for line in recipesFile:
+            if line.strip() == "":
+                continue
+            recipe = json.loads(line)
+            if recipe.get("url") and recipe.get("ingredients"):
+                recipes[recipe["url"]] = recipe
+
+    postings = dict() # term -> list of (recipe number, weighted frequency)
+    lengths = []
+    encodedRecipes = []
+    for recipeNumber, recipe in enumerate(recipes.values()):
+        ingredientNames = namesFunc(recipe) if namesFunc is not None else [ingredientName(line) for line in recipe["ingredients"]]
+        frequencies = dict()
+        for term in terms(recipe.get("recipeName", "")):
+            frequencies[term] = frequencies.get(term, 0) + nameWeight
+        for name in ingredientNames:
+            for term in terms(name):
+                frequencies[term] = frequencies.get(term, 0) + 1
+        for term, frequency in frequencies.items():
+            postings.setdefault(term, []).append((recipeNumber, frequency))
+        lengths.append(sum(frequencies.values()))
+        encodedRecipes.append(json.dumps(recipe).encode("utf-8"))
+
+    writeIndex(postings, lengths, encodedRecipes, indexPath)
+    return len(encodedRecipes)
+
+############################################################################
+# Name: writeIndex                                                         #
+# Params: postings (dict of term -> [(recipe number, frequency)]), lengths #
+# (per recipe), encodedRecipes (per recipe JSON bytes), indexPath          #
+# Returns: None                                                            #
+# Notes: Written to the side and then moved into place, like conceptIndex. #
+############################################################################
+def writeIndex(postings, lengths, encodedRecipes, indexPath):
+    encodedTerms = sorted((term.encode("utf-8"), entries) for term, entries in postings.items())
+    termOffsets = [0]
+    postOffsets = [0]
+    for term, entries in encodedTerms:
+        termOffsets.append(termOffsets[-1] + len(term))
+        postOffsets.append(postOffsets[-1] + len(entries))
+    recipeOffsets = [0]
+    for encodedRecipe in encodedRecipes:
+        recipeOffsets.append(recipeOffsets[-1] + len(encodedRecipe))
+    averageLength = sum(lengths) / len(lengths) if len(lengths) > 0 else 0.0
+
+    temporaryPath = indexPath + ".tmp"
+    with open(temporaryPath, "wb") as indexFile:
+        indexFile.write(struct.pack(headerFormat, indexMagic, indexVersion, len(encodedRecipes), len(encodedTerms), averageLength, 0))
+        indexFile.write(struct.pack("<" + str(len(termOffsets)) + "I", *termOffsets))
+        indexFile.write(struct.pack("<" + str(len(postOffsets)) + "I", *postOffsets))
+        for term, entries in encodedTerms:
+            indexFile.write(struct.pack("<" + str(2 * len(entries)) + "I", *[number for entry in entries for number in entry]))
+        indexFile.write(struct.pack("<" + str(len(lengths)) + "I", *lengths))
+        indexFile.write(struct.pack("<" + str(len(recipeOffsets)) + "Q", *recipeOffsets))
+        for term, entries in encodedTerms:
+            indexFile.write(term)
+        for encodedRecipe in encodedRecipes:
+            indexFile.write(encodedRecipe)
+    os.replace(temporaryPath, indexPath)
+
+############################################################################
+# Name: littleEndianArray                                                  #
+# Params: view (a memoryview of one numeric section), typeCode ("I" or     #
+# "Q", same as the section was packed with)                                #
+# Returns: Something indexable and sliceable like an array of those numbers #
+# Notes: The index is always written little-endian. On a little-endian     #
+# machine the section is viewed in place; anywhere else it is copied into  #
+# an array and byte-swapped, so an index built on one machine reads the    #
+# same on any other.                                                       #
+############################################################################
+def littleEndianArray(view, typeCode):
+    if sys.byteorder == "little":
+        return view.cast(typeCode)
+    swapped = array.array(typeCode, view.tobytes())
+    swapped.byteswap()
+    return swapped
+
+class RecipeCatalog:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: indexPath (an index written by buildIndex)                       #
+    # Returns: None                                                            #
+    # Notes: Maps the file instead of reading it. The numeric sections are     #
+    # viewed in place as arrays, so nothing is copied until a search needs it  #
+    # (except on a big-endian machine, see littleEndianArray).                 #
+    ############################################################################
+    def __init__(self, indexPath):
+        self.indexPath = indexPath
+        self.indexFile = open(indexPath, "rb")
+        self.data = mmap.mmap(self.indexFile.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, self.recipeCount, self.termCount, self.averageLength, reserved = struct.unpack_from(headerFormat, self.data, 0)
+        if magic != indexMagic or version != indexVersion:
+            raise ValueError(indexPath + " is not a recipe index this version of the bot can read")
+
+        self.view = memoryview(self.data)
+        position = headerSize
+        self.termOffsets = littleEndianArray(self.view[position:position + 4 * (self.termCount + 1)], "I")
+        position += 4 * (self.termCount + 1)
+        self.postOffsets = littleEndianArray(self.view[position:position + 4 * (self.termCount + 1)], "I")
+        position += 4 * (self.termCount + 1)
+        postingCount = self.postOffsets[self.termCount] if self.termCount > 0 else 0
+        self.postings = littleEndianArray(self.view[position:position + 8 * postingCount], "I")
+        position += 8 * postingCount
+        self.lengths = littleEndianArray(self.view[position:position + 4 * self.recipeCount], "I")
+        position += 4 * self.recipeCount
+        self.recipeOffsets = littleEndianArray(self.view[position:position + 8 * (self.recipeCount + 1)], "Q")
+        position += 8 * (self.recipeCount + 1)
+        self.termBlobStart = position
+        self.recipeBlobStart = position + (self.termOffsets[self.termCount] if self.termCount > 0 else 0)
+
+    ############################################################################
+    # Name: _termAt                                                            #
+    # Params: position (index into the sorted term table)                      #
+    # Returns: The term's bytes                                                #
+    # Notes: None                                                              #
+    ############################################################################
+    def _termAt(self, position):
+        return self.data[self.termBlobStart + self.termOffsets[position]:self.termBlobStart + self.termOffsets[position + 1]]
+
+    ############################################################################
+    # Name: _findTerm                                                          #
+    # Params: term (already run through terms())                               #
+    # Returns: Its position in the term table, or None                         #
+    # Notes: Plain binary search, as in ConceptIndex.flagsFor.                 #
+    ############################################################################
+    def _findTerm(self, term):
+        target = term.encode("utf-8")
+        low = 0
+        high = self.termCount
+        while low < high:
+            middle = (low + high) // 2
+            middleTerm = self._termAt(middle)
+            if middleTerm < target:
+                low = middle + 1
+            elif middleTerm > target:
+                high = middle
+            else:
+                return middle
+        return None
+
+    ############################################################################
+    # Name: search                                                             #
+    # Params: query (what the user typed), limit (most results to return)      #
+    # Returns: A list of SearchResult, best first                              #
+    # Notes: Standard BM25 over the terms of the query. Only the posting lists #
+    # of those terms are read, so the cost follows how common the words are,   #
+    # not how many recipes there are.                                          #
+    ############################################################################
+    def search(self, query, limit = defaultResults):
+        scores = dict()
+        for term in set(terms(query)):
+            position = self._findTerm(term)
+            if position is None:
+                continue
+            start = 2 * self.postOffsets[position]
+            stop = 2 * self.postOffsets[position + 1]
+            documentFrequency = (stop - start) // 2
+            idf = math.log(1 + (self.recipeCount - documentFrequency + 0.5) / (documentFrequency + 0.5))
+            entries = self.postings[start:stop]
+            for recipeNumber, frequency in zip(entries[0::2], entries[1::2]):
+                lengthRatio = self.lengths[recipeNumber] / self.averageLength if self.averageLength > 0 else 1.0
+                scores[recipeNumber] = scores.get(recipeNumber, 0.0) + idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * lengthRatio))
+
+        best = sorted(scores.items(), key = lambda item: (-item[1], item[0]))[:limit]
+        results = []
+        for recipeNumber, score in best:
+            recipe = self.recipe(recipeNumber)
+            results.append(SearchResult(score, recipeNumber, recipe.get("recipeName", recipe["url"]), recipe["url"]))
+        return results
+
+    ############################################################################
+    # Name: recipe                                                             #
+    # Params: recipeNumber (from a SearchResult)                               #
+    # Returns: The recipe dict, with its "url"                                 #
+    # Notes: None                                                              #
+    ############################################################################
+    def recipe(self, recipeNumber):
+        start = self.recipeBlobStart + self.recipeOffsets[recipeNumber]
+        stop = self.recipeBlobStart + self.recipeOffsets[recipeNumber + 1]
+        return json.loads(self.data[start:stop].decode("utf-8"))
+
+    def __len__(self):
+        return self.recipeCount
+
+    ############################################################################
+    # Name: close                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Releases the array views, then unmaps the index and closes the    #
+    # file.                                                                    #
+    ############################################################################
+    def close(self):
+        for arrayView in [self.termOffsets, self.postOffsets, self.postings, self.lengths, self.recipeOffsets, self.view]:
+            if isinstance(arrayView, memoryview):
+                arrayView.release()
+        self.data.close()
+        self.indexFile.close()
+
+############################################################################
+# Name: parsedNames                                                        #
+# Params: recipe (one line of recipeCrawler.py output)                     #
+# Returns: The isa of every ingredient, from the bot's own parser          #
+# Notes: Much slower than ingredientName the first time, but parses go in  #
+# the recipe store, so building again later is quick.                      #
+############################################################################
+def parsedNames(recipe):
+    from recipeBot import RecipeBot # Only here, since the bot imports this module
+    parser = RecipeBot.__new__(RecipeBot) # No conversation, so nothing to ask or fetch
+    parser.outputFunc = lambda message: None
+    parser.recipe = Recipe(recipe["url"], dict((key, value) for key, value in recipe.items() if key != "url"))
+    parser._allParsing()
+    return [record.isa for record in parser.ingPredicates.values()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Build or search a local index of scraped recipes.")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+    buildParser = subparsers.add_parser("build", help = "Index a JSON lines file from recipeCrawler.py")
+    buildParser.add_argument("recipes", help = "JSON lines file of recipes")
+    buildParser.add_argument("index", help = "Where to write the index")
+    buildParser.add_argument("--parse", action = "store_true", help = "Index the ingredient names from the full parser (slow, but stored parses are reused)")
+    searchParser = subparsers.add_parser("search", help = "Print the best matches for a search")
+    searchParser.add_argument("index", help = "An index from the build command")
+    searchParser.add_argument("query", help = "What to search for, like \"chicken and broth soup\"")
+    searchParser.add_argument("--limit", type = int, default = 10, help = "Most results to show")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        namesFunc = None
+        if args.parse:
+            from recipeBot import RecipeBot
+            from recipeStore import RecipeStore
+            from conceptCache import ConceptCache
+            RecipeBot.conceptCache = ConceptCache()
+            RecipeBot.recipeStore = RecipeStore(version = RecipeBot.parserVersion())
+            namesFunc = parsedNames
+        buildStart = time.perf_counter()
+        recipeCount = buildIndex(args.recipes, args.index, namesFunc)
+        print("Indexed " + str(recipeCount) + " recipes into " + args.index + " in " + "{:.1f}".format(time.perf_counter() - buildStart) + "s")
+    else:
+        catalog = RecipeCatalog(args.index)
+        searchStart = time.perf_counter()
+        results = catalog.search(args.query, args.limit)
+        searchSeconds = time.perf_counter() - searchStart
+        for result in results:
+            print("{:8.3f}  {}  {}".format(result.score, result.name, result.url))
+        print(str(len(results)) + " results from " + str(len(catalog)) + " recipes in " + "{:.2f}".format(searchSeconds * 1000) + "ms")
+        catalog.close()
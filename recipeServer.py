@@ -0,0 +1,453 @@
+### Multi-session conversation server
+### Hosts many independent cooking sessions in one asyncio process. Each session gets its own
+### RecipeBot (and so its own recipe and predicates), while the spaCy model is loaded once and
+### shared read-only by all of them. Parsed recipes are shared too, through the recipe cache (see
+### recipeState.py), so sessions for a recipe someone else just parsed start straight away. A
+### session can move on to another recipe by saying "load a new recipe". Sessions can be reached over a small JSON-over-HTTP API, or
+### as JSON lines on stdin/stdout when there is no network to listen on.
+###
+### HTTP API:
+###   POST   /sessions       {"url": "..."}   -> {"session": id, "replies": [...], "done": false}
+###   POST   /sessions/<id>  {"text": "..."}  -> {"session": id, "replies": [...], "done": bool}
+###   DELETE /sessions/<id>                   -> {"session": id, "closed": true}
+###   POST   /annotate       {"recipes": [...]} -> {"results": [...], "costs": {...}} (see batchAnnotate.py)
+###   GET    /stats                           -> counts of live, finished and evicted sessions
+###   GET    /metrics                         -> per-stage timings, counters and cache stats
+###
+### JSON lines (--stdio): every line in is {"session": id, "url": "..."} to start a session, or
+### {"session": id, "text": "..."} for a turn ({"recipes": [...]} parses a batch of recipes), and
+### every line out is the same response as above.
+from recipeBot import RecipeBot
+from instrumentation import metrics
+from batchAnnotate import annotateChunk
+from transcripts import TranscriptRecorder
+from recipeState import RecipeCache, defaultMaxRecipes, defaultMaxBytes
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import argparse
+import json
+import time
+import sys
+import uuid
+
+class InputNotAvailable(Exception):
+    pass
+
+class BotSession:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: sessionID (name of the session), recipeURL (the recipe to cook), #
+    # loop (the server's event loop), executor (the pool turns are run on),    #
+    # turnTimeout (most seconds a turn may take, None for no limit)            #
+    # Returns: None                                                            #
+    # Notes: A session is just a RecipeBot and its state. Nothing is running   #
+    # between turns; each turn borrows a worker from the shared pool, so an    #
+    # idle session costs no thread at all.                                     #
+    ############################################################################
+    def __init__(self, sessionID, recipeURL, loop, executor = None, turnTimeout = None):
+        self.sessionID = sessionID
+        self.recipeURL = recipeURL
+        self.loop = loop
+        self.executor = executor
+        self.turnTimeout = turnTimeout
+        self.bot = None
+        self.replies = [] # What the bot said during the current turn
+        self.done = False # True once the conversation is over
+        self.lastActive = time.monotonic()
+        self.turnLock = asyncio.Lock() # Turns for one session are taken one at a time, in the order they arrived
+
+    ############################################################################
+    # Name: start                                                              #
+    # Params: None                                                             #
+    # Returns: The replies up to the bot's first question                      #
+    # Notes: Fetching and parsing happens on the pool, so the event loop keeps #
+    # serving every other session in the meantime.                             #
+    ############################################################################
+    async def start(self):
+        await self.turnLock.acquire()
+        return await self._onPool(self._start)
+
+    ############################################################################
+    # Name: turn                                                               #
+    # Params: text (what the user said)                                        #
+    # Returns: The bot's replies up to its next question                       #
+    # Notes: None                                                              #
+    ############################################################################
+    async def turn(self, text):
+        await self.turnLock.acquire()
+        if self.done:
+            self.turnLock.release()
+            return []
+        self.lastActive = time.monotonic()
+        return await self._onPool(self._turn, text)
+
+    ############################################################################
+    # Name: _onPool                                                            #
+    # Params: function (_start or _turn), args (what to call it with)          #
+    # Returns: What the function returned                                      #
+    # Notes: The caller holds turnLock, and it is released once the function   #
+    # has really finished. A thread on the pool cannot be stopped, so a turn   #
+    # that runs past turnTimeout keeps going after asyncio.TimeoutError is     #
+    # raised here. The session is closed for good at that point, since the     #
+    # bot is still busy with the last turn and its replies would get mixed in  #
+    # with the next one's.                                                     #
+    ############################################################################
+    async def _onPool(self, function, *args):
+        pendingTurn = self.loop.run_in_executor(self.executor, function, *args)
+        try:
+            return await asyncio.wait_for(asyncio.shield(pendingTurn), self.turnTimeout)
+        except BaseException:
+            if not pendingTurn.done():
+                self.done = True
+                pendingTurn.add_done_callback(lambda finishedTurn: self.turnLock.release())
+                pendingTurn = None
+            raise
+        finally:
+            if pendingTurn is not None:
+                self.turnLock.release()
+
+    ############################################################################
+    # Name: close                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: There is no thread to stop, so closing just marks it done.        #
+    ############################################################################
+    def close(self):
+        self.done = True
+
+    ############################################################################
+    # Name: _start                                                             #
+    # Params: None                                                             #
+    # Returns: The replies up to the bot's first question                      #
+    # Notes: Runs on the pool.                                                 #
+    ############################################################################
+    def _start(self):
+        try:
+            self._say("\nThank you! This conversation will continue momentarily, but some things need to be readied first. This could take a little while.")
+            self.bot = RecipeBot(self.recipeURL, inputFunc = self._noInput, outputFunc = self._say)
+            self.bot.startConversation()
+        except InputNotAvailable:
+            self._say("\nSessions here have to start from a recipe URL, since I cannot ask which search result you meant before the session exists. Please start a new session with the recipe's URL.")
+            self.done = True
+        except Exception as sessionError:
+            self._say("\nI'm sorry, something went really wrong with this session: " + repr(sessionError))
+            self.done = True
+        return self._finishTurn()
+
+    ############################################################################
+    # Name: _noInput                                                           #
+    # Params: prompt (what the bot wanted to ask)                              #
+    # Returns: Nothing, it always raises InputNotAvailable                     #
+    # Notes: The bot's inputFunc. Everything the user says comes in as turns,  #
+    # so a bot that asks for input directly (like _chooseRecipe, for a search  #
+    # at the start with a recipe catalog) would otherwise block a pool thread  #
+    # on the server's stdin.                                                   #
+    ############################################################################
+    def _noInput(self, prompt):
+        raise InputNotAvailable(prompt)
+
+    ############################################################################
+    # Name: _turn                                                              #
+    # Params: text (what the user said)                                        #
+    # Returns: The bot's replies up to its next question                       #
+    # Notes: Runs on the pool.                                                 #
+    ############################################################################
+    def _turn(self, text):
+        try:
+            self.bot.handleTurn(text)
+        except Exception as sessionError:
+            self._say("\nI'm sorry, something went really wrong with this session: " + repr(sessionError))
+            self.done = True
+        return self._finishTurn()
+
+    ############################################################################
+    # Name: _say                                                               #
+    # Params: message (what the bot wants to tell the user)                    #
+    # Returns: None                                                            #
+    # Notes: Stands in for print() while a turn runs.                          #
+    ############################################################################
+    def _say(self, message):
+        self.replies.append(message)
+
+    ############################################################################
+    # Name: _finishTurn                                                        #
+    # Params: None                                                             #
+    # Returns: The replies for this turn, ending with the bot's next question  #
+    # Notes: None                                                              #
+    ############################################################################
+    def _finishTurn(self):
+        if self.bot is not None and self.bot.isDone():
+            self.done = True
+        elif not self.done:
+            self.replies.append(self.bot.prompt)
+        replies = self.replies
+        self.replies = []
+        return replies
+
+class SessionManager:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: maxSessions (most live sessions at once), idleTimeout (seconds   #
+    # without a turn before a session is evicted), turnTimeout (most seconds   #
+    # a single turn may take), workers (most turns running at once)            #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, maxSessions = 5000, idleTimeout = 30 * 60, turnTimeout = 300, workers = 32):
+        self.executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "turn") # Shared by every session
+        self.maxSessions = maxSessions
+        self.idleTimeout = idleTimeout
+        self.turnTimeout = turnTimeout
+        self.sessions = dict()
+        self.finished = 0
+        self.evicted = 0
+
+    ############################################################################
+    # Name: handle                                                             #
+    # Params: message (a dict with a "url" to start a session, or a "text"     #
+    # for a turn, plus an optional "session" id, or "recipes" to parse a batch #
+    # of recipes without any session)                                          #
+    # Returns: The response dict                                               #
+    # Notes: Shared by the HTTP and JSON lines front ends.                     #
+    ############################################################################
+    async def handle(self, message):
+        if "recipes" in message:
+            return await self._annotate(message["recipes"])
+        sessionID = message.get("session")
+        if "url" in message:
+            if len(self.sessions) >= self.maxSessions:
+                return {"error": "The server is full, please try again later."}
+            sessionID = sessionID if sessionID is not None else uuid.uuid4().hex
+            if sessionID in self.sessions:
+                return {"session": sessionID, "error": "That session already exists."}
+            session = BotSession(sessionID, message["url"], asyncio.get_running_loop(), self.executor, self.turnTimeout)
+            self.sessions[sessionID] = session
+            return await self._respond(session, session.start())
+
+        if sessionID not in self.sessions:
+            return {"session": sessionID, "error": "There is no such session (it may have finished or been idle too long)."}
+        if message.get("close"):
+            self.sessions.pop(sessionID).close()
+            self.finished += 1
+            return {"session": sessionID, "closed": True}
+        session = self.sessions[sessionID]
+        return await self._respond(session, session.turn(str(message.get("text", ""))))
+
+    ############################################################################
+    # Name: _annotate                                                          #
+    # Params: recipes (list of recipe dicts, like recipeCrawler.py writes)     #
+    # Returns: The response dict, with one result per recipe in order          #
+    # Notes: Takes up one of the turn workers for the whole batch.             #
+    ############################################################################
+    async def _annotate(self, recipes):
+        if not isinstance(recipes, list):
+            return {"error": "recipes must be a list of recipes."}
+        pendingBatch = asyncio.get_running_loop().run_in_executor(self.executor, annotateChunk, list(enumerate(recipes, 1)))
+        try:
+            outputLines, costs = await asyncio.wait_for(pendingBatch, self.turnTimeout)
+        except asyncio.TimeoutError:
+            return {"error": "That took too long, please try a smaller batch."}
+        return {"results": [json.loads(outputLine) for _, outputLine in outputLines], "costs": costs}
+
+    ############################################################################
+    # Name: _respond                                                           #
+    # Params: session (the BotSession), pendingTurn (coroutine for the turn)   #
+    # Returns: The response dict                                               #
+    # Notes: Finished sessions are dropped right away, and so are sessions     #
+    # whose turn ran out of time (see BotSession._onPool).                     #
+    ############################################################################
+    async def _respond(self, session, pendingTurn):
+        try:
+            replies = await pendingTurn
+        except asyncio.TimeoutError:
+            if self.sessions.get(session.sessionID) is session:
+                del self.sessions[session.sessionID]
+                self.finished += 1
+            return {"session": session.sessionID, "error": "That took too long, so this session has been closed. Please start a new one.", "done": True}
+        if session.done and self.sessions.get(session.sessionID) is session:
+            del self.sessions[session.sessionID]
+            self.finished += 1
+        return {"session": session.sessionID, "replies": replies, "done": session.done}
+
+    ############################################################################
+    # Name: evictIdle                                                          #
+    # Params: onEvicted (optional coroutine function, given the list of ids    #
+    # evicted by each sweep that evicted any)                                  #
+    # Returns: None                                                            #
+    # Notes: Runs forever, closing sessions nobody has talked to in a while.   #
+    # onEvicted is how a prefork worker tells the supervisor, which routes by  #
+    # session id and would otherwise never hear about these.                   #
+    ############################################################################
+    async def evictIdle(self, onEvicted = None):
+        while True:
+            await asyncio.sleep(min(60, self.idleTimeout / 2))
+            now = time.monotonic()
+            evictedIDs = [key for key, session in self.sessions.items() if now - session.lastActive > self.idleTimeout]
+            for sessionID in evictedIDs:
+                self.sessions.pop(sessionID).close()
+                self.evicted += 1
+            if onEvicted is not None and len(evictedIDs) > 0:
+                await onEvicted(evictedIDs)
+
+    ############################################################################
+    # Name: stats                                                              #
+    # Params: None                                                             #
+    # Returns: A dict of session counts                                        #
+    # Notes: None                                                              #
+    ############################################################################
+    def stats(self):
+        return {"live": len(self.sessions), "finished": self.finished, "evicted": self.evicted, "maxSessions": self.maxSessions}
+
+############################################################################
+# Name: serveHTTP                                                          #
+# Params: manager (the SessionManager), host, port                         #
+# Returns: None (runs until the process is stopped)                        #
+# Notes: Just enough HTTP/1.1 for the JSON API above, with keep-alive.     #
+############################################################################
+async def serveHTTP(manager, host, port):
+    async def handleConnection(reader, writer):
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+                method, path, version = requestLine.decode("latin-1").split(" ", 2)
+                headers = dict()
+                while True:
+                    headerLine = (await reader.readline()).decode("latin-1").strip()
+                    if headerLine == "":
+                        break
+                    name, value = headerLine.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+
+                status, response = await routeHTTP(manager, method, path, body)
+                payload = json.dumps(response).encode("utf-8")
+                keepAlive = headers.get("connection", "").lower() != "close" and version.strip() == "HTTP/1.1"
+                writer.write(("HTTP/1.1 " + status + "\r\nContent-Type: application/json\r\nContent-Length: " + str(len(payload)) + \
+                "\r\nConnection: " + ("keep-alive" if keepAlive else "close") + "\r\n\r\n").encode("latin-1") + payload)
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass # A malformed request or a client hanging up just ends the connection
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handleConnection, host, port)
+    print("Serving " + RecipeBot.name + " on http://" + host + ":" + str(port), file = sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+############################################################################
+# Name: routeHTTP                                                          #
+# Params: manager (the SessionManager), method, path, body (raw bytes)     #
+# Returns: (status line, response dict)                                    #
+# Notes: None                                                              #
+############################################################################
+async def routeHTTP(manager, method, path, body):
+    try:
+        message = json.loads(body) if body else dict()
+    except ValueError:
+        message = None
+    if not isinstance(message, dict): # Valid JSON can still be a list or a bare string
+        return "400 Bad Request", {"error": "The body must be a JSON object."}
+
+    pieces = [piece for piece in path.split("?")[0].split("/") if piece != ""]
+    if method == "GET" and pieces == ["stats"]:
+        return "200 OK", manager.stats()
+    if method == "GET" and pieces == ["metrics"]:
+        return "200 OK", metrics.snapshot()
+    if method == "POST" and pieces == ["sessions"] and "url" in message:
+        message.pop("session", None) # The server picks the id for HTTP clients
+        response = await manager.handle(message)
+    elif method == "POST" and pieces == ["annotate"]:
+        response = await manager.handle({"recipes": message.get("recipes")})
+    elif len(pieces) == 2 and pieces[0] == "sessions" and method in ("POST", "DELETE"):
+        response = await manager.handle({"session": pieces[1], "text": message.get("text", ""), "close": method == "DELETE"})
+    else:
+        return "404 Not Found", {"error": "Unknown endpoint."}
+    return ("200 OK" if "error" not in response else "409 Conflict"), response
+
+############################################################################
+# Name: serveStdio                                                         #
+# Params: manager (the SessionManager)                                     #
+# Returns: None (runs until stdin closes)                                  #
+# Notes: Every line is handled in its own task, so a slow turn in one      #
+# session does not hold up the others. Responses can come out of order,    #
+# which is why every one carries its session id.                           #
+############################################################################
+async def serveStdio(manager):
+    loop = asyncio.get_running_loop()
+    writeLock = asyncio.Lock()
+
+    async def handleLine(line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            message = None
+        if isinstance(message, dict):
+            response = await manager.handle(message)
+        else:
+            response = {"error": "Every line must be a JSON object."}
+        async with writeLock:
+            sys.stdout.write(json.dumps(response) + "\n")
+            sys.stdout.flush()
+
+    pending = set()
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            break
+        if line.strip() != "":
+            task = asyncio.ensure_future(handleLine(line))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+    if len(pending) > 0:
+        await asyncio.wait(pending)
+
+############################################################################
+# Name: main                                                               #
+# Params: args (parsed command line arguments)                             #
+# Returns: None                                                            #
+# Notes: None                                                              #
+############################################################################
+async def main(args):
+    manager = SessionManager(args.max_sessions, args.idle_timeout, args.turn_timeout, args.workers)
+    metrics.addSource("sessions", manager.stats)
+    RecipeBot.modelLoader.start() # Every session shares this one model, so get it loading right away
+    evictor = asyncio.ensure_future(manager.evictIdle())
+    try:
+        if args.stdio:
+            await serveStdio(manager)
+        else:
+            await serveHTTP(manager, args.host, args.port)
+    finally:
+        evictor.cancel()
+        manager.executor.shutdown(wait = False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serve many " + RecipeBot.name + " conversations from one process.")
+    parser.add_argument("--host", default = "127.0.0.1", help = "Address to listen on")
+    parser.add_argument("--port", type = int, default = 8337, help = "Port to listen on")
+    parser.add_argument("--stdio", action = "store_true", help = "Speak JSON lines on stdin/stdout instead of HTTP")
+    parser.add_argument("--max-sessions", type = int, default = 5000, help = "Most sessions to host at once")
+    parser.add_argument("--idle-timeout", type = float, default = 30 * 60, help = "Seconds of silence before a session is evicted")
+    parser.add_argument("--turn-timeout", type = float, default = 300, help = "Most seconds a single turn (including the first fetch and parse) may take before its session is closed")
+    parser.add_argument("--workers", type = int, default = 32, help = "Most turns (fetching, parsing or answering) running at once")
+    parser.add_argument("--progressive", action = "store_true", help = "Start every session once its ingredients and first step are parsed, and parse the other steps in the background")
+    parser.add_argument("--recipe-cache-size", type = int, default = defaultMaxRecipes, help = "Most parsed recipes to keep in memory for new sessions to share (0 keeps none)")
+    parser.add_argument("--recipe-cache-mb", type = float, default = defaultMaxBytes / (1024 * 1024), help = "Most memory, in MB, the parsed recipes kept in memory may take")
+    parser.add_argument("--record", metavar = "TRANSCRIPT_FILE", help = "Append every session's recipe and turns to this file, for loadGenerator.py to replay")
+    args = parser.parse_args()
+    RecipeBot.progressiveParsing = args.progressive
+    if args.recipe_cache_size > 0:
+        RecipeBot.recipeCache = RecipeCache(args.recipe_cache_size, int(args.recipe_cache_mb * 1024 * 1024))
+        metrics.addSource("recipeCache", RecipeBot.recipeCache.stats)
+    if args.record is not None:
+        RecipeBot.transcriptRecorder = TranscriptRecorder(args.record)
+
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
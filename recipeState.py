@@ -0,0 +1,183 @@
+### Per-session recipe state
+### Everything the bot knows about the recipe being cooked (the scraped data, the spaCy parses, the
+### ConceptNet answers fetched for it, the predicates and the step index) lives on one Recipe, so
+### the bot can let go of one recipe and pick up another without restarting, and without reloading
+### spaCy. Once a recipe is parsed, the parses and ConceptNet answers are dropped (only the
+### predicates are needed from then on) and the recipe goes into a RecipeCache. That is a least
+### recently used cache bounded both by count and by the memory its recipes hold, so going back to
+### an earlier recipe is instant while a long-running process never holds more than the bound.
+from collections import OrderedDict
+import threading
+import types
+import sys
+
+defaultMaxRecipes = 32
+defaultMaxBytes = 64 * 1024 * 1024
+
+############################################################################
+# Name: deepSize                                                           #
+# Params: value (any object)                                               #
+# Returns: Roughly how many bytes the object and everything it holds take  #
+# Notes: sys.getsizeof over everything reachable through containers,       #
+# __dict__ and __slots__, counting shared objects once. Classes, modules   #
+# and functions are not followed, since they are not the recipe's to own.  #
+############################################################################
+def deepSize(value):
+    seen = set()
+    pending = [value]
+    totalBytes = 0
+    while len(pending) > 0:
+        item = pending.pop()
+        if id(item) in seen or isinstance(item, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            continue
+        seen.add(id(item))
+        totalBytes += sys.getsizeof(item)
+        if isinstance(item, dict):
+            pending += list(item.keys()) + list(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            pending += list(item)
+        elif not isinstance(item, (str, bytes, int, float, bool)):
+            if hasattr(item, "__dict__"):
+                pending.append(vars(item))
+            for itemClass in type(item).__mro__:
+                slots = getattr(itemClass, "__slots__", ())
+                for slot in ([slots] if isinstance(slots, str) else slots):
+                    if hasattr(item, slot):
+                        pending.append(getattr(item, slot))
+    return totalBytes
+
+############################################################################
+# Name: recipeField                                                        #
+# Params: name (an attribute of Recipe)                                    #
+# Returns: A property that reads and writes that attribute on the bot's    #
+# current recipe                                                           #
+# Notes: The parsers and the conversation keep using self.ingPredicates    #
+# and the rest, and swapping self.recipe swaps every one of them at once.  #
+############################################################################
+def recipeField(name):
+    return property(lambda bot: getattr(bot.recipe, name), lambda bot, value: setattr(bot.recipe, name, value))
+
+class Recipe:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: recipeURL, recipeData (what fetchRecipe returned, or None if it  #
+    # is still being fetched)                                                  #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, recipeURL, recipeData = None):
+        self.recipeURL = recipeURL
+        self.recipeData = recipeData
+        self.recipeLoader = None # Fetches and scrapes the recipe in the background when recipeData is None
+        self.ingPredicates = dict() # The predicates, as records (see recipeRecords.py)
+        self.instPredicates = dict()
+        self.recipeIndex = None # Which steps use which ingredients, built once parsing is done
+        self.ingDocs = None # spaCy's parses and the phrase matches, only kept while parsing
+        self.instDocs = None
+        self.ingMatches = None
+        self.prefetched = None # ConceptNet responses fetched ahead of parsing, only kept while parsing
+        self.prefetchReport = None # Latency summary of the last prefetch
+        self.termClassifier = None # Answers the food/action/tool questions for this recipe
+        self.stepScheduler = None # Parses the other steps in the background with progressive parsing
+        self.restoredFromStore = False # True if the predicates came from the store instead of the parser
+        self.parsed = False # True once every step has its predicates
+
+    ############################################################################
+    # Name: release                                                            #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Drops everything only the parsing needed. The parses and the      #
+    # ConceptNet answers are most of a recipe's memory, and the conversation   #
+    # never looks at them again.                                               #
+    ############################################################################
+    def release(self):
+        self.recipeLoader = None
+        self.ingDocs = None
+        self.instDocs = None
+        self.ingMatches = None
+        self.prefetched = None
+        self.stepScheduler = None
+
+    ############################################################################
+    # Name: sizeBytes                                                          #
+    # Params: None                                                             #
+    # Returns: Roughly how much memory the recipe holds                        #
+    # Notes: Only counts what the recipe owns. The classifier's tiers point at #
+    # things every recipe shares (the model, the index), so only its answers   #
+    # are counted.                                                             #
+    ############################################################################
+    def sizeBytes(self):
+        owned = [self.recipeURL, self.recipeData, self.ingPredicates, self.instPredicates, self.recipeIndex,
+        self.ingDocs, self.instDocs, self.ingMatches, self.prefetched, self.prefetchReport]
+        if self.termClassifier is not None:
+            owned += [self.termClassifier.decisions, self.termClassifier.counts]
+        return deepSize(owned)
+
+class RecipeCache:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: maxRecipes (most recipes to keep), maxBytes (most memory, by     #
+    # Recipe.sizeBytes, to keep)                                               #
+    # Returns: None                                                            #
+    # Notes: Shared by every bot in the process, so it has its own lock.       #
+    ############################################################################
+    def __init__(self, maxRecipes = defaultMaxRecipes, maxBytes = defaultMaxBytes):
+        self.maxRecipes = maxRecipes
+        self.maxBytes = maxBytes
+        self.recipes = OrderedDict() # URL -> (Recipe, its size), least recently used first
+        self.totalBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    ############################################################################
+    # Name: get                                                                #
+    # Params: recipeURL                                                        #
+    # Returns: The parsed Recipe, or None on a miss                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def get(self, recipeURL):
+        with self.lock:
+            entry = self.recipes.get(recipeURL)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.recipes.move_to_end(recipeURL)
+            self.hits += 1
+            return entry[0]
+
+    ############################################################################
+    # Name: put                                                                #
+    # Params: recipe (a parsed Recipe)                                         #
+    # Returns: None                                                            #
+    # Notes: Evicts the least recently used recipes until both bounds hold     #
+    # again. A recipe too big to fit on its own is not kept at all.            #
+    ############################################################################
+    def put(self, recipe):
+        recipeBytes = recipe.sizeBytes() # Measured outside the lock, since it walks the whole recipe
+        with self.lock:
+            previous = self.recipes.pop(recipe.recipeURL, None)
+            if previous is not None:
+                self.totalBytes -= previous[1]
+            if recipeBytes > self.maxBytes or self.maxRecipes < 1:
+                return
+            self.recipes[recipe.recipeURL] = (recipe, recipeBytes)
+            self.totalBytes += recipeBytes
+            while len(self.recipes) > self.maxRecipes or self.totalBytes > self.maxBytes:
+                evictedURL, (evicted, evictedBytes) = self.recipes.popitem(last = False)
+                self.totalBytes -= evictedBytes
+                self.evictions += 1
+
+    ############################################################################
+    # Name: stats                                                              #
+    # Params: None                                                             #
+    # Returns: A dict with the recipe count, the memory they hold, the bounds  #
+    # and the hit/miss/eviction counters                                       #
+    # Notes: None                                                              #
+    ############################################################################
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"recipes": len(self.recipes), "bytes": self.totalBytes, "maxRecipes": self.maxRecipes, "maxBytes": self.maxBytes,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "hitRate": (self.hits / lookups) if lookups > 0 else 0.0}
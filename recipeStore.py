@@ -0,0 +1,190 @@
+### Persistent store of fully parsed recipes, backed by SQLite
+### Parsing a recipe (spaCy, then ConceptNet for every candidate word) is the slow part of starting
+### a session. Once a recipe has been parsed its predicates are kept here, keyed by the URL and a
+### hash of the recipe's content, so the next session with the same recipe skips parsing (and
+### spaCy) entirely. Entries are also tagged with a version made from the spaCy model's version and
+### the parser's own source code, so changing either quietly retires every old entry.
+from recipeRecords import IngredientRecord, StepRecord
+from importlib import metadata
+import threading
+import hashlib
+import inspect
+import sqlite3
+import json
+import time
+import os
+
+############################################################################
+# Name: contentHash                                                        #
+# Params: recipeData (the dict from fetchRecipe)                           #
+# Returns: A hex SHA-256 of the recipe's content                           #
+# Notes: If the site edits the recipe, the hash changes and the old parse  #
+# is no longer used.                                                       #
+############################################################################
+def contentHash(recipeData):
+    return hashlib.sha256(json.dumps(recipeData, sort_keys = True).encode("utf-8")).hexdigest()
+
+############################################################################
+# Name: parserVersion                                                      #
+# Params: modelName (the spaCy model package), sources (functions,         #
+# classes, modules or plain values the parse depends on)                   #
+# Returns: A short hex version string                                      #
+# Notes: Code is hashed by its source, anything else by its repr, so       #
+# editing a parser method or one of the word lists changes the version.    #
+############################################################################
+def parserVersion(modelName, sources):
+    versionHash = hashlib.sha256()
+    for packageName in ["spacy", modelName]:
+        try:
+            versionHash.update((packageName + "==" + metadata.version(packageName)).encode("utf-8"))
+        except metadata.PackageNotFoundError:
+            versionHash.update((packageName + " not installed").encode("utf-8"))
+    for source in sources:
+        try:
+            versionHash.update(inspect.getsource(source).encode("utf-8"))
+        except (TypeError, OSError): # Not code, or code without a source file
+            versionHash.update(repr(sorted(source) if isinstance(source, (set, frozenset)) else source).encode("utf-8"))
+    return versionHash.hexdigest()[:16]
+
+class RecipeStore:
+    defaultPath = os.path.join(os.path.expanduser("~"), ".recipeBot", "recipeStore.sqlite3")
+    defaultMaxEntries = 2000 # Least recently used recipes get thrown out past this point
+
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: path (where the SQLite file lives), maxEntries (size bound for   #
+    # LRU eviction), version (from parserVersion)                              #
+    # Returns: None                                                            #
+    # Notes: Opens (or creates) the store. Entries from any other version are  #
+    # never returned, and get dropped the next time their URL is stored.       #
+    ############################################################################
+    def __init__(self, path = None, maxEntries = None, version = ""):
+        self.path = path if path is not None else self.defaultPath
+        self.maxEntries = maxEntries if maxEntries is not None else self.defaultMaxEntries
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock() # The connection gets shared, so only one thread talks to SQLite at a time
+
+        if self.path != ":memory:" and os.path.dirname(self.path) != "":
+            os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        self.connection = sqlite3.connect(self.path, check_same_thread = False)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS recipes (
+            url TEXT NOT NULL,
+            contentHash TEXT NOT NULL,
+            version TEXT NOT NULL,
+            recipeData TEXT NOT NULL,
+            ingPredicates TEXT NOT NULL,
+            instPredicates TEXT NOT NULL,
+            createdAt REAL NOT NULL,
+            lastAccess REAL NOT NULL,
+            PRIMARY KEY (url, contentHash, version))""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS recipesByAccess ON recipes (lastAccess)")
+        self.connection.commit()
+
+    ############################################################################
+    # Name: hasURL                                                             #
+    # Params: url                                                              #
+    # Returns: True if some parse of this URL exists for the current version   #
+    # Notes: Used before the recipe has even been fetched, to guess whether    #
+    # spaCy will be needed at all. The content hash is checked later in get.   #
+    ############################################################################
+    def hasURL(self, url):
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM recipes WHERE url = ? AND version = ? LIMIT 1", (url, self.version)).fetchone()
+        return row is not None
+
+    ############################################################################
+    # Name: get                                                                #
+    # Params: url, recipeData (what was just fetched from the URL)             #
+    # Returns: (ingPredicates, instPredicates), or None on a miss              #
+    # Notes: The predicate dicts are stored as lists of [key, fields] pairs,   #
+    # so the keys (strings for ingredients, step numbers for instructions)     #
+    # come back with the same types and in the same order they were parsed,    #
+    # and the fields are turned back into records (see recipeRecords.py).      #
+    ############################################################################
+    def get(self, url, recipeData):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT ingPredicates, instPredicates FROM recipes WHERE url = ? AND contentHash = ? AND version = ?",
+            (url, contentHash(recipeData), self.version)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE recipes SET lastAccess = ? WHERE url = ? AND contentHash = ? AND version = ?",
+            (now, url, contentHash(recipeData), self.version))
+            self.connection.commit()
+            self.hits += 1
+        return (dict((key, IngredientRecord.fromDict(fields)) for key, fields in json.loads(row[0])),
+        dict((key, StepRecord.fromDict(fields)) for key, fields in json.loads(row[1])))
+
+    ############################################################################
+    # Name: put                                                                #
+    # Params: url, recipeData, ingPredicates, instPredicates (the parse to     #
+    # keep)                                                                    #
+    # Returns: None                                                            #
+    # Notes: Any older parse of the same URL (other content or another         #
+    # version) is replaced, then the least recently used recipes are evicted   #
+    # if the store has grown past maxEntries.                                  #
+    ############################################################################
+    def put(self, url, recipeData, ingPredicates, instPredicates):
+        now = time.time()
+        with self.lock:
+            self.connection.execute("DELETE FROM recipes WHERE url = ?", (url,))
+            self.connection.execute("INSERT INTO recipes (url, contentHash, version, recipeData, ingPredicates, instPredicates, createdAt, lastAccess) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (url, contentHash(recipeData), self.version, json.dumps(recipeData), json.dumps([(key, record.asDict()) for key, record in ingPredicates.items()]), json.dumps([(key, record.asDict()) for key, record in instPredicates.items()]), now, now))
+            overflow = self.connection.execute("SELECT COUNT(*) FROM recipes").fetchone()[0] - self.maxEntries
+            if overflow > 0:
+                self.connection.execute("DELETE FROM recipes WHERE rowid IN (SELECT rowid FROM recipes ORDER BY lastAccess ASC LIMIT ?)", (overflow,))
+                self.evictions += overflow
+            self.connection.commit()
+
+    ############################################################################
+    # Name: prune                                                              #
+    # Params: None                                                             #
+    # Returns: How many entries were dropped                                   #
+    # Notes: Deletes everything left over from other versions.                 #
+    ############################################################################
+    def prune(self):
+        with self.lock:
+            dropped = self.connection.execute("DELETE FROM recipes WHERE version != ?", (self.version,)).rowcount
+            self.connection.commit()
+        return dropped
+
+    ############################################################################
+    # Name: clear                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Drops every entry and resets the counters.                        #
+    ############################################################################
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM recipes")
+            self.connection.commit()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    ############################################################################
+    # Name: stats                                                              #
+    # Params: None                                                             #
+    # Returns: A dict with the entry count and the hit/miss/eviction counters  #
+    # Notes: None                                                              #
+    ############################################################################
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {"entries": entries, "version": self.version, "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+        "hitRate": (self.hits / lookups) if lookups > 0 else 0.0}
+
+    ############################################################################
+    # Name: close                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Closes the underlying SQLite connection.                          #
+    ############################################################################
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,280 @@
+### How-to search backends, with background prefetching
+### The "how do I do that?" query for every step is known as soon as the recipe is parsed, so the
+### answers for the step the user is on (and the next few) are looked up in the background before
+### anyone asks. Results are cached per query for a while (in a bounded LRU, with expired results
+### swept out now and then), and a question never waits longer than
+### the latency budget: if the answer is not back by then, the bot says so and the lookup keeps
+### going in the background for next time. StubBackend answers instantly and offline for testing.
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from lazyLoader import lazyImport
+from instrumentation import timed, count
+from httpClient import client, UpstreamUnavailable
+from urllib.parse import quote_plus
+from collections import OrderedDict
+import threading
+import json
+import time
+
+youtubeSearch = lazyImport("youtube_search")
+googleSearch = lazyImport("googlesearch")
+
+VIDEO = "video" # What each backend is used for
+WEB = "web"
+
+defaultTTL = 60 * 60 * 6 # Seconds a search result stays fresh
+defaultBudget = 3.0 # Most seconds a question waits on a search
+defaultWorkers = 4 # Searches running at once
+defaultLookahead = 1 # Upcoming steps to prefetch beyond the current one
+defaultMaxEntries = 10000 # Most search results to keep, least recently used dropped first
+queuedPerWorker = 16 # Prefetches are skipped once this many searches per worker are waiting
+
+class YouTubeBackend:
+    name = "youtube"
+
+    ############################################################################
+    # Name: search                                                             #
+    # Params: query (what to search for)                                       #
+    # Returns: The URL of the first video, or None if there was none           #
+    # Notes: None                                                              #
+    ############################################################################
+    def search(self, query):
+        videos = json.loads(youtubeSearch.YoutubeSearch(query, max_results = 1).to_json())["videos"]
+        return "https://www.youtube.com" + videos[0]["url_suffix"] if len(videos) > 0 else None
+
+class GoogleBackend:
+    name = "google"
+
+    ############################################################################
+    # Name: search                                                             #
+    # Params: query (what to search for)                                       #
+    # Returns: The first result's URL, or None if there was none               #
+    # Notes: Depending on its version, googlesearch gives back a list or a     #
+    # generator, so only the first item is ever taken.                         #
+    ############################################################################
+    def search(self, query):
+        return next(iter(googleSearch.search(query)), None)
+
+class StubBackend:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: name (shows up in the URLs), results (dict of query -> URL to    #
+    # answer with), delay (seconds each search pretends to take)               #
+    # Returns: None                                                            #
+    # Notes: Queries not in results get a made-up (but stable) URL.            #
+    ############################################################################
+    def __init__(self, name = "stub", results = None, delay = 0.0):
+        self.name = name
+        self.results = results if results is not None else dict()
+        self.delay = delay
+        self.calls = 0
+
+    ############################################################################
+    # Name: search                                                             #
+    # Params: query (what to search for)                                       #
+    # Returns: A URL                                                           #
+    # Notes: None                                                              #
+    ############################################################################
+    def search(self, query):
+        self.calls += 1
+        if self.delay > 0:
+            time.sleep(self.delay)
+        return self.results.get(query, "https://example.invalid/" + self.name + "?q=" + quote_plus(query))
+
+############################################################################
+# Name: liveBackends                                                       #
+# Params: None                                                             #
+# Returns: The backends the bot uses for real, by role                     #
+# Notes: None                                                              #
+############################################################################
+def liveBackends():
+    return {VIDEO: YouTubeBackend(), WEB: GoogleBackend()}
+
+############################################################################
+# Name: stubBackends                                                       #
+# Params: resultsPath (optional JSON file of query -> URL)                 #
+# Returns: Offline stand-ins for liveBackends                              #
+# Notes: None                                                              #
+############################################################################
+def stubBackends(resultsPath = None):
+    results = dict()
+    if resultsPath is not None:
+        with open(resultsPath) as resultsFile:
+            results = json.load(resultsFile)
+    return {VIDEO: StubBackend("video", results), WEB: StubBackend("web", results)}
+
+class SearchPrefetcher:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: backends (dict of role -> backend), ttl (seconds a result stays  #
+    # fresh), budget (most seconds lookup waits), workers (searches at once),  #
+    # maxEntries (most results to keep)                                        #
+    # Returns: None                                                            #
+    # Notes: One of these is shared by every session, so two cooks on the same #
+    # recipe share results too. Searches run on a fixed pool of workers, so a  #
+    # long-running server never has more than that many search threads.        #
+    ############################################################################
+    def __init__(self, backends, ttl = defaultTTL, budget = defaultBudget, workers = defaultWorkers, maxEntries = defaultMaxEntries):
+        self.backends = backends
+        self.ttl = ttl
+        self.budget = budget
+        self.maxEntries = maxEntries
+        self.maxQueued = max(1, workers) * queuedPerWorker
+        self.executor = ThreadPoolExecutor(max_workers = max(1, workers), thread_name_prefix = "search")
+        self.results = OrderedDict() # (role, query) -> (URL or None, when it was found), least recently used first
+        self.inFlight = dict() # (role, query) -> Future for searches still running
+        self.lastSweep = time.monotonic()
+        self.lock = threading.Lock()
+        self.counts = {"cached": 0, "waited": 0, "timedOut": 0, "failed": 0, "prefetched": 0, "skipped": 0, "evicted": 0, "expired": 0}
+
+    ############################################################################
+    # Name: _fresh                                                             #
+    # Params: key ((role, query))                                              #
+    # Returns: (True, result) if there is a fresh result, else (False, None)   #
+    # Notes: Must be called with the lock held.                                #
+    ############################################################################
+    def _fresh(self, key):
+        if key in self.results:
+            result, foundAt = self.results[key]
+            if time.monotonic() - foundAt <= self.ttl:
+                self.results.move_to_end(key)
+                return True, result
+            del self.results[key]
+            self.counts["expired"] += 1
+        return False, None
+
+    ############################################################################
+    # Name: _store                                                             #
+    # Params: key ((role, query)), result (URL or None)                        #
+    # Returns: None                                                            #
+    # Notes: Must be called with the lock held. Expired results are swept out  #
+    # every so often (not only when the same query comes up again, which for   #
+    # a finished session it never does), then the least recently used ones go  #
+    # until there are at most maxEntries.                                      #
+    ############################################################################
+    def _store(self, key, result):
+        now = time.monotonic()
+        self.results[key] = (result, now)
+        self.results.move_to_end(key)
+        if now - self.lastSweep > min(self.ttl, 60):
+            self.lastSweep = now
+            for expiredKey in [storedKey for storedKey, (_, foundAt) in self.results.items() if now - foundAt > self.ttl]:
+                del self.results[expiredKey]
+                self.counts["expired"] += 1
+        while len(self.results) > self.maxEntries:
+            self.results.popitem(last = False)
+            self.counts["evicted"] += 1
+
+    ############################################################################
+    # Name: _start                                                             #
+    # Params: key ((role, query))                                              #
+    # Returns: The Future for the search                                       #
+    # Notes: Must be called with the lock held, which also keeps _run from     #
+    # finishing before the Future is in inFlight.                              #
+    ############################################################################
+    def _start(self, key):
+        if key not in self.inFlight:
+            self.inFlight[key] = self.executor.submit(self._run, key)
+        return self.inFlight[key]
+
+    ############################################################################
+    # Name: _run                                                               #
+    # Params: key ((role, query))                                              #
+    # Returns: The result URL, or None if there was none                       #
+    # Notes: Runs on the pool. Failed searches are not cached, so the next     #
+    # lookup tries again. Each backend has a circuit breaker (see              #
+    # httpClient.py), so while one keeps failing its searches fail straight    #
+    # away instead of tying up the pool, and the bot answers without it.       #
+    ############################################################################
+    def _run(self, key):
+        role, query = key
+        breaker = client.breaker("search." + role)
+        try:
+            if not breaker.allow():
+                count("search." + role + ".rejected")
+                raise UpstreamUnavailable(role + " search is not being called for now, after failing repeatedly")
+            try:
+                with timed("search." + role):
+                    result = self.backends[role].search(query)
+            except Exception:
+                breaker.failed()
+                raise
+            breaker.succeeded()
+        except Exception:
+            with self.lock:
+                self.counts["failed"] += 1
+                del self.inFlight[key]
+            raise
+        with self.lock:
+            self._store(key, result)
+            del self.inFlight[key]
+        return result
+
+    ############################################################################
+    # Name: prefetch                                                           #
+    # Params: queries (the queries to look up ahead of time), roles (which     #
+    # backends to ask, all of them by default)                                 #
+    # Returns: None                                                            #
+    # Notes: Returns straight away. Anything cached or already running is      #
+    # left alone, and nothing new is queued while the pool is far behind,      #
+    # since a prefetch is only a guess at what will be asked.                  #
+    ############################################################################
+    def prefetch(self, queries, roles = None):
+        roles = roles if roles is not None else list(self.backends.keys())
+        with self.lock:
+            for query in queries:
+                for role in roles:
+                    key = (role, query)
+                    if not self._fresh(key)[0] and key not in self.inFlight:
+                        if len(self.inFlight) >= self.maxQueued:
+                            self.counts["skipped"] += 1
+                            continue
+                        self._start(key)
+                        self.counts["prefetched"] += 1
+
+    ############################################################################
+    # Name: lookup                                                             #
+    # Params: role (which backend), query (what to search for), budget (most   #
+    # seconds to wait, the prefetcher's budget by default)                     #
+    # Returns: The result URL, or None if there was none, the search failed,   #
+    # or it did not come back within the budget                                #
+    # Notes: A search that runs out the budget keeps going in the background,  #
+    # so asking again a little later will usually find it cached.              #
+    ############################################################################
+    def lookup(self, role, query, budget = None):
+        key = (role, query)
+        with self.lock:
+            isFresh, result = self._fresh(key)
+            if isFresh:
+                self.counts["cached"] += 1
+                return result
+            future = self._start(key)
+            self.counts["waited"] += 1
+        try:
+            with timed("search.wait"):
+                return future.result(timeout = budget if budget is not None else self.budget)
+        except FutureTimeout:
+            with self.lock:
+                self.counts["timedOut"] += 1
+            return None
+        except Exception: # Already counted as failed in _run
+            return None
+
+    ############################################################################
+    # Name: close                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Drops any searches that have not started yet. Ones already        #
+    # running finish on their own.                                             #
+    ############################################################################
+    def close(self):
+        self.executor.shutdown(wait = False, cancel_futures = True)
+
+    ############################################################################
+    # Name: stats                                                              #
+    # Params: None                                                             #
+    # Returns: A dict of how lookups went                                      #
+    # Notes: "cached" lookups were answered without waiting at all.            #
+    ############################################################################
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, entries = len(self.results), running = len(self.inFlight))
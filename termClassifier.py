@@ -0,0 +1,266 @@
+### Tiered term classification
+### The parsers keep asking the same three questions about words: is it a food, is it an action
+### (a cooking verb), and is it a cooking tool. (Multi-word foods are found by the phrase matcher in
+### foodMatcher.py instead.) Each question goes through an ordered list of tiers, cheapest first,
+### and the first tier with an answer wins.
+### The remote ConceptNet API is only ever the last resort, and when it cannot be reached it
+### passes too, so whatever comes after it (the term model, if there is one) gets the question.
+from collections import namedtuple
+from contextlib import contextmanager
+from httpClient import UpstreamUnavailable
+import threading
+
+FOOD = "food"
+ACTION = "action"
+TOOL = "tool"
+questions = [FOOD, ACTION, TOOL]
+
+############################################################################
+# Name: normalizeTerm                                                      #
+# Params: term (a word, or a phrase with spaces or underscores)            #
+# Returns: The term the way ConceptNet names its nodes                     #
+# Notes: None                                                              #
+############################################################################
+def normalizeTerm(term):
+    return "_".join(term.strip().lower().split())
+
+Verdict = namedtuple("Verdict", ["isMatch", "tier"]) # The answer, and the name of the tier that gave it
+
+class LexiconTier:
+    name = "lexicon"
+
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: foods (set of known foods), pairedWords (foods that come as two  #
+    # words, like "chicken broth"), cookingVerbs (known cooking verbs)         #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, foods, pairedWords, cookingVerbs):
+        self.foods = set(foods) | set(pairedWords)
+        self.cookingVerbs = set(cookingVerbs)
+
+    ############################################################################
+    # Name: decide                                                             #
+    # Params: question (one of the questions above), term (the word, or a      #
+    # phrase joined by underscores), token (the spaCy token, if there is one)  #
+    # Returns: True/False, or None if this tier cannot tell                    #
+    # Notes: The lexicons only ever say yes. Not being in them proves nothing. #
+    ############################################################################
+    def decide(self, question, term, token):
+        if question == FOOD and (term in self.foods or term.replace("_", " ") in self.foods):
+            return True
+        if question == ACTION and term in self.cookingVerbs:
+            return True
+        return None
+
+class PartOfSpeechTier:
+    name = "partOfSpeech"
+
+    # None of these can be a food, verb or tool no matter what ConceptNet says about the string
+    nonCandidates = set(["DET", "PUNCT", "ADP", "NUM", "CCONJ", "SCONJ", "PRON", "PART", "AUX", "SYM", "SPACE", "INTJ"])
+
+    ############################################################################
+    # Name: decide                                                             #
+    # Params: question, term, token (same as LexiconTier.decide)               #
+    # Returns: False for words that cannot possibly match, None otherwise      #
+    # Notes: Rules out determiners, punctuation, numbers and so on using the   #
+    # tags spaCy already gave us. Stop words are only ruled out as foods and   #
+    # tools, since plenty of them ("put", "make") are perfectly good verbs.    #
+    ############################################################################
+    def decide(self, question, term, token):
+        if not any(character.isalpha() for character in term):
+            return False
+        if token is None:
+            return None
+        if token.pos_ in self.nonCandidates or token.is_punct or token.like_num:
+            return False
+        if question in (FOOD, TOOL) and token.is_stop:
+            return False
+        return None
+
+class IndexTier:
+    name = "localIndex"
+
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: conceptIndex (a ConceptIndex from conceptIndex.py)               #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, conceptIndex):
+        self.conceptIndex = conceptIndex
+
+    ############################################################################
+    # Name: decide                                                             #
+    # Params: question, term, token (same as LexiconTier.decide)               #
+    # Returns: True/False                                                      #
+    # Notes: The index holds every edge we care about, so a missing term is a  #
+    # real no rather than an unknown.                                          #
+    ############################################################################
+    def decide(self, question, term, token):
+        if question == FOOD:
+            return self.conceptIndex.isFood(term)
+        if question == ACTION:
+            return self.conceptIndex.isAction(term)
+        return self.conceptIndex.isTool(term)
+
+class ModelTier:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: termModel (a TermModel from termModel.py), confidence (how sure  #
+    # the model has to be, from 0.5 to 1, before its answer is used), name     #
+    # (what the counters call it)                                              #
+    # Returns: None                                                            #
+    # Notes: The bot can ask the model twice in one chain (before ConceptNet,  #
+    # and as the fallback after it), so each one gets its own name.            #
+    ############################################################################
+    def __init__(self, termModel, confidence, name = "termModel"):
+        self.termModel = termModel
+        self.confidence = confidence
+        self.name = name
+
+    ############################################################################
+    # Name: decide                                                             #
+    # Params: question, term, token (same as LexiconTier.decide)               #
+    # Returns: True/False, or None if the model is not sure enough             #
+    # Notes: Anything in between is left for the tiers after this one, so at   #
+    # a confidence of 0.5 the model answers everything and ConceptNet is       #
+    # never asked.                                                             #
+    ############################################################################
+    def decide(self, question, term, token):
+        probability = self.termModel.probability(question, term)
+        if probability >= self.confidence:
+            return True
+        if probability <= 1 - self.confidence:
+            return False
+        return None
+
+class RemoteTier:
+    name = "conceptNet"
+
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: queryFunc (takes a term and returns ConceptNet's JSON response,  #
+    # e.g. RecipeBot._queryConceptNet)                                         #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, queryFunc):
+        self.queryFunc = queryFunc
+        self.unavailable = 0 # Questions passed on because ConceptNet could not be reached
+
+    ############################################################################
+    # Name: decide                                                             #
+    # Params: question, term, token (same as LexiconTier.decide)               #
+    # Returns: True/False, or None if ConceptNet could not be reached          #
+    # Notes: The same edge checks the parsers always made, just in one place.  #
+    ############################################################################
+    def decide(self, question, term, token):
+        try:
+            requestJSON = self.queryFunc(term)
+        except UpstreamUnavailable:
+            self.unavailable += 1
+            return None
+        for edge in requestJSON["edges"]:
+            eachEdge = edge["@id"].split(",")
+            if question == FOOD and "isa" in eachEdge[0].lower() and "/" + term + "/" in eachEdge[1].lower() and "/food" in eachEdge[2].lower():
+                return True
+            if question == ACTION and "mannerof" in eachEdge[0].lower() and ("/" + term + "/v/" in eachEdge[1].lower() or \
+            "/" + term + "/v/" in eachEdge[2].lower()):
+                return True
+            if question == TOOL and "usedfor" in edge["@id"].lower() and edge["end"]["label"].lower() == "cook":
+                return True
+        return False
+
+class TermClassifier:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: tiers (tier objects, in the order they should be asked)          #
+    # Returns: None                                                            #
+    # Notes: Any object with a name and a decide method can be a tier.         #
+    ############################################################################
+    def __init__(self, tiers):
+        self.tiers = tiers
+        self.counts = {tier.name: {question: 0 for question in questions} for tier in tiers}
+        self.counts["undecided"] = {question: 0 for question in questions}
+        self.decisions = dict() # (question, term) -> the last Verdict given for it
+        self.local = threading.local() # Whether to count is per thread, see uncounted
+
+    ############################################################################
+    # Name: classify                                                           #
+    # Params: question, term, token (same as LexiconTier.decide)               #
+    # Returns: A Verdict                                                       #
+    # Notes: If no tier can answer (e.g. there is no remote tier), the answer  #
+    # is no, same as when ConceptNet had nothing to say.                       #
+    ############################################################################
+    def classify(self, question, term, token = None):
+        term = normalizeTerm(term)
+        verdict = Verdict(False, "undecided")
+        for tier in self.tiers:
+            isMatch = tier.decide(question, term, token)
+            if isMatch is not None:
+                verdict = Verdict(isMatch, tier.name)
+                break
+
+        if getattr(self.local, "counting", True):
+            self.counts[verdict.tier][question] += 1
+        self.decisions[(question, term)] = verdict
+        return verdict
+
+    ############################################################################
+    # Name: needsRemote                                                        #
+    # Params: question, term, token (same as LexiconTier.decide)               #
+    # Returns: Boolean                                                         #
+    # Notes: True if every tier before the remote one passes on this term.     #
+    # Nothing is counted, since this is only used to plan what to prefetch.    #
+    ############################################################################
+    def needsRemote(self, question, term, token = None):
+        term = normalizeTerm(term)
+        for tier in self.tiers:
+            if isinstance(tier, RemoteTier):
+                return True
+            if tier.decide(question, term, token) is not None:
+                return False
+        return False
+
+    ############################################################################
+    # Name: uncounted                                                          #
+    # Params: None                                                             #
+    # Returns: A context manager                                               #
+    # Notes: Classifications made inside it do not show up in the counters,    #
+    # so planning work (like the prefetch) does not inflate the numbers. Only  #
+    # the calling thread stops counting, so a progressive parse running in the #
+    # background on the same classifier is still counted.                      #
+    ############################################################################
+    @contextmanager
+    def uncounted(self):
+        previous = getattr(self.local, "counting", True)
+        self.local.counting = False
+        try:
+            yield
+        finally:
+            self.local.counting = previous
+
+    ############################################################################
+    # Name: report                                                             #
+    # Params: None                                                             #
+    # Returns: A dict of per-tier counts, plus how many classifications never  #
+    # needed the remote tier                                                   #
+    # Notes: None                                                              #
+    ############################################################################
+    def report(self):
+        total = sum(sum(perQuestion.values()) for perQuestion in self.counts.values())
+        remote = sum(self.counts.get(RemoteTier.name, {}).values())
+        return {"tiers": self.counts, "classifications": total, "remote": remote, "answeredLocally": total - remote,
+        "remoteUnavailable": self.remoteUnavailable()}
+
+    ############################################################################
+    # Name: remoteUnavailable                                                  #
+    # Params: None                                                             #
+    # Returns: How many questions the remote tier passed on because it could   #
+    # not be reached                                                           #
+    # Notes: Anything above 0 means some answers are fallbacks.                #
+    ############################################################################
+    def remoteUnavailable(self):
+        return sum(tier.unavailable for tier in self.tiers if isinstance(tier, RemoteTier))
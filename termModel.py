@@ -0,0 +1,332 @@
+### Local term model
+### A small logistic regression that answers the food, action and tool questions without asking
+### ConceptNet. Every term is turned into hashed character n-grams (plus the whole term, and the
+### last word of a phrase), so words ConceptNet has never heard of still get a guess from how they
+### are spelled ("-berries", "-ed", "-pan"). The model is trained on the ConceptNet responses that
+### are already in the cache plus the bot's own word lists, and scoring every term of a recipe is a
+### single pass over one sparse matrix. Usage:
+###     python termModel.py train --output termModel.npz
+###     python termModel.py eval termModel.npz
+###     python termModel.py classify termModel.npz basil whisk skillet
+from lazyLoader import lazyImport
+from termClassifier import FOOD, ACTION, TOOL, RemoteTier, normalizeTerm
+from conceptCache import ConceptCache
+from foodMatcher import readPhrases, defaultPhrasesPath
+import threading
+import argparse
+import hashlib
+import json
+import time
+import zlib
+import io
+
+numpy = lazyImport("numpy")
+
+heads = [FOOD, ACTION, TOOL] # One weight column per question
+ngramSizes = (2, 3, 4)
+defaultDimensions = 2 ** 18 # Hash buckets for the features
+defaultEpochs = 200
+defaultRate = 0.5
+defaultL2 = 1e-6
+defaultConfidence = 0.9 # How sure the model has to be before the bot skips ConceptNet
+heldOutBuckets = 10 # One term in this many is kept out of training to evaluate on
+
+############################################################################
+# Name: features                                                           #
+# Params: term (a word, or a phrase with spaces or underscores)            #
+# Returns: A list of feature strings                                       #
+# Notes: The whole term lets the model remember the words it was trained   #
+# on; the n-grams (with < and > marking the ends) are what carries over to #
+# words it has not seen.                                                   #
+############################################################################
+def features(term):
+    term = normalizeTerm(term)
+    padded = "<" + term + ">"
+    grams = ["w:" + term]
+    words = term.split("_")
+    if len(words) > 1:
+        grams.append("l:" + words[-1]) # "chicken_broth" is a food because "broth" is
+    for size in ngramSizes:
+        grams += [padded[start:start + size] for start in range(len(padded) - size + 1)]
+    return grams
+
+############################################################################
+# Name: hashedFeatures                                                     #
+# Params: terms (list of terms), dimensions (number of hash buckets)       #
+# Returns: (columns, offsets), the sparse rows of the feature matrix: term #
+# i's features are columns[offsets[i]:offsets[i + 1]]                      #
+# Notes: crc32 rather than hash(), since hash() changes between runs and   #
+# the model has to score the same way it was trained.                      #
+############################################################################
+def hashedFeatures(terms, dimensions):
+    columns = []
+    offsets = [0]
+    for term in terms:
+        columns += [zlib.crc32(gram.encode("utf-8")) % dimensions for gram in features(term)]
+        offsets.append(len(columns))
+    return numpy.array(columns, dtype = numpy.int64), numpy.array(offsets, dtype = numpy.int64)
+
+############################################################################
+# Name: sigmoid                                                            #
+# Params: logits (array)                                                   #
+# Returns: The probabilities                                               #
+# Notes: Clipped so very sure terms do not overflow exp.                   #
+############################################################################
+def sigmoid(logits):
+    return 1.0 / (1.0 + numpy.exp(-numpy.clip(logits, -30, 30)))
+
+############################################################################
+# Name: scoreRows                                                          #
+# Params: weights, bias (the model), columns, offsets (from hashedFeatures)#
+# Returns: The logits, one row per term and one column per head            #
+# Notes: Every term has at least one feature, so reduceat never sees an    #
+# empty row.                                                               #
+############################################################################
+def scoreRows(weights, bias, columns, offsets):
+    if len(offsets) < 2:
+        return numpy.zeros((0, len(heads)))
+    return numpy.add.reduceat(weights[columns], offsets[:-1], axis = 0) + bias
+
+class TermModel:
+    maxScored = 100000 # Most terms to remember scores for before starting over
+
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: weights (dimensions x heads array), bias (one per head), digest  #
+    # (identifies the model file, for RecipeBot.parserVersion)                 #
+    # Returns: None                                                            #
+    # Notes: One model is shared by every session in the servers, so the       #
+    # remembered scores have a lock and are bounded by maxScored.              #
+    ############################################################################
+    def __init__(self, weights, bias, digest = None):
+        self.weights = weights
+        self.bias = bias
+        self.dimensions = weights.shape[0]
+        self.digest = digest
+        self.scores = dict() # Normalized term -> its probabilities, one per head
+        self.lock = threading.Lock()
+
+    ############################################################################
+    # Name: predict                                                            #
+    # Params: terms (list of terms)                                            #
+    # Returns: An array of probabilities, one row per term and one column per  #
+    # head                                                                     #
+    # Notes: None                                                              #
+    ############################################################################
+    def predict(self, terms):
+        columns, offsets = hashedFeatures(terms, self.dimensions)
+        return sigmoid(scoreRows(self.weights, self.bias, columns, offsets))
+
+    ############################################################################
+    # Name: prime                                                              #
+    # Params: terms (every term the parsers might ask about)                   #
+    # Returns: How many terms had to be scored                                 #
+    # Notes: Scores them all in one batch, so the parsers' one-at-a-time       #
+    # questions are just dictionary lookups.                                   #
+    ############################################################################
+    def prime(self, terms):
+        normalizedTerms = set(normalizeTerm(term) for term in terms)
+        with self.lock:
+            newTerms = sorted(normalizedTerms - self.scores.keys())
+        self._remember(newTerms, self.predict(newTerms))
+        return len(newTerms)
+
+    ############################################################################
+    # Name: _remember                                                          #
+    # Params: terms (normalized terms), probabilities (their rows from         #
+    # predict)                                                                 #
+    # Returns: None                                                            #
+    # Notes: Starts over rather than going past maxScored, which is as good as #
+    # an LRU here since priming puts a recipe's terms back in one batch.       #
+    ############################################################################
+    def _remember(self, terms, probabilities):
+        with self.lock:
+            if len(self.scores) + len(terms) > self.maxScored:
+                self.scores = dict()
+            for term, termProbabilities in zip(terms, probabilities):
+                self.scores[term] = termProbabilities
+
+    ############################################################################
+    # Name: probability                                                        #
+    # Params: question (FOOD, ACTION or TOOL), term                            #
+    # Returns: How likely the model thinks the answer is yes                   #
+    # Notes: Terms that were not primed get scored on their own, and are       #
+    # remembered under the same bound as prime's.                              #
+    ############################################################################
+    def probability(self, question, term):
+        term = normalizeTerm(term)
+        probabilities = self.scores.get(term)
+        if probabilities is None:
+            probabilities = self.predict([term])[0]
+            self._remember([term], [probabilities])
+        return float(probabilities[heads.index(question)])
+
+    ############################################################################
+    # Name: save                                                               #
+    # Params: path (where to write the model)                                  #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def save(self, path):
+        with open(path, "wb") as modelFile:
+            numpy.savez_compressed(modelFile, weights = self.weights, bias = self.bias, heads = numpy.array(heads), ngramSizes = numpy.array(ngramSizes))
+
+############################################################################
+# Name: loadTermModel                                                      #
+# Params: path (a file written by TermModel.save)                          #
+# Returns: The TermModel                                                   #
+# Notes: Models trained with other heads or n-grams would score terms      #
+# differently than they were trained, so those are refused.                #
+############################################################################
+def loadTermModel(path):
+    with open(path, "rb") as modelFile:
+        modelBytes = modelFile.read()
+    saved = numpy.load(io.BytesIO(modelBytes))
+    if list(saved["heads"]) != heads or tuple(saved["ngramSizes"]) != ngramSizes:
+        raise ValueError(path + " is not a term model this version of the bot can read")
+    return TermModel(saved["weights"], saved["bias"], hashlib.sha256(modelBytes).hexdigest()[:16])
+
+############################################################################
+# Name: trainingSet                                                        #
+# Params: conceptCache (a ConceptCache), query (the query string the bot   #
+# caches responses under), foods (known foods and multi-word foods),       #
+# cookingVerbs (known cooking verbs)                                       #
+# Returns: (terms, labels, mask, fromConceptNet): labels and mask have a   #
+# row per term and a column per head, mask is 1 where the label is known,  #
+# and fromConceptNet marks the terms that had a cached response            #
+# Notes: Cached terms get every head labelled, by the same edge checks the #
+# remote tier makes. The word lists only ever add yeses, same as the       #
+# lexicon tier, so a term that is only in them has its other heads left    #
+# unknown rather than taken to be no.                                      #
+############################################################################
+def trainingSet(conceptCache, query, foods, cookingVerbs):
+    verdicts = dict()
+    for term, response in conceptCache.entries(query):
+        remoteTier = RemoteTier(lambda anyTerm: response)
+        verdicts[term] = [remoteTier.decide(FOOD, term, None), remoteTier.decide(ACTION, term, None), remoteTier.decide(TOOL, term, None)]
+    fromConceptNet = set(verdicts)
+    for food in foods:
+        verdicts.setdefault(normalizeTerm(food), [None, None, None])[0] = True
+    for verb in cookingVerbs:
+        verdicts.setdefault(normalizeTerm(verb), [None, None, None])[1] = True
+
+    terms = sorted(term for term in verdicts if term != "")
+    labels = numpy.array([[1.0 if verdict else 0.0 for verdict in verdicts[term]] for term in terms]).reshape(-1, len(heads))
+    mask = numpy.array([[0.0 if verdict is None else 1.0 for verdict in verdicts[term]] for term in terms]).reshape(-1, len(heads))
+    return terms, labels, mask, numpy.array([term in fromConceptNet for term in terms], dtype = bool)
+
+############################################################################
+# Name: isHeldOut                                                          #
+# Params: term                                                             #
+# Returns: Boolean                                                         #
+# Notes: Decided by the term itself, so the split stays the same as the    #
+# cache grows.                                                             #
+############################################################################
+def isHeldOut(term):
+    return zlib.crc32(term.encode("utf-8")) % heldOutBuckets == 0
+
+############################################################################
+# Name: train                                                              #
+# Params: terms, labels, mask (from trainingSet), dimensions, epochs,      #
+# rate (Adagrad step size), l2 (weight decay)                              #
+# Returns: The trained TermModel                                           #
+# Notes: Full batch Adagrad on the logistic loss, one head per column. The #
+# gradient of every weight is a bincount over the feature columns, so an   #
+# epoch is a couple of passes over the nonzeros and nothing dense is built #
+# besides the weights themselves.                                          #
+############################################################################
+def train(terms, labels, mask, dimensions = defaultDimensions, epochs = defaultEpochs, rate = defaultRate, l2 = defaultL2):
+    columns, offsets = hashedFeatures(terms, dimensions)
+    rows = numpy.repeat(numpy.arange(len(terms)), numpy.diff(offsets))
+    weights = numpy.zeros((dimensions, len(heads)))
+    bias = numpy.zeros(len(heads))
+    weightHistory = numpy.full((dimensions, len(heads)), 1e-8)
+    biasHistory = numpy.full(len(heads), 1e-8)
+    examples = numpy.maximum(mask.sum(axis = 0), 1.0)
+    for epoch in range(epochs):
+        errors = (sigmoid(scoreRows(weights, bias, columns, offsets)) - labels) * mask / examples
+        weightGradient = numpy.stack([numpy.bincount(columns, weights = errors[rows, head], minlength = dimensions) for head in range(len(heads))], axis = 1)
+        weightGradient += l2 * weights
+        biasGradient = errors.sum(axis = 0)
+        weightHistory += weightGradient ** 2
+        biasHistory += biasGradient ** 2
+        weights -= rate * weightGradient / numpy.sqrt(weightHistory)
+        bias -= rate * biasGradient / numpy.sqrt(biasHistory)
+    return TermModel(weights.astype(numpy.float32), bias.astype(numpy.float32))
+
+############################################################################
+# Name: evaluate                                                           #
+# Params: model (a TermModel), terms, labels, mask (from trainingSet, only #
+# the rows to evaluate on), confidence (same as ModelTier)                 #
+# Returns: A dict per head of how often the model agrees with the labels,  #
+# its precision and recall, and how much of it is answered (and how well)  #
+# at the given confidence, plus how long scoring took                      #
+# Notes: "answered" is what ModelTier would decide without ConceptNet.     #
+############################################################################
+def evaluate(model, terms, labels, mask, confidence = defaultConfidence):
+    scoreStart = time.perf_counter()
+    probabilities = model.predict(terms)
+    scoreSeconds = time.perf_counter() - scoreStart
+    report = {"terms": len(terms), "scoreSeconds": scoreSeconds, "confidence": confidence}
+    for head, question in enumerate(heads):
+        known = mask[:, head] > 0
+        truth = labels[known, head] > 0.5
+        predicted = probabilities[known, head] >= 0.5
+        answered = (probabilities[known, head] >= confidence) | (probabilities[known, head] <= 1 - confidence)
+        truePositives = int((truth & predicted).sum())
+        report[question] = {"labelled": int(known.sum()), "positives": int(truth.sum()),
+        "agreement": float((truth == predicted).mean()) if known.sum() > 0 else 0.0,
+        "precision": truePositives / int(predicted.sum()) if predicted.sum() > 0 else 0.0,
+        "recall": truePositives / int(truth.sum()) if truth.sum() > 0 else 0.0,
+        "answered": float(answered.mean()) if known.sum() > 0 else 0.0,
+        "answeredAgreement": float((truth == predicted)[answered].mean()) if answered.sum() > 0 else 0.0}
+    return report
+
+if __name__ == "__main__":
+    from recipeBot import RecipeBot # Only for its word lists; imported here since recipeBot imports this module
+
+    parser = argparse.ArgumentParser(description = "Train and check the local model that answers food/action/tool questions without ConceptNet.")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+    trainParser = subparsers.add_parser("train", help = "Train a model from the ConceptNet cache and the bot's word lists")
+    trainParser.add_argument("--output", default = "termModel.npz", help = "Where to write the model")
+    trainParser.add_argument("--dimensions", type = int, default = defaultDimensions, help = "Hash buckets for the character n-grams")
+    trainParser.add_argument("--epochs", type = int, default = defaultEpochs, help = "Passes over the training terms")
+    trainParser.add_argument("--rate", type = float, default = defaultRate, help = "Adagrad step size")
+    trainParser.add_argument("--l2", type = float, default = defaultL2, help = "Weight decay")
+    trainParser.add_argument("--all", action = "store_true", help = "Train on every term instead of holding one in " + str(heldOutBuckets) + " out to evaluate on")
+    evalParser = subparsers.add_parser("eval", help = "Measure how often a model agrees with the ConceptNet cache")
+    evalParser.add_argument("model", help = "A model written by train")
+    evalParser.add_argument("--held-out", action = "store_true", help = "Only evaluate on the terms train held out")
+    classifyParser = subparsers.add_parser("classify", help = "Print what a model thinks of some terms")
+    classifyParser.add_argument("model", help = "A model written by train")
+    classifyParser.add_argument("terms", nargs = "+", help = "Words or phrases to classify")
+    for subparser in [trainParser, evalParser]:
+        subparser.add_argument("--cache-path", default = ConceptCache.defaultPath, help = "Where the ConceptNet response cache is stored")
+        subparser.add_argument("--food-phrases", default = defaultPhrasesPath, help = "File of multi-word foods (one per line) to count as foods")
+        subparser.add_argument("--confidence", type = float, default = defaultConfidence, help = "How sure the model has to be for its answer to count as given")
+    args = parser.parse_args()
+
+    if args.command == "classify":
+        model = loadTermModel(args.model)
+        print(json.dumps({term: dict(zip(heads, [round(float(probability), 4) for probability in probabilities])) \
+        for term, probabilities in zip(args.terms, model.predict(args.terms))}, indent = 2))
+    else:
+        query = "offset=0&limit=" + str(RecipeBot.queryOffset)
+        foods = set(RecipeBot.allFoods) | set(RecipeBot.pairedWords) | set(readPhrases(args.food_phrases))
+        terms, labels, mask, fromConceptNet = trainingSet(ConceptCache(args.cache_path), query, foods, RecipeBot.cookingVerbs)
+        heldOut = numpy.array([isHeldOut(term) for term in terms], dtype = bool)
+        if args.command == "train":
+            training = numpy.ones(len(terms), dtype = bool) if args.all else ~heldOut
+            trainStart = time.perf_counter()
+            model = train([term for term, use in zip(terms, training) if use], labels[training], mask[training], args.dimensions, args.epochs, args.rate, args.l2)
+            trainSeconds = time.perf_counter() - trainStart
+            model.save(args.output)
+            report = {"output": args.output, "terms": len(terms), "fromConceptNet": int(fromConceptNet.sum()), "trainedOn": int(training.sum()), "trainSeconds": trainSeconds}
+            if not args.all:
+                evaluating = heldOut & fromConceptNet
+                report["heldOut"] = evaluate(model, [term for term, use in zip(terms, evaluating) if use], labels[evaluating], mask[evaluating], args.confidence)
+            print(json.dumps(report, indent = 2))
+        else:
+            model = loadTermModel(args.model)
+            evaluating = fromConceptNet & heldOut if args.held_out else fromConceptNet # Agreement with ConceptNet, so the word lists are left out
+            print(json.dumps(evaluate(model, [term for term, use in zip(terms, evaluating) if use], labels[evaluating], mask[evaluating], args.confidence), indent = 2))
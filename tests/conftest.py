@@ -0,0 +1,131 @@
+### Shared test fixtures
+### The modules live at the top of the repository, so that goes on the path first. stubServer is a
+### local HTTP server for anything that makes outbound calls: every path answers from a script of
+### responses and faults, and every request is logged with when it arrived.
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import time
+import sys
+import os
+
+repoRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repoRoot)
+fixturesPath = os.path.join(repoRoot, "benchmarkFixtures")
+
+import pytest
+
+class StubServer:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: Listens on a free port on this machine only.                      #
+    ############################################################################
+    def __init__(self):
+        self.routes = dict() # path -> list of steps, each used once in order (the last one repeats)
+        self.contentTypes = dict() # path -> the Content-Type its bodies are sent with
+        self.requests = [] # (path, time.monotonic() when it arrived)
+        self.lock = threading.Lock()
+        stub = self
+
+        class StubHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub._answer(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target = self.server.serve_forever, name = "stubServer", daemon = True)
+        self.thread.start()
+
+    ############################################################################
+    # Name: url                                                                #
+    # Params: path (starting with /)                                           #
+    # Returns: The full URL of that path on this server                        #
+    # Notes: None                                                              #
+    ############################################################################
+    def url(self, path):
+        return "http://127.0.0.1:" + str(self.server.server_address[1]) + path
+
+    ############################################################################
+    # Name: route                                                              #
+    # Params: path, steps (what to do for each request, in order),             #
+    # contentType (the Content-Type header to send)                            #
+    # Returns: None                                                            #
+    # Notes: A step is a body (str or bytes, sent with a 200), a status code   #
+    # (int, sent with an empty body), "drop" (close the connection without     #
+    # answering), or ("slow", seconds, step) to wait before doing the step.    #
+    # A str body is sent as UTF-8.                                             #
+    ############################################################################
+    def route(self, path, *steps, contentType = "text/html; charset=utf-8"):
+        with self.lock:
+            self.routes[path] = list(steps)
+            self.contentTypes[path] = contentType
+
+    ############################################################################
+    # Name: hits                                                               #
+    # Params: path                                                             #
+    # Returns: How many requests that path has had                             #
+    # Notes: None                                                              #
+    ############################################################################
+    def hits(self, path):
+        with self.lock:
+            return sum(1 for requestPath, _ in self.requests if requestPath == path)
+
+    ############################################################################
+    # Name: _answer                                                            #
+    # Params: handler (the request being handled)                              #
+    # Returns: None                                                            #
+    # Notes: Paths with no route get a 404.                                    #
+    ############################################################################
+    def _answer(self, handler):
+        path = handler.path
+        with self.lock:
+            self.requests.append((path, time.monotonic()))
+            steps = self.routes.get(path, [404])
+            step = steps.pop(0) if len(steps) > 1 else steps[0]
+            contentType = self.contentTypes.get(path, "text/html; charset=utf-8")
+        while isinstance(step, tuple):
+            time.sleep(step[1])
+            step = step[2]
+        if step == "drop":
+            handler.close_connection = True
+            handler.connection.close()
+            return
+        status = step if isinstance(step, int) else 200
+        body = b"" if isinstance(step, int) else (step.encode("utf-8") if isinstance(step, str) else step)
+        handler.send_response(status)
+        handler.send_header("Content-Type", contentType)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    ############################################################################
+    # Name: close                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stubServer():
+    server = StubServer()
+    yield server
+    server.close()
+
+############################################################################
+# Name: fixturePage                                                        #
+# Params: name (a file in benchmarkFixtures/pages)                         #
+# Returns: The saved page's text                                           #
+# Notes: None                                                              #
+############################################################################
+def fixturePage(name):
+    with open(os.path.join(fixturesPath, "pages", name), encoding = "utf-8") as pageFile:
+        return pageFile.read()
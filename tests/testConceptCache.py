@@ -0,0 +1,55 @@
+### Tests for conceptCache.py: least recently used eviction with the lastAccess writes batched,
+### the running row count, and expiry
+from conceptCache import ConceptCache
+import time
+import pytest
+
+@pytest.fixture
+def conceptCache(tmp_path):
+    cache = ConceptCache(str(tmp_path / "concepts.sqlite3"), maxEntries = 3)
+    yield cache
+    cache.close()
+
+def testConceptCacheEvictsByLastAccess(conceptCache):
+    for term in ["salt", "egg", "milk"]:
+        conceptCache.put(term, "q", {"term": term})
+        time.sleep(0.01)
+    assert conceptCache.get(" Salt ", "q") == {"term": "salt"} # Only noted in memory for now
+    conceptCache.put("butter", "q", {"term": "butter"}) # Writes the hit first, so egg is the oldest
+    assert conceptCache.get("egg", "q") is None
+    assert conceptCache.get("salt", "q") is not None and conceptCache.get("butter", "q") is not None
+    assert conceptCache.stats()["entries"] == 3 and conceptCache.stats()["evictions"] == 1
+
+def testConceptCacheCountsRowsWithoutRecounting(conceptCache):
+    for _ in range(3):
+        conceptCache.put("salt", "q", {"term": "salt"})
+    assert conceptCache.stats()["entries"] == 1 and conceptCache.stats()["evictions"] == 0
+    conceptCache.clear()
+    assert conceptCache.stats()["entries"] == 0
+
+def testConceptCacheHitsSurviveAReopen(tmp_path):
+    path = str(tmp_path / "concepts.sqlite3")
+    cache = ConceptCache(path, maxEntries = 2)
+    cache.put("salt", "q", {"term": "salt"})
+    time.sleep(0.01)
+    cache.put("egg", "q", {"term": "egg"})
+    time.sleep(0.01)
+    cache.get("salt", "q")
+    cache.close() # Flushes the noted hit
+    reopened = ConceptCache(path, maxEntries = 2)
+    try:
+        assert reopened.stats()["entries"] == 2
+        reopened.put("milk", "q", {"term": "milk"})
+        assert reopened.get("egg", "q") is None and reopened.get("salt", "q") == {"term": "salt"}
+    finally:
+        reopened.close()
+
+def testConceptCacheExpiresOldEntries(tmp_path):
+    cache = ConceptCache(str(tmp_path / "concepts.sqlite3"), ttl = 0.05)
+    try:
+        cache.put("salt", "q", {"term": "salt"})
+        assert cache.get("salt", "q") is not None
+        time.sleep(0.06)
+        assert cache.get("salt", "q") is None and cache.stats()["entries"] == 0
+    finally:
+        cache.close()
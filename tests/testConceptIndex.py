@@ -0,0 +1,55 @@
+### Tests for conceptIndex.py: the index built from a small assertions dump, its file layout, and
+### lookups through the memory-mapped reader
+from conceptIndex import ConceptIndex, buildIndex, ACTION, TOOL
+import struct
+import gzip
+import pytest
+
+assertions = [("/r/IsA", "/c/en/ground_beef/n", "/c/en/food/n"),
+("/r/IsA", "/c/en/egg", "/c/en/food"),
+("/r/IsA", "/c/en/hammer", "/c/en/tool"),
+("/r/MannerOf", "/c/en/whisk/v", "/c/en/beat/v"),
+("/r/UsedFor", "/c/en/skillet/n", "/c/en/cook"),
+("/r/UsedFor", "/c/en/whisk/n", "/c/en/cook"),
+("/r/IsA", "/c/fr/oeuf", "/c/en/food"),
+("/r/IsA", "/c/en/crème_fraîche", "/c/en/food")]
+
+@pytest.fixture
+def conceptIndexPath(tmp_path):
+    assertionsPath = str(tmp_path / "assertions.csv.gz")
+    with gzip.open(assertionsPath, "wt", encoding = "utf-8") as assertionsFile:
+        for relation, start, end in assertions:
+            assertionsFile.write("\t".join(["/a/[" + start + "]", relation, start, end, "{}"]) + "\n")
+        assertionsFile.write("not an assertion\n")
+    indexPath = str(tmp_path / "concepts.idx")
+    assert buildIndex(assertionsPath, indexPath) == 6
+    return indexPath
+
+def testConceptIndexLayout(conceptIndexPath):
+    with open(conceptIndexPath, "rb") as indexFile:
+        data = indexFile.read()
+    magic, version, termCount, reserved = struct.unpack_from("<4sIII", data, 0)
+    assert (magic, version, termCount) == (b"CNIX", 1, 6)
+    offsets = struct.unpack_from("<7I", data, 16)
+    flags = data[16 + 28:16 + 28 + termCount]
+    blob = data[16 + 28 + termCount:]
+    names = [blob[offsets[position]:offsets[position + 1]] for position in range(termCount)]
+    assert names == sorted(names) and len(blob) == offsets[-1]
+    assert dict(zip(names, flags))[b"whisk"] == ACTION | TOOL
+
+def testConceptIndexLookups(conceptIndexPath):
+    index = ConceptIndex(conceptIndexPath)
+    try:
+        assert len(index) == 6
+        assert index.isFood("Ground Beef") and index.isFood(" egg ") and index.isFood("crème fraîche")
+        assert index.isAction("whisk") and index.isTool("whisk") and not index.isFood("whisk")
+        assert index.isAction("beat") and index.isTool("skillet")
+        assert index.flagsFor("hammer") == 0 and index.flagsFor("oeuf") == 0 and index.flagsFor("zzz") == 0 and index.flagsFor("") == 0
+    finally:
+        index.close()
+
+def testConceptIndexRejectsOtherFiles(tmp_path):
+    otherPath = tmp_path / "other.idx"
+    otherPath.write_bytes(b"RSIX" + bytes(12))
+    with pytest.raises(ValueError):
+        ConceptIndex(str(otherPath))
@@ -0,0 +1,108 @@
+### Tests for httpClient.py, against a local server that injects faults
+from httpClient import HTTPClient, CircuitBreaker, Endpoint, UpstreamUnavailable, endpoints
+from termClassifier import TermClassifier, RemoteTier, FOOD
+from recipeScraper import fetchRecipe
+from conftest import fixturePage
+import pytest
+import time
+
+@pytest.fixture
+def quickEndpoint(monkeypatch):
+    monkeypatch.setitem(endpoints, "test", Endpoint(1.0, 0.3, 5.0, 2, 0.01))
+    return "test"
+
+def testRetriesUntilTheUpstreamAnswers(stubServer, quickEndpoint):
+    stubServer.route("/flaky", 503, "drop", "fine")
+    pauses = []
+    client = HTTPClient(sleep = pauses.append)
+    response = client.get(quickEndpoint, stubServer.url("/flaky"))
+    assert response.status_code == 200 and response.text == "fine"
+    assert stubServer.hits("/flaky") == 3
+    assert len(pauses) == 2 and pauses[1] > pauses[0] / 1.5 # Jittered, but still backing off
+
+def testBeforeAttemptRunsForEveryTry(stubServer, quickEndpoint):
+    stubServer.route("/busy", 429, 429, "fine")
+    attempts = []
+    client = HTTPClient(sleep = lambda seconds: None)
+    response = client.get(quickEndpoint, stubServer.url("/busy"), beforeAttempt = lambda: attempts.append(stubServer.hits("/busy")))
+    assert response.text == "fine" and attempts == [0, 1, 2]
+
+def testWaitingForTheFirstSlotDoesNotUseTheBudget(stubServer, monkeypatch):
+    monkeypatch.setitem(endpoints, "test", Endpoint(1.0, 1.0, 0.2, 0, 0.01))
+    stubServer.route("/page", "fine")
+    client = HTTPClient()
+    assert client.get("test", stubServer.url("/page"), beforeAttempt = lambda: time.sleep(0.3)).text == "fine"
+
+def testOtherStatusesAreTheAnswer(stubServer, quickEndpoint):
+    client = HTTPClient(sleep = lambda seconds: None)
+    assert client.get(quickEndpoint, stubServer.url("/missing")).status_code == 404
+    assert stubServer.hits("/missing") == 1
+    assert client.breaker(quickEndpoint, "127.0.0.1:" + str(stubServer.server.server_address[1])).failures == 0
+
+def testSlowAnswersTimeOut(stubServer, quickEndpoint):
+    stubServer.route("/slow", ("slow", 1.0, "late"))
+    client = HTTPClient(sleep = lambda seconds: None)
+    started = time.monotonic()
+    with pytest.raises(UpstreamUnavailable):
+        client.get(quickEndpoint, stubServer.url("/slow"))
+    assert time.monotonic() - started < 2.0 # Three attempts at the 0.3s read timeout, not three full seconds
+    assert stubServer.hits("/slow") == 3
+
+def testBreakerTripsAndStopsCalling(stubServer, quickEndpoint):
+    stubServer.route("/down", 500)
+    client = HTTPClient(sleep = lambda seconds: None)
+    for _ in range(CircuitBreaker().threshold):
+        with pytest.raises(UpstreamUnavailable):
+            client.get(quickEndpoint, stubServer.url("/down"))
+    calls = stubServer.hits("/down")
+    with pytest.raises(UpstreamUnavailable):
+        client.get(quickEndpoint, stubServer.url("/down"))
+    assert stubServer.hits("/down") == calls
+    assert list(client.stats().values())[0]["state"] == "open"
+
+def testHalfOpenBreakerLetsOneCallThrough():
+    breaker = CircuitBreaker(threshold = 1, resetAfter = 0.05)
+    breaker.failed()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow() # The test call is still out
+    breaker.failed()
+    assert breaker.state() == "open" and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.succeeded()
+    assert breaker.state() == "closed" and breaker.allow()
+
+def testBreakersArePerHost(stubServer, quickEndpoint):
+    stubServer.route("/down", 500)
+    stubServer.route("/up", "fine")
+    client = HTTPClient(sleep = lambda seconds: None)
+    for _ in range(CircuitBreaker().threshold):
+        with pytest.raises(UpstreamUnavailable):
+            client.get(quickEndpoint, stubServer.url("/down"))
+    otherHost = stubServer.url("/up").replace("127.0.0.1", "localhost")
+    assert client.get(quickEndpoint, otherHost).text == "fine"
+
+def testUnreachableConceptNetFallsBackToTheNextTier():
+    class AlwaysYes:
+        name = "fallback"
+        def decide(self, question, term, token):
+            return True
+
+    def unreachable(term):
+        raise UpstreamUnavailable("conceptnet is down")
+
+    classifier = TermClassifier([RemoteTier(unreachable), AlwaysYes()])
+    verdict = classifier.classify(FOOD, "quinoa")
+    assert verdict.isMatch and verdict.tier == "fallback"
+    assert classifier.remoteUnavailable() == 1
+
+def testFetchRecipeFromTheStubServer(stubServer):
+    stubServer.route("/quiche", fixturePage("shredded-potato-quiche.html"))
+    recipeData = fetchRecipe(stubServer.url("/quiche"))
+    assert recipeData["recipeName"] == "Shredded Potato Quiche"
+    assert len(recipeData["ingredients"]) > 0 and len(recipeData["instructions"]) > 0
+
+def testFetchRecipeGivesNoneWhenThePageIsGone(stubServer):
+    assert fetchRecipe(stubServer.url("/gone")) is None
@@ -0,0 +1,63 @@
+### Tests for intentMatcher.py: the bounded edit distance against a plain full table, and the
+### Aho-Corasick automaton against a substring scan for every keyword
+from intentMatcher import boundedDistance, KeywordAutomaton, IntentMatcher, lastStep
+import itertools
+import random
+
+botCommands = {"forwardNav": ["forward", "next", "after"],
+"backwardNav": ["back", "previous", "before"],
+"otherNav": ["repeat", "th step", "st step", "nd step", "rd step"],
+"recipeNav": ["new recipe", "another recipe", "different recipe"],
+"questions": ["How do I", "How to", "How many steps are there?"]}
+navTypes = ["forwardNav", "backwardNav", "otherNav", "recipeNav"]
+
+def fullDistance(first, second):
+    previousRow = list(range(len(second) + 1))
+    for row in range(1, len(first) + 1):
+        currentRow = [row] + [0] * len(second)
+        for column in range(1, len(second) + 1):
+            currentRow[column] = min(previousRow[column - 1] + (first[row - 1] != second[column - 1]), previousRow[column] + 1, currentRow[column - 1] + 1)
+        previousRow = currentRow
+    return previousRow[len(second)]
+
+def testBoundedDistanceMatchesTheFullTable():
+    shuffler = random.Random(7)
+    words = ["", "a", "ab", "how", "hwo", "how do i", "how to", "hot do", "whisk", "wisk", "kitten", "sitting"]
+    words += ["".join(shuffler.choice("abc ") for _ in range(shuffler.randint(0, 8))) for _ in range(40)]
+    for first, second in itertools.product(words, repeat = 2):
+        distance = fullDistance(first, second)
+        for limit in range(0, 4):
+            assert boundedDistance(first, second, limit) == (distance if distance <= limit else limit + 1), (first, second, limit)
+
+def testBoundedDistanceGivesUpOnLengthAlone():
+    assert boundedDistance("a", "a" * 50, 2) == 3
+    assert boundedDistance("kitten", "sitting", 3) == 3
+
+def testAutomatonFindsEveryKeyword():
+    keywords = {"he": 1, "she": 2, "his": 3, "hers": 4, "s": 5}
+    found = KeywordAutomaton(keywords).findAll("ushers and his")
+    expected = [(keyword, label) for keyword, label in keywords.items() for start in range(len("ushers and his")) if "ushers and his".startswith(keyword, start)]
+    assert sorted(found) == sorted(expected)
+    assert found.index(("she", 2)) < found.index(("hers", 4)) # In the order they end in the text
+
+def testAutomatonAgreesWithASubstringScan():
+    shuffler = random.Random(11)
+    keywords = dict((keyword, navType) for navType in navTypes for keyword in botCommands[navType])
+    automaton = KeywordAutomaton(keywords)
+    for _ in range(200):
+        text = " ".join(shuffler.choice(list(keywords) + ["the", "eggs", "ne", "bac"]) for _ in range(shuffler.randint(0, 6)))
+        assert set(automaton.findAll(text)) == set((keyword, label) for keyword, label in keywords.items() if keyword in text)
+
+def testMatcherKeywordsQuestionsAndSteps():
+    matcher = IntentMatcher(botCommands, navTypes)
+    assert matcher.keywords("Go to the NEXT step") == {"forwardNav": {"next"}}
+    assert matcher.keywords("take me to the 3rd step") == {"otherNav": {"rd step"}}
+    assert matcher.keywords("whisk the eggs") == dict()
+    assert matcher.question("hoe do i whisk eggs") == "How do I whisk eggs"
+    assert matcher.question("how to fold") == "How to fold"
+    assert matcher.question("hwo do i whisk eggs") is None # A swap is two edits
+    assert matcher.question("why do you whisk") is None
+    assert matcher.stepReference("go to the fifth step") == 5
+    assert matcher.stepReference("the 12th one") == 12
+    assert matcher.stepReference("the last step") == lastStep
+    assert matcher.stepReference("next") is None
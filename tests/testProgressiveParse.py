@@ -0,0 +1,92 @@
+### Tests for progressiveParse.StepScheduler: ensure parses a step the worker has not reached on the
+### caller's thread, and cancel gives up on the rest without calling onFinished
+from progressiveParse import StepScheduler
+import threading
+
+class Steps:
+    # Records which thread parsed each step; steps in blocked wait for release first
+    def __init__(self, blocked = ()):
+        self.parsedBy = dict()
+        self.blocked = set(blocked)
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+
+    def parse(self, stepIdx):
+        if stepIdx in self.blocked:
+            self.started.set()
+            self.release.wait(5)
+        with self.lock:
+            self.parsedBy[stepIdx] = threading.current_thread()
+
+def testWorkerParsesEveryStepOnce():
+    steps = Steps()
+    finished = threading.Event()
+    scheduler = StepScheduler(5, steps.parse, finished.set)
+    scheduler.start()
+    scheduler.waitAll()
+    assert finished.wait(5)
+    assert sorted(steps.parsedBy) == [0, 1, 2, 3, 4]
+    assert all(scheduler.isReady(stepIdx) for stepIdx in range(5))
+
+def testEnsureParsesAnUnclaimedStepRightAway():
+    steps = Steps(blocked = [0])
+    scheduler = StepScheduler(6, steps.parse)
+    scheduler.start()
+    assert steps.started.wait(5) # The worker is stuck on step 0
+    scheduler.ensure(4)
+    assert steps.parsedBy[4] is threading.current_thread()
+    assert not scheduler.isReady(0) and not scheduler.isReady(5)
+    steps.release.set()
+    scheduler.waitAll()
+    assert steps.parsedBy[5] is not threading.current_thread() # The worker moved on past the user
+    scheduler.thread.join(5)
+    assert not scheduler.thread.is_alive()
+
+def testEnsureWaitsForAStepAlreadyUnderway():
+    steps = Steps(blocked = [0])
+    scheduler = StepScheduler(2, steps.parse)
+    scheduler.start()
+    assert steps.started.wait(5)
+    threading.Timer(0.05, steps.release.set).start()
+    scheduler.ensure(0)
+    assert scheduler.isReady(0) and steps.parsedBy[0] is scheduler.thread
+
+def testEnsureIgnoresStepsOutOfRange():
+    scheduler = StepScheduler(2, Steps().parse)
+    scheduler.ensure(-1)
+    scheduler.ensure(2)
+    assert not scheduler.isReady(0) and not scheduler.isReady(1)
+
+def testFailedStepIsReadyWithoutFinishing():
+    finished = threading.Event()
+    def parse(stepIdx):
+        if stepIdx == 1:
+            raise ValueError("bad step")
+    scheduler = StepScheduler(3, parse, finished.set)
+    scheduler.start()
+    scheduler.waitAll()
+    scheduler.thread.join(5)
+    assert isinstance(scheduler.errors[1], ValueError) and not finished.is_set()
+
+def testCancelGivesUpOnTheRest():
+    steps = Steps(blocked = [0])
+    finished = threading.Event()
+    scheduler = StepScheduler(10, steps.parse, finished.set)
+    scheduler.start()
+    assert steps.started.wait(5)
+    threading.Timer(0.05, steps.release.set).start()
+    scheduler.cancel() # Waits for step 0 to finish, then the worker stops
+    assert not scheduler.thread.is_alive()
+    assert sorted(steps.parsedBy) == [0]
+    assert all(scheduler.isReady(stepIdx) for stepIdx in range(10)) # Nothing waits forever on a skipped step
+    scheduler.waitAll()
+    scheduler.ensure(7) # Already given up on, so it is not parsed now either
+    assert 7 not in steps.parsedBy and not finished.is_set()
+
+def testCancelBeforeStart():
+    steps = Steps()
+    scheduler = StepScheduler(3, steps.parse)
+    scheduler.cancel()
+    scheduler.waitAll()
+    assert steps.parsedBy == dict()
@@ -0,0 +1,113 @@
+### Tests for recipeCrawler.py: the saved benchmark pages are served by a local http.server under
+### two host names (127.0.0.1 and localhost), to check that each host is rate limited on its own
+### while the crawl still overlaps them (retries included), and that a crawl picks up from its
+### checkpoint
+from recipeCrawler import RecipeCrawler, HostRateLimiter, loadURLs
+from httpClient import endpoints, Endpoint
+from conftest import fixturePage
+import threading
+import json
+import time
+
+pageNames = ["scrambled-eggs.html", "shredded-potato-quiche.html", "weeknight-beef-chili.html"]
+rate = 10.0 # Requests per second to each host, so requests to one host are 0.1s apart
+slack = 0.02 # Timer and scheduling noise allowed for
+
+############################################################################
+# Name: servePages                                                         #
+# Params: stubServer, hosts (the host names to list the pages under)       #
+# Returns: The crawl's URLs, and a dict of path -> the host it was listed  #
+# under                                                                    #
+# Notes: Each host gets its own paths, since the server itself cannot tell #
+# which name it was reached by.                                            #
+############################################################################
+def servePages(stubServer, hosts):
+    urls = []
+    hostOf = dict()
+    for host in hosts:
+        for pageName in pageNames:
+            path = "/" + host + "/" + pageName
+            stubServer.route(path, fixturePage(pageName))
+            urls.append(stubServer.url(path).replace("127.0.0.1", host, 1))
+            hostOf[path] = host
+    return urls, hostOf
+
+def readRecipes(outputPath):
+    with open(outputPath, encoding = "utf-8") as outputFile:
+        return [json.loads(line) for line in outputFile]
+
+def testRateLimiterSpacesEachHostOnItsOwn():
+    limiter = HostRateLimiter(rate)
+    arrivals = []
+    lock = threading.Lock()
+    def fetch(url):
+        limiter.wait(url)
+        with lock:
+            arrivals.append((url.split("/")[2], time.monotonic()))
+    threads = [threading.Thread(target = fetch, args = ("http://" + host + "/page",)) for host in ["a.invalid", "B.invalid"] * 3]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for host in ["a.invalid", "B.invalid"]:
+        times = sorted(arrivedAt for arrivedHost, arrivedAt in arrivals if arrivedHost == host)
+        assert all(later - earlier >= 1.0 / rate - slack for earlier, later in zip(times, times[1:]))
+    assert time.monotonic() - started < 3 / rate + 0.1 # The two hosts waited side by side
+
+def testNoLimitMeansNoWaiting():
+    limiter = HostRateLimiter(None)
+    started = time.monotonic()
+    for _ in range(50):
+        limiter.wait("http://a.invalid/page")
+    assert time.monotonic() - started < 0.1
+
+def testCrawlRateLimitsPerHost(stubServer, tmp_path):
+    urls, hostOf = servePages(stubServer, ["127.0.0.1", "localhost"])
+    outputPath = str(tmp_path / "recipes.jsonl")
+    crawler = RecipeCrawler(outputPath, workers = 6, requestsPerSecond = rate)
+    report = crawler.crawl(urls)
+    assert (report["fetched"], report["failed"]) == (6, 0)
+    assert sorted(recipe["url"] for recipe in readRecipes(outputPath)) == sorted(urls)
+    assert set(recipe["recipeName"] for recipe in readRecipes(outputPath)) == set(["Simple Scrambled Eggs", "Shredded Potato Quiche", "Weeknight Beef Chili"])
+
+    for host in ["127.0.0.1", "localhost"]:
+        times = sorted(arrivedAt for path, arrivedAt in stubServer.requests if hostOf[path] == host)
+        assert len(times) == 3
+        assert all(later - earlier >= 1.0 / rate - slack for earlier, later in zip(times, times[1:]))
+    firstByHost = [min(arrivedAt for path, arrivedAt in stubServer.requests if hostOf[path] == host) for host in ["127.0.0.1", "localhost"]]
+    assert abs(firstByHost[0] - firstByHost[1]) < 1.0 / rate # Neither host waited on the other
+
+def testCrawlResumesFromItsCheckpoint(stubServer, tmp_path):
+    urls, hostOf = servePages(stubServer, ["127.0.0.1"])
+    stubServer.route("/127.0.0.1/gone.html", 404)
+    outputPath = str(tmp_path / "recipes.jsonl")
+    firstReport = RecipeCrawler(outputPath, workers = 2, requestsPerSecond = None).crawl(urls[:2])
+    assert firstReport["fetched"] == 2
+
+    secondReport = RecipeCrawler(outputPath, workers = 2, requestsPerSecond = None).crawl(urls + [stubServer.url("/127.0.0.1/gone.html")])
+    assert (secondReport["requested"], secondReport["skipped"], secondReport["fetched"], secondReport["failed"]) == (4, 2, 1, 1)
+    assert secondReport["failures"][0]["url"].endswith("/gone.html")
+    assert [stubServer.hits("/127.0.0.1/" + pageName) for pageName in pageNames] == [1, 1, 1]
+    assert sorted(recipe["url"] for recipe in readRecipes(outputPath)) == sorted(urls)
+
+def testURLsFromASitemap(stubServer, tmp_path):
+    urls, hostOf = servePages(stubServer, ["127.0.0.1"])
+    entries = "".join("<url><loc>" + url + "</loc></url>" for url in urls + urls[:1])
+    stubServer.route("/pages.xml", "<?xml version=\"1.0\"?><urlset xmlns=\"http://www.sitemaps.org/schemas/sitemap/0.9\">" + entries + "</urlset>")
+    stubServer.route("/index.xml", "<sitemapindex><sitemap><loc>" + stubServer.url("/pages.xml") + "</loc></sitemap></sitemapindex>")
+    crawler = RecipeCrawler(str(tmp_path / "recipes.jsonl"))
+    assert loadURLs(stubServer.url("/index.xml"), crawler.session) == urls
+    listPath = tmp_path / "urls.txt"
+    listPath.write_text("# saved pages\n\n" + "\n".join(urls + urls[:1]) + "\n", encoding = "utf-8")
+    assert loadURLs(str(listPath), crawler.session) == urls
+
+def testRetriesWaitForTheirOwnSlot(stubServer, tmp_path, monkeypatch):
+    monkeypatch.setitem(endpoints, "recipePage", Endpoint(1.0, 1.0, 10.0, 2, 0.001)) # Backoff alone would retry straight away
+    stubServer.route("/busy.html", 429, 503, fixturePage(pageNames[0]))
+    stubServer.route("/calm.html", fixturePage(pageNames[1]))
+    report = RecipeCrawler(str(tmp_path / "recipes.jsonl"), workers = 2, requestsPerSecond = rate).crawl([stubServer.url("/busy.html"), stubServer.url("/calm.html")])
+    assert (report["fetched"], report["failed"]) == (2, 0)
+    times = sorted(arrivedAt for path, arrivedAt in stubServer.requests)
+    assert len(times) == 4 and stubServer.hits("/busy.html") == 3
+    assert all(later - earlier >= 1.0 / rate - slack for earlier, later in zip(times, times[1:]))
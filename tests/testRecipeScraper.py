@@ -0,0 +1,62 @@
+### Tests for the chunked JSON-LD scanner in recipeScraper.py, on the saved benchmark pages cut
+### into chunks at every awkward place, and pages streamed from the local server in any charset
+from recipeScraper import LDJSONScanner, findLDJSON, parseRecipePage, streamPage
+from conftest import fixturePage
+import json
+import re
+import pytest
+
+pageNames = ["scrambled-eggs.html", "shredded-potato-quiche.html", "weeknight-beef-chili.html"]
+
+############################################################################
+# Name: chunked                                                            #
+# Params: text, size (characters per chunk)                                #
+# Returns: The text cut into chunks of that size                           #
+# Notes: None                                                              #
+############################################################################
+def chunked(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+@pytest.mark.parametrize("pageName", pageNames)
+def testChunkSizeDoesNotMatter(pageName):
+    page = fixturePage(pageName)
+    expected = re.findall(r"<script type=\"application/ld\+json\">(.*?)</script>", page, re.DOTALL)
+    assert len(expected) == 1
+    for size in [1, 2, 3, 7, 16, 17, 64, 1000, len(page)]:
+        assert findLDJSON(chunked(page, size)) == expected, size
+
+@pytest.mark.parametrize("pageName", pageNames)
+def testFixturePagesParse(pageName):
+    recipeData = parseRecipePage(chunked(fixturePage(pageName), 5))
+    assert recipeData["recipeName"] in ["Simple Scrambled Eggs", "Shredded Potato Quiche", "Weeknight Beef Chili"]
+    assert len(recipeData["ingredients"]) > 0 and len(recipeData["instructions"]) > 0
+
+def testTagsSplitAcrossChunks():
+    scanner = LDJSONScanner()
+    for chunk in ["<p>x</p><scr", "ipt TYPE='application/ld+json' id=a>{\"a\": ", "\"</b>\"}</scr", "ipt  ><script>var skipped = 1;</script", "><p>"]:
+        scanner.feed(chunk)
+    scanner.close()
+    assert [json.loads(block) for block in scanner.blocks] == [{"a": "</b>"}]
+
+def testOtherScriptsAreSkipped():
+    page = "<script>var x = '<script type=\"application/ld+json\">';</script><script type=\"application/ld+json\">[1]</script>"
+    assert findLDJSON(chunked(page, 4)) == ["[1]"]
+
+def testLongBlockIsKeptWhole():
+    body = json.dumps({"@type": "Recipe", "name": "Long", "recipeIngredient": ["egg " + str(number) for number in range(5000)]})
+    page = "<html><script type=\"application/ld+json\">" + body + "</script></html>"
+    assert findLDJSON(chunked(page, 333)) == [body]
+    assert len(parseRecipePage(chunked(page, 333))["ingredients"]) == 5000
+
+def testPageWithoutJSONLD():
+    assert findLDJSON(chunked("<html><body><p>no recipe here</p></body></html>", 3)) == []
+    assert parseRecipePage(["<html></html>"]) is None
+
+@pytest.mark.parametrize("contentType, encoding", [("text/html", "utf-8"), ("text/html; charset=ISO-8859-1", "latin-1"), ("text/html; Charset=UTF-8", "utf-8")])
+def testPagesDecodeByTheirCharset(stubServer, contentType, encoding):
+    recipeNode = {"@type": "Recipe", "name": "Crème Brûlée", "recipeIngredient": ["½ cup sugar"], "recipeInstructions": ["Bake."]}
+    page = "<html><script type=\"application/ld+json\">" + json.dumps(recipeNode, ensure_ascii = False) + "</script></html>"
+    stubServer.route("/brulee", page.encode(encoding), contentType = contentType)
+    recipeData = parseRecipePage(streamPage(stubServer.url("/brulee"), chunkSize = 7))
+    assert recipeData["recipeName"] == "Crème Brûlée"
+    assert recipeData["ingredients"] == ["½ cup sugar"]
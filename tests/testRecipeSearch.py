@@ -0,0 +1,45 @@
+### Tests for recipeSearch.py: the catalog built from a few recipe lines, BM25 search over it, and
+### the byte swap the reader needs on a big-endian machine (the file is always little-endian)
+from recipeSearch import RecipeCatalog, buildIndex, littleEndianArray
+import recipeSearch
+import struct
+import json
+import sys
+import pytest
+
+recipes = [{"url": "https://example.invalid/eggs", "recipeName": "Scrambled Eggs", "ingredients": ["4 large eggs", "2 tablespoons butter", "salt"]},
+{"url": "https://example.invalid/quiche", "recipeName": "Potato Quiche", "ingredients": ["3 cups shredded potatoes", "5 eggs", "1 cup milk"]},
+{"url": "https://example.invalid/chili", "recipeName": "Beef Chili", "ingredients": ["1 pound ground beef", "2 cans beans", "1 onion, diced"]},
+{"url": "https://example.invalid/eggs", "recipeName": "Scrambled Eggs", "ingredients": ["6 eggs", "1 tablespoon butter"]}, # A later version of the first
+{"url": "https://example.invalid/empty", "recipeName": "Nothing", "ingredients": []}]
+
+@pytest.fixture
+def recipeIndexPath(tmp_path):
+    recipesPath = tmp_path / "recipes.jsonl"
+    recipesPath.write_text("\n".join(json.dumps(recipe) for recipe in recipes) + "\n\n", encoding = "utf-8")
+    indexPath = str(tmp_path / "recipes.idx")
+    assert buildIndex(str(recipesPath), indexPath) == 3
+    return indexPath
+
+def testRecipeCatalogSearch(recipeIndexPath):
+    catalog = RecipeCatalog(recipeIndexPath)
+    try:
+        assert len(catalog) == 3
+        results = catalog.search("eggs")
+        assert [result.name for result in results] == ["Scrambled Eggs", "Potato Quiche"] # The name counts for more
+        assert catalog.recipe(results[0].recipeNumber)["ingredients"] == ["6 eggs", "1 tablespoon butter"]
+        assert [result.name for result in catalog.search("ground beef and onions")] == ["Beef Chili"]
+        assert catalog.search("saffron") == [] and catalog.search("") == []
+        assert len(catalog.search("eggs potato beef", limit = 2)) == 2
+    finally:
+        catalog.close()
+
+def testSectionsAreSwappedWhenTheMachineOrderDiffers(monkeypatch):
+    numbers = [1, 2, 70000, 2 ** 32 - 1]
+    assert list(littleEndianArray(memoryview(struct.pack("<4I", *numbers)), "I")) == numbers
+    # Claiming to be big-endian on a little-endian machine: bytes in the other order must come out the same
+    otherOrder = ">" if sys.byteorder == "little" else "<"
+    monkeypatch.setattr(recipeSearch.sys, "byteorder", "big" if sys.byteorder == "little" else "little")
+    swapped = littleEndianArray(memoryview(struct.pack(otherOrder + "4I", *numbers)), "I")
+    assert not isinstance(swapped, memoryview) and list(swapped) == numbers
+    assert list(littleEndianArray(memoryview(struct.pack(otherOrder + "2Q", 3, 2 ** 40)), "Q")) == [3, 2 ** 40]
@@ -0,0 +1,56 @@
+### Tests for recipeServer.py: anything that is not a JSON object gets an error response instead of
+### reaching the session manager, and a session never falls back to prompting on the server's stdin
+from recipeServer import SessionManager, routeHTTP, serveStdio
+from recipeSearch import RecipeCatalog, buildIndex
+from recipeBot import RecipeBot
+import asyncio
+import json
+import io
+import pytest
+
+class EchoManager:
+    # Stands in for a SessionManager, answering every message with itself
+    def __init__(self):
+        self.messages = []
+
+    async def handle(self, message):
+        self.messages.append(message)
+        return {"session": message.get("session"), "echo": message}
+
+@pytest.mark.parametrize("body", [b"[1, 2]", b"\"x\"", b"3", b"null", b"{not json"])
+def testHTTPBodyMustBeAnObject(body):
+    manager = EchoManager()
+    status, response = asyncio.run(routeHTTP(manager, "POST", "/sessions/abc", body))
+    assert status == "400 Bad Request" and "error" in response
+    assert manager.messages == []
+
+def testHTTPObjectReachesTheManager():
+    manager = EchoManager()
+    status, response = asyncio.run(routeHTTP(manager, "POST", "/sessions/abc", b"{\"text\": \"next\"}"))
+    assert status == "200 OK" and manager.messages == [{"session": "abc", "text": "next", "close": False}]
+
+def testEveryStdioLineGetsAnAnswer(monkeypatch, capsys):
+    manager = EchoManager()
+    monkeypatch.setattr("sys.stdin", io.StringIO("[1, 2]\n\"x\"\n3\n{broken\n{\"session\": \"abc\", \"text\": \"next\"}\n"))
+    asyncio.run(serveStdio(manager))
+    responses = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert len(responses) == 5
+    assert sum(1 for response in responses if response.get("error") == "Every line must be a JSON object.") == 4
+    assert manager.messages == [{"session": "abc", "text": "next"}]
+
+def testSessionNeverPromptsOnStdin(tmp_path, monkeypatch):
+    recipesPath = tmp_path / "recipes.jsonl"
+    recipesPath.write_text(json.dumps({"url": "https://example.invalid/soup", "recipeName": "Chicken Soup", "ingredients": ["1 chicken", "2 cups broth"]}) + "\n", encoding = "utf-8")
+    buildIndex(str(recipesPath), str(tmp_path / "recipes.idx"))
+    catalog = RecipeCatalog(str(tmp_path / "recipes.idx"))
+    monkeypatch.setattr(RecipeBot, "recipeCatalog", catalog)
+    monkeypatch.setattr("builtins.input", lambda prompt = "": pytest.fail("the session asked stdin: " + prompt))
+    async def start():
+        manager = SessionManager(workers = 1)
+        return await manager.handle({"url": "chicken soup"}), manager
+    try:
+        response, manager = asyncio.run(start())
+    finally:
+        catalog.close()
+    assert response["done"] and "start from a recipe URL" in response["replies"][-1]
+    assert manager.stats()["live"] == 0
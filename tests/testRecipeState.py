@@ -0,0 +1,36 @@
+### Tests for recipeState.RecipeCache: least recently used first, bounded both by the number of
+### recipes and by the memory they hold
+from recipeState import Recipe, RecipeCache
+
+def recipe(name, steps = 3):
+    return Recipe("https://example.invalid/" + name, {"recipeName": name, "ingredients": ["egg"], "instructions": ["Step " + str(number) for number in range(steps)]})
+
+def testRecipeCacheEvictsTheLeastRecentlyUsed():
+    cache = RecipeCache(maxRecipes = 2)
+    first, second, third = recipe("first"), recipe("second"), recipe("third")
+    cache.put(first)
+    cache.put(second)
+    assert cache.get(first.recipeURL) is first # Now second is the oldest
+    cache.put(third)
+    assert cache.get(second.recipeURL) is None
+    assert cache.get(first.recipeURL) is first and cache.get(third.recipeURL) is third
+    stats = cache.stats()
+    assert (stats["recipes"], stats["evictions"], stats["hits"], stats["misses"]) == (2, 1, 3, 1)
+
+def testRecipeCacheKeepsToItsMemoryBound():
+    small, big = recipe("small"), recipe("big", steps = 2000)
+    cache = RecipeCache(maxRecipes = 10, maxBytes = small.sizeBytes() * 3)
+    for name in ["a", "b", "c", "d"]:
+        cache.put(recipe(name))
+    assert cache.stats()["bytes"] <= cache.maxBytes and cache.stats()["recipes"] < 4
+    assert cache.get("https://example.invalid/d") is not None
+    cache.put(big) # Bigger than the whole cache, so it is not kept and nothing else is lost for it
+    assert cache.get(big.recipeURL) is None and cache.get("https://example.invalid/d") is not None
+
+def testRecipeCacheReplacesTheSameURL():
+    cache = RecipeCache(maxRecipes = 2)
+    cache.put(recipe("same"))
+    replacement = recipe("same", steps = 10)
+    cache.put(replacement)
+    assert cache.stats()["recipes"] == 1 and cache.stats()["bytes"] == replacement.sizeBytes()
+    assert cache.get(replacement.recipeURL) is replacement
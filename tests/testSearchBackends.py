@@ -0,0 +1,49 @@
+### Tests for the search results kept by searchBackends.SearchPrefetcher: least recently used
+### first, expiry, and prefetches skipped while the pool is behind
+from searchBackends import SearchPrefetcher, StubBackend, VIDEO
+import threading
+import time
+
+def testSearchResultsAreBoundedLeastRecentlyUsedFirst():
+    backend = StubBackend("video")
+    prefetcher = SearchPrefetcher({VIDEO: backend}, maxEntries = 2, workers = 1)
+    try:
+        for query in ["whisk", "fold", "whisk", "sear"]:
+            prefetcher.lookup(VIDEO, query)
+        assert backend.calls == 3
+        prefetcher.lookup(VIDEO, "whisk")
+        assert backend.calls == 3 # Used most recently, so fold went instead
+        prefetcher.lookup(VIDEO, "fold")
+        assert backend.calls == 4
+        stats = prefetcher.stats()
+        assert stats["entries"] == 2 and stats["evicted"] == 2 and stats["cached"] == 2
+    finally:
+        prefetcher.close()
+
+def testSearchResultsExpire():
+    backend = StubBackend("video")
+    prefetcher = SearchPrefetcher({VIDEO: backend}, ttl = 0.05)
+    try:
+        prefetcher.lookup(VIDEO, "whisk")
+        time.sleep(0.06)
+        prefetcher.lookup(VIDEO, "whisk")
+        assert backend.calls == 2 and prefetcher.stats()["expired"] == 1
+    finally:
+        prefetcher.close()
+
+def testPrefetchIsSkippedWhileThePoolIsBehind():
+    release = threading.Event()
+    class BlockedBackend:
+        def search(self, query):
+            release.wait(5)
+            return "https://example.invalid/" + query
+    prefetcher = SearchPrefetcher({VIDEO: BlockedBackend()}, workers = 1)
+    try:
+        prefetcher.prefetch(["step " + str(number) for number in range(prefetcher.maxQueued + 5)])
+        stats = prefetcher.stats()
+        assert stats["running"] == prefetcher.maxQueued and stats["skipped"] == 5
+        release.set()
+        assert prefetcher.lookup(VIDEO, "step 0", budget = 5) == "https://example.invalid/step 0"
+    finally:
+        release.set()
+        prefetcher.close()
@@ -0,0 +1,29 @@
+### Tests for termClassifier.py: the tiers are asked cheapest first, and each one, including the
+### two term model tiers on either side of ConceptNet, is counted under its own name
+from termClassifier import TermClassifier, LexiconTier, ModelTier, RemoteTier, FOOD, TOOL, questions
+from httpClient import UpstreamUnavailable
+
+class FixedModel:
+    # Stands in for a TermModel, with a probability per term
+    def __init__(self, probabilities):
+        self.probabilities = probabilities
+
+    def probability(self, question, term):
+        return self.probabilities.get(term, 0.5)
+
+def testModelTiersAreCountedApart():
+    def unreachable(term):
+        raise UpstreamUnavailable("conceptnet is down")
+    model = FixedModel({"quinoa": 0.97, "tofu": 0.7})
+    classifier = TermClassifier([LexiconTier(["egg"], ["chicken broth"], ["whisk"]), ModelTier(model, 0.9), RemoteTier(unreachable), ModelTier(model, 0.5, "termModelFallback")])
+    assert classifier.classify(FOOD, "egg").tier == "lexicon"
+    assert classifier.classify(FOOD, "chicken broth") == (True, "lexicon")
+    assert classifier.classify(FOOD, "quinoa") == (True, "termModel")
+    assert classifier.classify(FOOD, "tofu") == (True, "termModelFallback")
+    assert classifier.classify(TOOL, "tofu") == (True, "termModelFallback")
+    counts = classifier.report()["tiers"]
+    assert counts["termModel"][FOOD] == 1 and counts["termModelFallback"] == {FOOD: 1, "action": 0, TOOL: 1}
+    assert classifier.report()["remoteUnavailable"] == 2
+
+def testOnlyTheQuestionsTheBotAsks():
+    assert questions == [FOOD, "action", TOOL]
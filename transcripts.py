@@ -0,0 +1,88 @@
+### Session transcripts
+### Records what real users type, so loadGenerator.py can replay it later. Every session writes a
+### "start" line with the recipe it picked (the scraped recipe itself, so a replay never has to
+### fetch it again) and then one "turn" line per thing the user typed, as it is typed. Lines from
+### many sessions can be interleaved in one file (the server shares one recorder between all of
+### its sessions), so every line carries its session's id.
+import threading
+import json
+import time
+import uuid
+
+class TranscriptRecorder:
+    ############################################################################
+    # Name: __init__                                                           #
+    # Params: path (JSON lines file to append to)                              #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def __init__(self, path):
+        self.path = path
+        self.transcriptFile = open(path, "a", encoding = "utf-8")
+        self.lock = threading.Lock() # Sessions on different threads share the file
+
+    ############################################################################
+    # Name: _write                                                             #
+    # Params: event (dict to write as one line)                                #
+    # Returns: None                                                            #
+    # Notes: Flushed right away, so a crash loses at most the line in flight.  #
+    ############################################################################
+    def _write(self, event):
+        line = json.dumps(event) + "\n"
+        with self.lock:
+            self.transcriptFile.write(line)
+            self.transcriptFile.flush()
+
+    ############################################################################
+    # Name: start                                                              #
+    # Params: recipeURL, recipeData (what fetchRecipe returned)                #
+    # Returns: The new session's id, for turn()                                #
+    # Notes: None                                                              #
+    ############################################################################
+    def start(self, recipeURL, recipeData):
+        sessionID = uuid.uuid4().hex
+        self._write({"session": sessionID, "event": "start", "at": time.time(), "url": recipeURL, "recipe": recipeData})
+        return sessionID
+
+    ############################################################################
+    # Name: turn                                                               #
+    # Params: sessionID (from start), text (what the user typed), state (what  #
+    # the bot was waiting on, like "step")                                     #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def turn(self, sessionID, text, state):
+        self._write({"session": sessionID, "event": "turn", "at": time.time(), "text": text, "state": state})
+
+    ############################################################################
+    # Name: close                                                              #
+    # Params: None                                                             #
+    # Returns: None                                                            #
+    # Notes: None                                                              #
+    ############################################################################
+    def close(self):
+        with self.lock:
+            self.transcriptFile.close()
+
+############################################################################
+# Name: readTranscripts                                                    #
+# Params: path (a file written by TranscriptRecorder)                      #
+# Returns: A list of {"session", "url", "recipe", "turns"} dicts, in the   #
+# order the sessions started, with "turns" the list of what was typed      #
+# Notes: Turns whose start line is missing (say, from a file that was      #
+# rotated mid-session) are dropped, since there is no recipe to replay     #
+# them against. So are broken lines.                                       #
+############################################################################
+def readTranscripts(path):
+    sessions = dict()
+    with open(path, encoding = "utf-8") as transcriptFile:
+        for line in transcriptFile:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get("event") == "start":
+                sessions[event["session"]] = {"session": event["session"], "url": event["url"], "recipe": event["recipe"], "turns": []}
+            elif event.get("event") == "turn" and event.get("session") in sessions:
+                sessions[event["session"]]["turns"].append(event["text"])
+    return list(sessions.values())